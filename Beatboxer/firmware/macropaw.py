@@ -129,9 +129,10 @@ class MacroPawKeyboard(KMKKeyboard):
     NP5 -> NP6 -> NP7 -> NP8
 
     The MacroPawKeyboard class for the KnH0F creates a NeoPixelBackground
-    object called leds_matrix for the LEDs. (Unlike most of the other
-    MacroPaws, we don't need to use a PixelSlice because the electrical
-    order matches the logical order.)
+    object called allpixels for the LEDs, and a PixelSlice of all of it called
+    leds_matrix. (The electrical order matches the logical order, so the
+    slice doesn't need a mapping; it's there so that writes get the
+    brightness and gamma lookup tables applied, like on the other MacroPaws.)
     """
     def __init__(self):
         super().__init__()
@@ -143,9 +144,12 @@ class MacroPawKeyboard(KMKKeyboard):
                          board.ROW4, board.ROW5, board.ROW6, board.ROW7)
         self.diode_orientation = DiodeOrientation.ROW2COL
 
-        # self.allpixels is the underlying LED array of the hardware.
-        self.leds_matrix = NeoPixelBackground(board.NEOPIXEL, 8, pixel_order="GRB",
-                                              brightness=0.125)
+        # self.allpixels is the underlying LED array of the hardware, with
+        # gamma correction for smoother fades. That dims the middle of the
+        # range, hence brightness 0.1875 rather than 0.125.
+        self.allpixels = NeoPixelBackground(board.NEOPIXEL, 8, pixel_order="GRB",
+                                            brightness=0.1875, gamma=2.2)
+        self.leds_matrix = PixelSlice(self.allpixels, 0, 8)
 
         # self.extensions.append(MediaKeys())
 
@@ -1,32 +1,26 @@
 import sys
 
+import argparse
+import io
 import json
+import os
 import re
+import shutil
+import tempfile
+import time
 
-from pyparsing import ParseResults, nestedExpr
+from concurrent.futures import ProcessPoolExecutor
 
+import layout
+import sexpr
 
-def lisp(x):
-    if isinstance(x, ParseResults):
-        return lisp(list(x))
 
-    if isinstance(x, list):
-        assert(not isinstance(x[0], list))
-        s = "(%s" % x[0]
-
-        for y in x[1:]:
-            s2 = lisp(y)
-
-            if s2[0] == "(":
-                s += "\n" + s2
-            else:
-                s += " " + s2
-
-        s += ")"
-    else:
-        s = str(x)
-
-    return s
+# The Beatboxer's key matrix: SW1 is at the top left, and they go across
+# in rows of COLUMNS, PITCH mm apart.
+SWITCHES = 64
+COLUMNS = 8
+ORIGIN = (60.42, 26.91)
+PITCH = (15, 15)
 
 
 class Size:
@@ -153,7 +147,39 @@ class Property:
 
         return result
 
-class GRText:
+
+class Placed:
+    """
+    Gives anything with a location the x, y, and rotation attributes that
+    layout.py moves parts around with.
+    """
+
+    @property
+    def x(self):
+        return self.location.x
+
+    @x.setter
+    def x(self, value):
+        self.location.x = value
+
+    @property
+    def y(self):
+        return self.location.y
+
+    @y.setter
+    def y(self, value):
+        self.location.y = value
+
+    @property
+    def rotation(self):
+        return self.location.rotation
+
+    @rotation.setter
+    def rotation(self, value):
+        self.location.rotation = value
+
+
+class GRText(Placed):
     def __init__(self, elements):
         self.text = elements[1]
         self.location = None
@@ -182,8 +208,12 @@ class GRText:
 
         return result
 
+    @property
+    def ref(self):
+        return self.text.strip('"')
+
 
-class Footprint:
+class Footprint(Placed):
     def __init__(self, elements):
         self.kind = elements[1]
         self.location = None
@@ -227,6 +257,10 @@ class Footprint:
 
         return s
 
+    @property
+    def ref(self):
+        return self.reference.value.strip('"')
+
     def as_list(self):
         result = ["footprint", self.kind]
 
@@ -248,159 +282,255 @@ class Footprint:
         return result
 
 
-pcbData = open(sys.argv[1]).read()
-pcbFile = nestedExpr().parseString(pcbData)
-pcb = pcbFile[0]
+class Element:
+    """
+    A top-level element of the board. It stays as its span of the source
+    text unless something parses it into an object (the parsed attribute),
+    in which case it gets written back out from that object instead.
+    """
 
-found_kicad = False
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.kind = HEAD.match(source, start).group(1)
+        self.parsed = None
 
-interesting = {}
-uninteresting = []
-elements = []
+    def parse(self):
+        return sexpr.parse(self.source[self.start:self.end])
 
-for el in pcb:
-    if not found_kicad:
-        if el == "kicad_pcb":
-            found_kicad = True
+    def write(self, f):
+        if self.parsed is None:
+            f.write(self.source[self.start:self.end])
         else:
-            raise Exception("Not a KiCad PCB file")
-        continue
+            sexpr.write(f, self.parsed.as_list(), depth=1)
+
+
+# Cheap peeks at an unparsed element: its kind, a footprint's reference, and a
+# gr_text's text. These let us skip parsing anything we won't change.
+HEAD = re.compile(r'\(\s*([^\s()"]+)')
+REFERENCE = re.compile(r'\(property\s+"Reference"\s+("[^"]*")')
+GR_TEXT = re.compile(r'\(gr_text\s+("[^"]*")')
+
+def label_offset(text):
+    """
+    Where a switch's label goes, in X, relative to the switch.
+
+    Yuck. The width of the text is about 0.7mm per character (good, since
+    that's a measured value that lines up with the font size we set below!)
+    and the footprint is about 6.9mm wide. So... do the math for the X
+    placement.
+    """
+    text_width = 0.7 * len(text)
+    space = (6.9 - text_width) / 2
+
+    # This 0.25 is a measured fudge factor.
+    return -1 * (space - 0.25)
+
+
+def set_font_size(effects):
+    effects.font.size.width = 0.7
+    effects.font.size.height = 0.7
 
-    if el[0] == "footprint":
-        key = None
-        fp = Footprint(el)
 
-        match = re.match(r'^"(D\d+)"$', fp.reference.value)
+def label_switch(v, log):
+    set_font_size(v.reference.effects)
 
-        if not match:
-            match = re.match(r'^"(SW\d+)"$', fp.reference.value)
+    v.reference.location.x = label_offset(v.reference.value)
+    v.reference.location.y = -2.79
+    v.reference.location.rotation = 0
+
+    log.write(f"Switch {v.reference.value}: {v.location.x} {v.location.y}\n")
+
+
+def label_diode(v, log):
+    set_font_size(v.reference.effects)
+
+    v.reference.location.x = 2.1775
+    v.reference.location.y = 0.07
+    v.reference.location.rotation = 0
+
+    log.write(f"Diode {v.reference.value}: {v.location.x} {v.location.y}\n")
+
+
+def label_back(v, log):
+    set_font_size(v.effects)
+
+    log.write(f"Back label {v.text}: {v.location.x} {v.location.y}\n")
+
+
+def relayout(pcbData, out, log):
+    """
+    Lay out the key matrix of the board in pcbData, writing the result to
+    out and chatter to log. Returns the number of elements changed.
+    """
+    if not re.match(r'\s*\(kicad_pcb\b', pcbData):
+        raise Exception("Not a KiCad PCB file")
+
+    board = [ Element(pcbData, start, end) for start, end in sexpr.spans(pcbData) ]
+
+    # The footprints (switches and diodes) and back labels we'll move.
+    footprints = layout.RefIndex()
+    labels = layout.RefIndex()
+
+    for el in board:
+        if el.kind == "footprint":
+            key = None
+            m = REFERENCE.search(pcbData, el.start, el.end)
+            reference = m.group(1) if m else None
+
+            match = re.match(r'^"(D\d+)"$', reference or "")
+
+            if not match:
+                match = re.match(r'^"(SW\d+)"$', reference or "")
+
+                if match:
+                    switch_num = int(match.group(1)[2:])
+
+                    if switch_num < 1 or switch_num > SWITCHES:
+                        match = None
 
             if match:
-                switch_num = int(match.group(1)[2:])
+                key = f"FP {match.group(1)}"
+                fp = Footprint(el.parse())
 
-                if switch_num < 1 or switch_num > 64:
-                    match = None
+                log.write(f"Mark {key} at {fp.location.x} {fp.location.y} {fp.location.rotation}\n")
+                footprints.add(fp)
+                el.parsed = fp
+            else:
+                log.write(f"Skip footprint {reference}\n")
+        elif el.kind == "gr_text":
+            key = None
+            m = GR_TEXT.match(pcbData, el.start, el.end)
+            text = m.group(1) if m else None
 
-        if match:
-            key = f"FP {match.group(1)}"
+            match = re.match(r'^"(SW\d+)"$', text or "")
 
-            sys.stderr.write(f"Mark {key} at {fp.location.x} {fp.location.y} {fp.location.rotation}\n")
-            interesting[key] = fp
-        else:
-            sys.stderr.write(f"Skip footprint {fp.reference.value} at {fp.location.x} {fp.location.y} {fp.location.rotation}\n")
+            if match:
+                key = f"GRTXT {match.group(1)}"
 
-            uninteresting.append(fp)
-    elif el[0] == "gr_text":
-        key = None
-        gr_text = GRText(el)
+            if key:
+                gr_text = GRText(el.parse())
 
-        match = re.match(r'^"(SW\d+)"$', gr_text.text)
+                log.write(f"Mark {key} at {gr_text.location.x} {gr_text.location.y} {gr_text.location.rotation}\n")
 
-        if match:
-            key = f"GRTXT {match.group(1)}"
+                labels.add(gr_text)
+                el.parsed = gr_text
+            else:
+                log.write(f"Skip gr_text {text}\n")
 
-        if key:
-            sys.stderr.write(f"Mark {key} at {gr_text.location.x} {gr_text.location.y} {gr_text.location.rotation}\n")
+    # Switches go on the grid; each diode goes just to the right of its
+    # switch, and each back label just above it.
+    switches = footprints.series("SW", 1, SWITCHES)
+    diodes = footprints.series("D")
+    back_labels = labels.series("SW")
 
-            interesting[key] = gr_text
-        else:
-            sys.stderr.write(f"Skip gr_text {gr_text.text} at {gr_text.location.x} {gr_text.location.y} {gr_text.location.rotation}\n")
+    layout.place_grid(switches, COLUMNS, ORIGIN, PITCH)
+    layout.apply(switches, lambda v: label_switch(v, log))
+
+    layout.place_relative(diodes, footprints, "SW", 5.55, 1.6275, rotation=90)
+    layout.apply(diodes, lambda v: label_diode(v, log))
 
-            uninteresting.append(gr_text)
-    else:
-        elements.append(el)
+    layout.place_relative(back_labels, footprints, "SW",
+                          lambda v: label_offset(v.text), -2.78, rotation=0)
+    layout.apply(back_labels, lambda v: label_back(v, log))
 
-for k, v in interesting.items():
-    match = re.match(r'^FP SW(\d+)$', k)
+    # Nothing we placed should be sitting on top of anything else we placed.
+    placed = layout.GridIndex([ part for _, part in switches + diodes ], cell=PITCH[0])
 
-    if match:
-        switchNum = int(match.group(1))
+    for a, b in placed.crowded(1.0):
+        log.write(f"Warning: {a.ref} and {b.ref} overlap at {a.x} {a.y}\n")
 
-        row = (switchNum - 1) // 8
-        col = (switchNum - 1) % 8
+    # Write everything back in its original order, copying the text between
+    # elements (and every element we didn't parse) straight from the source.
+    pos = 0
 
-        x = 60.42 + (15 * col)
-        y = 26.91 + (15 * row)
+    for el in board:
+        out.write(pcbData[pos:el.start])
+        el.write(out)
+        pos = el.end
 
-        v.location.x = x
-        v.location.y = y
+    out.write(pcbData[pos:])
 
-        v.reference.effects.font.size.width = 0.7
-        v.reference.effects.font.size.height = 0.7
+    return sum(1 for el in board if el.parsed is not None)
 
-        # Yuck. The width of the text is about 0.7mm per character (good,
-        # since that's a measured value that lines up with the font.size.width
-        # above!) and the footprint is about 6.9mm wide. So... do the math for
-        # the X placement.
-        text_width = 0.7 * len(v.reference.value)
-        space = (6.9 - text_width) / 2
 
-        # This 0.25 is a measured fudge factor.
-        v.reference.location.x = -1 * (space - 0.25)
-        v.reference.location.y = -2.79
-        v.reference.location.rotation = 0
+def relayout_file(path, suffix, verbose):
+    """
+    Batch worker: lay out path, atomically writing the result to path +
+    suffix (or back over path). Returns (changed, seconds).
+    """
+    start = time.monotonic()
 
-        sys.stderr.write(f"Switch {v.reference.value}: {v.location.x} {v.location.y}\n")
+    with open(path) as f:
+        pcbData = f.read()
 
-for k, v in interesting.items():
-    match = re.match(r'^FP D(\d+)$', k)
+    output = path + suffix
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                               prefix="." + os.path.basename(output) + ".")
 
-    if match:
-        diodeNum = int(match.group(1))
-        switchKey = f'FP SW{diodeNum}'
+    try:
+        with os.fdopen(fd, "w") as out:
+            changed = relayout(pcbData, out, sys.stderr if verbose else io.StringIO())
 
-        switch = interesting[switchKey]
+        shutil.copymode(path, tmp)
+        os.replace(tmp, output)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
-        x = switch.location.x + 5.55
-        y = switch.location.y + 1.6275
+    return changed, time.monotonic() - start
 
-        v.location.x = x
-        v.location.y = y
-        v.location.rotation = 90
 
-        v.reference.effects.font.size.width = 0.7
-        v.reference.effects.font.size.height = 0.7
-        v.reference.location.x = 2.1775
-        v.reference.location.y = 0.07
-        v.reference.location.rotation = 0
+def batch(paths, jobs, suffix, verbose):
+    """
+    Lay out several boards in a pool of processes, then print how long each
+    took and how many elements it changed. Returns the number of failures.
+    """
+    failures = 0
 
-        sys.stderr.write(f"Diode {v.reference.value}: {v.location.x} {v.location.y}\n")
-        continue
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [ (path, pool.submit(relayout_file, path, suffix, verbose)) for path in paths ]
 
-    match = re.match(r'^GRTXT SW(\d+)$', k)
+        sys.stderr.write("\n%-48s %8s %8s\n" % ("File", "Time", "Changed"))
 
-    if match:
-        diodeNum = int(match.group(1))
-        switchKey = f'FP SW{diodeNum}'
+        for path, future in futures:
+            try:
+                changed, elapsed = future.result()
+                sys.stderr.write("%-48s %7.2fs %8d\n" % (path, elapsed, changed))
+            except Exception as e:
+                sys.stderr.write("%-48s FAILED: %s\n" % (path, e))
+                failures += 1
 
-        switch = interesting[switchKey]
+    return failures
 
-        # Yuck. The width of the text is about 0.7mm per character (good,
-        # since that's a measured value that lines up with the font.size.width
-        # above!) and the footprint is about 6.9mm wide. So... do the math for
-        # the X placement.
-        text_width = 0.7 * len(v.text)
-        space = (6.9 - text_width) / 2
 
-        # This 0.25 is a measured fudge factor.
-        v.location.x = switch.location.x - (space - 0.25)
-        v.location.y = switch.location.y - 2.78
-        v.location.rotation = 0
+def main(argv):
+    parser = argparse.ArgumentParser(description="Lay out the Beatboxer key matrix.")
+    parser.add_argument("--batch", action="store_true",
+                        help="rewrite every file given, in a pool of processes, instead "
+                             "of writing one file to stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="maximum concurrent processes with --batch (default: number of cores)")
+    parser.add_argument("--suffix", default="",
+                        help="with --batch, write FILE+SUFFIX instead of replacing FILE")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="with --batch, log every element as usual")
+    parser.add_argument("files", nargs="+", metavar="FILE")
 
-        v.effects.font.size.width = 0.7
-        v.effects.font.size.height = 0.7
+    args = parser.parse_args(argv)
 
-        sys.stderr.write(f"Back label {v.text}: {v.location.x} {v.location.y}\n")
+    if args.batch:
+        return 1 if batch(args.files, max(1, args.jobs), args.suffix, args.verbose) else 0
 
-out = ["kicad_pcb"]
+    if len(args.files) != 1:
+        parser.error("give exactly one FILE, or use --batch")
 
-for el in elements:
-    out.append(el)
+    with open(args.files[0]) as f:
+        relayout(f.read(), sys.stdout, sys.stderr)
 
-for v in interesting.values():
-    out.append(v.as_list())
+    return 0
 
-for v in uninteresting:
-    out.append(v.as_list())
 
-print(lisp(out))
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,188 @@
+import math
+import re
+
+# Helpers for PCB layout scripts like hrm.py: find parts by reference
+# designator, find parts by position, and move whole groups of parts at once.
+#
+# A "part" is anything with these attributes:
+#
+#   ref        the reference designator, unquoted ("SW12", "D3")
+#   x, y       position in mm
+#   rotation   rotation in degrees, or None
+#
+# so the scripts can hand over their own footprint objects (or small adapters
+# for them) without this module knowing anything about KiCad's file format.
+
+REFDES = re.compile(r'^([A-Za-z_#]+)(\d+)$')
+
+
+def split_ref(ref):
+    """
+    Split a reference designator into its prefix and number: "SW12" is
+    ("SW", 12). A designator with no number (or no prefix) comes back as
+    (ref, None).
+    """
+    m = REFDES.match(ref)
+
+    if not m:
+        return ref, None
+
+    return m.group(1), int(m.group(2))
+
+
+class RefIndex:
+    """
+    RefIndex finds parts by reference designator, either one at a time
+    ("SW12") or as a numbered series ("every D, in order").
+    """
+
+    def __init__(self, parts=()):
+        self.by_ref = {}
+        self.by_prefix = {}
+
+        for part in parts:
+            self.add(part)
+
+    def add(self, part):
+        if part.ref in self.by_ref:
+            raise ValueError("Duplicate reference %s" % part.ref)
+
+        self.by_ref[part.ref] = part
+
+        prefix, number = split_ref(part.ref)
+
+        if number is not None:
+            self.by_prefix.setdefault(prefix, {})[number] = part
+
+    def __len__(self):
+        return len(self.by_ref)
+
+    def __contains__(self, ref):
+        return ref in self.by_ref
+
+    def __getitem__(self, ref):
+        return self.by_ref[ref]
+
+    def get(self, ref, default=None):
+        return self.by_ref.get(ref, default)
+
+    def find(self, prefix, number):
+        return self.by_prefix.get(prefix, {}).get(number)
+
+    def series(self, prefix, first=None, last=None):
+        """
+        Return [ (number, part), ... ] for every part with the given prefix
+        and a number in [first, last], in numeric order.
+        """
+        numbered = self.by_prefix.get(prefix, {})
+
+        return [ (n, numbered[n]) for n in sorted(numbered)
+                 if ((first is None) or (n >= first)) and ((last is None) or (n <= last)) ]
+
+
+class GridIndex:
+    """
+    GridIndex buckets parts into square cells by position, so that finding
+    the parts near a point only looks at the cells around it instead of at
+    every part on the board.
+    """
+
+    def __init__(self, parts=(), cell=10.0):
+        self.cell = cell
+        self.cells = {}
+
+        for part in parts:
+            self.add(part)
+
+    def key(self, x, y):
+        return (math.floor(x / self.cell), math.floor(y / self.cell))
+
+    def add(self, part):
+        self.cells.setdefault(self.key(part.x, part.y), []).append(part)
+
+    def near(self, x, y, radius):
+        """
+        Return the parts within radius of (x, y), nearest first.
+        """
+        cx0, cy0 = self.key(x - radius, y - radius)
+        cx1, cy1 = self.key(x + radius, y + radius)
+
+        found = []
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for part in self.cells.get((cx, cy), ()):
+                    d = math.hypot(part.x - x, part.y - y)
+
+                    if d <= radius:
+                        found.append((d, part))
+
+        found.sort(key=lambda dp: dp[0])
+
+        return [ part for _, part in found ]
+
+    def crowded(self, distance):
+        """
+        Yield (a, b) for each pair of parts closer together than distance.
+        """
+        for part in [ p for cell in self.cells.values() for p in cell ]:
+            for other in self.near(part.x, part.y, distance):
+                if (other is not part) and (id(part) < id(other)):
+                    yield part, other
+
+
+def resolve(value, part):
+    """
+    Transform parameters can be constants, or functions of the part being
+    moved (for offsets that depend on, say, the length of a label).
+    """
+    return value(part) if callable(value) else value
+
+
+def place_grid(series, columns, origin, pitch, rotation=None):
+    """
+    Lay out a numbered series (as from RefIndex.series) row by row on a
+    grid: part N lands in row (N-1) // columns, column (N-1) % columns,
+    with part 1 at origin. pitch is the (x, y) spacing between cells.
+    """
+    x0, y0 = origin
+    px, py = pitch
+
+    for n, part in series:
+        row = (n - 1) // columns
+        col = (n - 1) % columns
+
+        part.x = x0 + (px * col)
+        part.y = y0 + (py * row)
+
+        if rotation is not None:
+            part.rotation = resolve(rotation, part)
+
+
+def place_relative(series, anchors, anchor_prefix, dx, dy, rotation=None):
+    """
+    Move each part N of a numbered series to (dx, dy) from the part in
+    anchors (a RefIndex) with the same number and anchor_prefix: for
+    example, put each D<n> next to its SW<n>. Every part must have an
+    anchor.
+    """
+    for n, part in series:
+        anchor = anchors.find(anchor_prefix, n)
+
+        if anchor is None:
+            raise KeyError("%s has no %s%d to be placed relative to" % (part.ref, anchor_prefix, n))
+
+        part.x = anchor.x + resolve(dx, part)
+        part.y = anchor.y + resolve(dy, part)
+
+        if rotation is not None:
+            part.rotation = resolve(rotation, part)
+
+
+def apply(series, transform):
+    """
+    Call transform(part) for every part in a numbered series, for changes
+    that aren't about position.
+    """
+    for _, part in series:
+        transform(part)
@@ -0,0 +1,204 @@
+import re
+
+# A small reader for KiCad's S-expression files (.kicad_pcb, .kicad_sch,
+# etc.).
+#
+# parse() turns the text into nested lists of strings, one list per
+# parenthesized expression. Every atom is kept exactly as it appeared in the
+# source -- quoted strings keep their quotes and any backslash escapes -- so
+# writing the lists back out reproduces the original tokens.
+#
+# It's one pass of a single regex over the text plus an explicit stack, so
+# it runs in linear time and doesn't recurse no matter how deep the file
+# nests.
+#
+# spans() is cheaper still: it finds where each top-level element of a file
+# starts and ends without building anything, so callers can parse only the
+# elements they care about and copy the rest through untouched.
+
+# Every non-whitespace character starts exactly one of these, so finditer()
+# never skips anything but whitespace. The lone '"' at the end only matches
+# a string that never gets closed.
+TOKEN = re.compile(r'[()]|"(?:[^"\\]|\\.)*"|[^\s()"]+|"', re.S)
+
+# The same, minus bare atoms: all spans() needs to see is the parentheses,
+# and the strings that might have parentheses in them.
+STRUCTURE = re.compile(r'[()]|"(?:[^"\\]|\\.)*"|"', re.S)
+
+# When writing, KiCad keeps adding (xy ...) points to a line until it's
+# reached this column.
+XY_COLUMN_LIMIT = 99
+
+
+class SExprError(ValueError):
+    def __init__(self, message, offset):
+        super().__init__("%s at offset %d" % (message, offset))
+        self.offset = offset
+
+
+def tokenize(text):
+    """
+    Yield (offset, token) for each token in text: "(", ")", a quoted string
+    (quotes included), or a bare atom.
+    """
+    for m in TOKEN.finditer(text):
+        tok = m.group()
+
+        if tok == '"':
+            raise SExprError("Unterminated string", m.start())
+
+        yield m.start(), tok
+
+
+def parse_all(text):
+    """
+    Parse every top-level expression in text, returning them as a list.
+    """
+    root = []
+    stack = [ root ]
+    opened = []
+
+    for offset, tok in tokenize(text):
+        if tok == "(":
+            node = []
+            stack[-1].append(node)
+            stack.append(node)
+            opened.append(offset)
+        elif tok == ")":
+            if len(stack) == 1:
+                raise SExprError("Unbalanced ')'", offset)
+
+            stack.pop()
+            opened.pop()
+        else:
+            stack[-1].append(tok)
+
+    if opened:
+        raise SExprError("Unclosed '('", opened[-1])
+
+    return root
+
+
+def parse(text):
+    """
+    Parse the first top-level expression in text (for a KiCad file, the
+    whole file).
+    """
+    exprs = parse_all(text)
+
+    if not exprs or not isinstance(exprs[0], list):
+        raise SExprError("No expression found", 0)
+
+    return exprs[0]
+
+
+def spans(text):
+    """
+    Yield (start, end) offsets of each expression directly inside the first
+    top-level expression of text, without building any of them: text[start:end]
+    is the expression's exact source.
+    """
+    depth = 0
+    start = None
+
+    for m in STRUCTURE.finditer(text):
+        tok = m.group()
+
+        if tok == "(":
+            depth += 1
+
+            if depth == 2:
+                start = m.start()
+        elif tok == ")":
+            if depth == 0:
+                raise SExprError("Unbalanced ')'", m.start())
+
+            if depth == 2:
+                yield start, m.end()
+
+            depth -= 1
+
+            if depth == 0:
+                return
+        elif tok == '"':
+            raise SExprError("Unterminated string", m.start())
+
+    if depth == 0:
+        raise SExprError("No expression found", 0)
+
+    raise SExprError("Unclosed '('", start if depth > 1 else 0)
+
+
+def chunks(expr, depth=0):
+    """
+    Yield the text of expr in pieces, laid out the way KiCad does it: a list
+    of nothing but atoms goes on one line, and each sublist goes on its own
+    line, one tab deeper than its parent, with the parent's closing
+    parenthesis on a line of its own. The exception is runs of (xy ...)
+    points, which share a line until it gets past XY_COLUMN_LIMIT. depth is
+    the nesting level expr itself is at; the first line isn't indented,
+    since whatever comes before it is expected to have done that.
+
+    Atoms that aren't strings (numbers, say) are written with str(). This
+    is iterative, so it doesn't care how deep expr is.
+    """
+    yield "("
+
+    # KiCad counts a tab as one column here.
+    column = depth + 1
+
+    # Each frame is [list, next index, depth, has sublists].
+    stack = [ [ expr, 0, depth, False ] ]
+
+    while stack:
+        frame = stack[-1]
+        node, i, level, multiline = frame
+
+        if i == len(node):
+            stack.pop()
+
+            if multiline:
+                column = level + 1
+                yield "\n" + ("\t" * level) + ")"
+            else:
+                column += 1
+                yield ")"
+
+            continue
+
+        frame[1] = i + 1
+        child = node[i]
+
+        if isinstance(child, list):
+            frame[3] = True
+
+            if (child and (child[0] == "xy") and (column < XY_COLUMN_LIMIT) and
+                isinstance(node[i - 1], list) and node[i - 1] and (node[i - 1][0] == "xy")):
+                column += 2
+                yield " ("
+            else:
+                column = level + 2
+                yield "\n" + ("\t" * (level + 1)) + "("
+
+            stack.append([ child, 0, level + 1, False ])
+            continue
+
+        atom = str(child)
+
+        if i == 0:
+            column += len(atom)
+            yield atom
+        elif multiline:
+            column = level + 1 + len(atom)
+            yield "\n" + ("\t" * (level + 1)) + atom
+        else:
+            column += 1 + len(atom)
+            yield " " + atom
+
+
+def write(f, expr, depth=0):
+    """
+    Write expr to the file f, as laid out by chunks().
+    """
+    for chunk in chunks(expr, depth):
+        f.write(chunk)
@@ -59,7 +59,9 @@ class Layers(_Layers):
 
 
 def setup_macropaw(debug, kbd):
-    ring_color = (0, 0, 64) if debug.enabled else (0, 64, 0)
+    # 112 rather than 64: with gamma correction, that comes out as bright as
+    # 64 used to.
+    ring_color = (0, 0, 112) if debug.enabled else (0, 112, 0)
     kbd.setup_animation(ring_color=ring_color,
                         animation_mode=AnimationModes.USER,
                         hue_default=128,
@@ -25,6 +25,7 @@ import supervisor
 
 from adafruit_neopixelbackground import NeoPixelBackground
 from pixelslice import PixelSlice
+from pixelflusher import PixelFlusher
 
 from macropawrgb import MacroPawRGB
 from ringrgb import RingRGB
@@ -139,7 +140,8 @@ class MacroPawKeyboard(KMKKeyboard):
     column-major ordering. This is because it makes the PCB layout much simpler.
     To cope with this, the MacroPawKeyboard class creates PixelSlices called
     leds_ring1 for the ring around Rotary1, leds_ring2 for the ring around Rotary2,
-    and leds_matrix for a column-major slice of the matrix LEDs.
+    and leds_matrix for a column-major slice of the matrix LEDs. leds_matrix is
+    dithered, so that the matrix animations fade smoothly at low brightness.
 
     If necessary, allpixels is the master Neopixel array. It's unlikely that this
     will be useful, though.
@@ -152,8 +154,12 @@ class MacroPawKeyboard(KMKKeyboard):
         self.row_pins = (board.ROW0, board.ROW1, board.ROW2, board.ROW3, board.ROW4)
         self.diode_orientation = DiodeOrientation.ROW2COL
 
-        # self.allpixels is the underlying LED array of the hardware.
-        self.allpixels = NeoPixelBackground(board.NEOPIXEL, 30, pixel_order="GRB", brightness=0.125)
+        # self.allpixels is the underlying LED array of the hardware. Gamma
+        # correction darkens everything below full scale, so brightness goes
+        # up from the old 0.125 to keep the breathing animations (which run
+        # from 64 to 255) putting out about as much light as they used to.
+        self.allpixels = NeoPixelBackground(board.NEOPIXEL, 30, pixel_order="GRB", brightness=0.1875,
+                                            double_buffer=True, gamma=2.2)
 
         # The ordering of the LEDs in self.allpixels isn't really all that
         # useful, so we slice it up in a few different ways. First, the two
@@ -167,7 +173,8 @@ class MacroPawKeyboard(KMKKeyboard):
                                                 1, 6, 11,
                                                 2, 7, 12,
                                                 3, 8, 13,
-                                                4, 9 ])
+                                                4, 9 ],
+                                      dither=True)
 
         self.extensions.append(MediaKeys())
 
@@ -237,9 +244,13 @@ class MacroPawKeyboard(KMKKeyboard):
             flashcolor = (64, 0, 0)
             print(f"Map switch to {keymap} failed: {msg}")
 
+        # These frames have to go out now, not whenever the LEDs are next
+        # free, hence wait=True.
         self.rgb_matrix.set_rgb_fill((0, 0, 0))
+        self.allpixels.flush(wait=True)
         time.sleep(0.25)
         self.rgb_matrix.set_rgb_fill(flashcolor)
+        self.allpixels.flush(wait=True)
         time.sleep(0.25)
 
         if status:
@@ -251,6 +262,14 @@ class MacroPawKeyboard(KMKKeyboard):
         self.SwitchToQWERTY = internal_key("SW_QWERTY", on_press=self.switch_to_QWERTY)
 
     def setup_animation(self, ring_color, **kwargs):
+        # Three RGB extensions share allpixels, and each of them calls show()
+        # every time it draws. Rather than have allpixels continuously
+        # resending its buffer, or send it once per show(), defer its show()s
+        # and let the PixelFlusher (which has to come after all three of
+        # them) send one frame per trip around the main loop.
+        self.allpixels.auto_write = False
+        self.allpixels.deferred = True
+
         self.rgb_ring1 = RingRGB(name="RING1", pixels=self.leds_ring1)
         self.rgb_ring1.set_rgb_fill(ring_color)
 
@@ -264,11 +283,13 @@ class MacroPawKeyboard(KMKKeyboard):
                                       **kwargs)
         self.rgb_matrix.set_rgb_fill(ring_color)
 
+        self.allpixels.flush(wait=True)
         time.sleep(0.25)
 
         self.extensions.append(self.rgb_matrix)
         self.extensions.append(self.rgb_ring1)
         self.extensions.append(self.rgb_ring2)
+        self.extensions.append(PixelFlusher(self.allpixels))
 
         self.KeyAnimationCycle = internal_key("NextAnim",
                                             on_press=self.rgb_matrix.next_animation)
@@ -136,11 +136,13 @@ class RingRGB(MacroPawRGB):
 
                 for i in range(3):
                     if (p >= 0) and (p < self.num_pixels):
+                        # Overlapping elements add up, but the pixels
+                        # (and their lookup tables) only go to 255.
                         prev = frame[p]
                         updated = [
-                            prev[0] + (element.color[0] >> i),
-                            prev[1] + (element.color[1] >> i),
-                            prev[2] + (element.color[2] >> i)
+                            min(prev[0] + (element.color[0] >> i), 255),
+                            min(prev[1] + (element.color[1] >> i), 255),
+                            min(prev[2] + (element.color[2] >> i), 255)
                         ]
 
                         # if debug.enabled:
@@ -163,8 +165,7 @@ class RingRGB(MacroPawRGB):
         # if debug.enabled:
         #     debug(f"frame: {frame}")
 
-        for i, updated in enumerate(frame):
-            self.set_rgb(updated, i)
+        self.write_frame(frame)
 
         self._elements = still_active
         self.disable_auto_write = False
@@ -97,5 +97,10 @@ class HardwareTestRunner:
 
 
 def setup_hardware_test(debug, keyboard):
+    # The test colors are meant to be seen as-is -- gamma correction would
+    # all but black out the dim (16, 16, 16) -- so the test turns gamma
+    # off, and runs at the old linear brightness.
+    keyboard.allpixels.set_lut(0.125, gamma=1.0)
+
     runner = HardwareTestRunner(keyboard, FirstBoot())
     runner.go()
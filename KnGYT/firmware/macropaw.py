@@ -133,9 +133,11 @@ class MacroPawKeyboard(KMKKeyboard):
         self.row_pins = (board.ROW0, board.ROW1)
         self.diode_orientation = DiodeOrientation.ROW2COL
 
-        # self.allpixels is the underlying LED array of the hardware.
+        # self.allpixels is the underlying LED array of the hardware, with
+        # gamma correction for smoother fades. That dims the middle of the
+        # range, hence brightness 0.1875 rather than 0.125.
         self.allpixels = NeoPixelBackground(board.NEOPIXEL, 10, pixel_order="GRB",
-                                            brightness=0.125)
+                                            brightness=0.1875, gamma=2.2)
 
         # The ordering of the LEDs in self.allpixels isn't really all that
         # useful, so we create self.leds_matrix with a better ordering.
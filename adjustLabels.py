@@ -2,13 +2,74 @@
 
 import sys
 
+import argparse
+import os
 import re
+import shutil
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
 
 reAt = re.compile(r'^\(at (\d+(\.\d+)?) (\d+(\.\d+)?)( ([-+]?\d+(\.\d+)?))?\)$')
 reText = re.compile(r'^\(fp_text ([^ ]+) \"([^"]+)\" \(at ([-+]?\d+(\.\d+)?) ([-+]?\d+(\.\d+)?)( ([-+]?\d+(\.\d+)?))?\) \(layer \"([^"]+)\"\)( hide)?$')
 reIndent = re.compile(r'^\s+')
-reDiode = re.compile(r'^D\d+$')
-reCap = re.compile(r'^C\d+$')
+rePrefix = re.compile(r'^([A-Za-z_]+)\d')
+
+# Label rules, by reference designator prefix. Each rule says what to change
+# about one kind of fp_text in a footprint with that prefix:
+#
+#   "reference"   the reference designator
+#   "value"       the value
+#   "user"        user text, other than ${REFERENCE}
+#   "user-ref"    user text that's ${REFERENCE} (usually the copy on the back)
+#
+# Only the DEFAULT_RULES prefixes get applied unless --rules says otherwise.
+
+RULES = {
+    "NP": {
+        "reference": dict(layer="F.SilkS", x=-1.65, y=-1.05),
+        "value":     dict(layer="F.SilkS", x=1.25, y=-1.05, hide=False),
+        "user":      dict(layer="F.SilkS", x=-2.25, y=0.7),
+    },
+    "SW": {
+        "reference": dict(layer="F.SilkS", x=-6.775, y=-7.45),
+        "value":     dict(hide=True),
+        "user-ref":  dict(layer="B.SilkS", x=3.8618, y=-7.3312, mirror=True),
+    },
+    "TP": {
+        "reference": dict(layer="F.SilkS", x=0, y=-2.0875),
+        "value":     dict(hide=True),
+        "user-ref":  dict(layer="B.SilkS", x=0, y=-2.0875, mirror=True),
+    },
+    "D": {
+        "reference": dict(layer="F.SilkS", x=1.79, y=0.72, rot=180.0),
+        "value":     dict(layer="F.SilkS", x=-1.86, y=0.27, rot=180.0),
+    },
+    "C": {
+        "reference": dict(layer="F.SilkS", x=-0.6158, y=-0.6396),
+        "value":     dict(layer="F.SilkS", x=0.4764, y=-0.6396),
+    },
+}
+
+DEFAULT_RULES = ("NP",)
+
+
+def compile_rules(prefixes):
+    """
+    Boil RULES down to just the prefixes we're applying, with each rule's
+    changes as a tuple of (attribute, value) pairs ready to set.
+    """
+    compiled = {}
+
+    for prefix in prefixes:
+        if prefix not in RULES:
+            raise ValueError(f"No rules for prefix {prefix} (choose from {', '.join(RULES)})")
+
+        compiled[prefix] = { kind: tuple(changes.items()) for kind, changes in RULES[prefix].items() }
+
+    return compiled
+
 
 class Text:
     def __init__(self, idx, groups):
@@ -24,6 +85,13 @@ class Text:
         self.hide = True if hide else False
         self.mirror = False
 
+    @property
+    def kind(self):
+        if self.name == "user":
+            return "user-ref" if self.value == "${REFERENCE}" else "user"
+
+        return self.name
+
     def line(self, indent):
         rstr = f' {self.rot}' if (self.rot != 0.0) else ''
         hstr = ' hide' if self.hide else ''
@@ -59,12 +127,13 @@ class Footprint:
         if t.name == 'reference':
             self.name = t.value
 
-        if self.name == 'NP24':
-            sys.stderr.write(f"-- ADD {t.name} {t.value}\n")
-
+    @property
+    def prefix(self):
+        m = rePrefix.match(self.name) if self.name else None
+        return m.group(1) if m else None
 
-    def fixText(self, t, **args):
-        for k, v in args.items():
+    def fixText(self, t, changes):
+        for k, v in changes:
             setattr(t, k, v)
 
         m = reIndent.match(self.lines[t.idx])
@@ -72,59 +141,21 @@ class Footprint:
 
         self.lines[t.idx] = t.line(indent)
 
-    def rectify(self):
-        if self.name and self.name.startswith('NP'):
-            # print(f"RECTIFY {self.name}")
-
-            for t in self.text:
-                if self.name == "NP24":
-                    sys.stderr.write(f"-- RECTIFY {t.name} {t.value}\n")
-                if t.name == "reference":
-                    self.fixText(t, layer="F.SilkS", x=-1.65, y=-1.05)
-                elif t.name == "value":
-                    self.fixText(t, layer="F.SilkS", x=1.25,  y=-1.05, hide=False)
-                elif (t.name == "user") and (t.value != "${REFERENCE}"):
-                    self.fixText(t, layer="F.SilkS", x=-2.25,  y=0.7)
-
-        # if self.name.startswith('SW'):
-        #     # print(f"RECTIFY {self.name}")
-
-        #     for t in self.text:
-        #         if t.name == "reference":
-        #             self.fixText(t, layer="F.SilkS", x=-6.775, y=-7.45)
-        #         elif t.name == "value":
-        #             self.fixText(t, hide=True)
-        #         elif (t.name == "user") and (t.value == "${REFERENCE}"):
-        #             self.fixText(t, layer="B.SilkS", x=3.8618,  y=-7.3312, mirror=True)
-
-        # if self.name.startswith('TP'):
-        #     # print(f"RECTIFY {self.name}")
-
-        #     for t in self.text:
-        #         if t.name == "reference":
-        #             self.fixText(t, layer="F.SilkS", x=0, y=-2.0875)
-        #         elif t.name == "value":
-        #             self.fixText(t, hide=True)
-        #         elif (t.name == "user") and (t.value == "${REFERENCE}"):
-        #             self.fixText(t, layer="B.SilkS", x=0,  y=-2.0875, mirror=True)
-
-        # if self.name and reDiode.match(self.name):
-        #     # print(f"RECTIFY {self.name}")
-
-        #     for t in self.text:
-        #         if t.name == "reference":
-        #             self.fixText(t, layer="F.SilkS", x=1.79, y=0.72, rot=180.0)
-        #         elif t.name == "value":
-        #             self.fixText(t, layer="F.SilkS", x=-1.86, y=0.27, rot=180.0)
-
-        # if self.name and reCap.match(self.name):
-        #     # print(f"RECTIFY {self.name}")
-
-        #     for t in self.text:
-        #         if t.name == "reference":
-        #             self.fixText(t, layer="F.SilkS", x=-0.6158, y=-0.6396)
-        #         elif t.name == "value":
-        #             self.fixText(t, layer="F.SilkS", x=0.4764, y=-0.6396)
+    def rectify(self, rules):
+        """
+        Apply rules (a table of rules for this footprint's prefix) to its
+        text, returning how many texts were changed.
+        """
+        changed = 0
+
+        for t in self.text:
+            changes = rules.get(t.kind)
+
+            if changes:
+                self.fixText(t, changes)
+                changed += 1
+
+        return changed
 
     def __str__(self) -> str:
         s = f"footprint {self.name} @ {self.x} {self.y} {self.rot}\n"
@@ -134,49 +165,155 @@ class Footprint:
 
         return s
 
-    def dump(self):
-        for l in self.lines:
-            sys.stdout.write(l)
+    def dump(self, out):
+        out.writelines(self.lines)
+
+
+def adjust(infile, out, rules):
+    """
+    Copy a KiCad 7 .kicad_pcb from infile to out in one pass, applying the
+    compiled rules to the labels of each footprint. A footprint runs from
+    its "(footprint" line to the next blank line; as soon as we know its
+    reference designator, one with no rules for its prefix just gets copied
+    through. Returns the number of labels changed.
+    """
+    state = 0
+    cur = None
+    changed = 0
+
+    for line in infile:
+        if state == 0:
+            # Outside any footprint: copy everything until the next one.
+            if line.lstrip().startswith("(footprint"):
+                cur = Footprint(line)
+                state = 1
+                continue
+
+            out.write(line)
+            continue
 
+        if not line.strip():
+            # End of the footprint.
+            if cur:
+                changed += cur.rectify(rules.get(cur.prefix, {}))
+                cur.dump(out)
+                cur = None
 
-state = 0
-cur = None
+            out.write(line)
+            state = 0
+            continue
 
-for line in sys.stdin:
-    if state == 0:
-        if line.strip().startswith("(footprint"):
-            # Make a new footprint starting with this line...
-            cur = Footprint(line)
-            
-            # ...then go to state 1.
-            state = 1
+        if state == 2:
+            # A footprint we're not changing.
+            out.write(line)
             continue
 
-        # Nothing special. Dump the line.
-        sys.stdout.write(line)
-        continue
+        # Only lines that look like they might match get near the regexes.
+        s = line.strip()
 
-    elif state == 1:
-        if not line.strip():
-            # print(cur)
-            cur.rectify()
-            cur.dump()
-            cur = None
-            state = 0
+        if s.startswith("(at "):
+            m = reAt.match(s)
 
-        m = reAt.match(line.strip())
+            if m:
+                cur.locate(line, m.groups())
+                continue
+        elif s.startswith("(fp_text "):
+            m = reText.match(s)
 
-        if m:
-            cur.locate(line, m.groups())
-            continue
+            if m:
+                cur.addText(line, m.groups())
 
-        m = reText.match(line.strip())
+                if cur.name and (cur.prefix not in rules):
+                    cur.dump(out)
+                    cur = None
+                    state = 2
+
+                continue
+
+        cur.addLine(line)
+
+    # A footprint at the very end of the file, with no blank line after it.
+    if cur:
+        changed += cur.rectify(rules.get(cur.prefix, {}))
+        cur.dump(out)
+
+    return changed
+
+
+def adjust_file(path, rules, suffix):
+    """
+    Batch worker: adjust path, atomically writing the result to path +
+    suffix (or back over path). Returns (changed, seconds).
+    """
+    start = time.monotonic()
+
+    output = path + suffix
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                               prefix="." + os.path.basename(output) + ".")
+
+    try:
+        with open(path) as infile, os.fdopen(fd, "w") as out:
+            changed = adjust(infile, out, rules)
+
+        shutil.copymode(path, tmp)
+        os.replace(tmp, output)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return changed, time.monotonic() - start
+
+
+def batch(paths, rules, jobs, suffix):
+    """
+    Adjust several boards in a pool of processes, then print how long each
+    took and how many labels it changed. Returns the number of failures.
+    """
+    failures = 0
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [ (path, pool.submit(adjust_file, path, rules, suffix)) for path in paths ]
+
+        sys.stderr.write("%-48s %8s %8s\n" % ("File", "Time", "Changed"))
+
+        for path, future in futures:
+            try:
+                changed, elapsed = future.result()
+                sys.stderr.write("%-48s %7.2fs %8d\n" % (path, elapsed, changed))
+            except Exception as e:
+                sys.stderr.write("%-48s FAILED: %s\n" % (path, e))
+                failures += 1
+
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Move the silkscreen labels of footprints in KiCad 7 PCBs: stdin to "
+                    "stdout, or every FILE in place.")
+    parser.add_argument("--rules", default=",".join(DEFAULT_RULES),
+                        help="comma-separated designator prefixes to apply rules for "
+                             "(default: %(default)s; available: " + ", ".join(RULES) + ")")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="maximum concurrent processes for FILEs (default: number of cores)")
+    parser.add_argument("--suffix", default="",
+                        help="write FILE+SUFFIX instead of replacing FILE")
+    parser.add_argument("files", nargs="*", metavar="FILE")
+
+    args = parser.parse_args(argv)
+
+    try:
+        rules = compile_rules([ p.strip() for p in args.rules.split(",") if p.strip() ])
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.files:
+        return 1 if batch(args.files, rules, max(1, args.jobs), args.suffix) else 0
+
+    adjust(sys.stdin, sys.stdout, rules)
+
+    return 0
 
-        if m:
-            cur.addText(line, m.groups())
-            continue
 
-        if cur:
-            cur.addLine(line)
-        else:
-            sys.stdout.write(line)
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -209,7 +209,7 @@ class BootManager:
         self.color = [0, 0, 0]
         self.show()
 
-        self.bootpixel._sm.deinit()
+        self.bootpixel.deinit()
 
     def _manage_semaphore(self, name: str, value: bool):
         """
@@ -17,7 +17,14 @@ rate of your LEDs or do more complicated processing.
 
 Because the pixelbuf storage is also being written out 'live', it is possible
 (even with auto-show 'false') to experience tearing, where the LEDs are a
-combination of old and new values at the same time.
+combination of old and new values at the same time. Passing
+``double_buffer=True`` avoids that when `auto_write` is false: ``show()``
+copies the pixelbuf storage into one of two front buffers and writes that
+out instead, and `frame_done` says when the LEDs have the last frame.
+
+Passing ``gamma`` moves brightness (and gamma correction) out of the
+pixelbuf and into `luts`, one 256-entry table per channel, for writers like
+`PixelSlice` to apply as they pack colors.
 
 The demonstration code, under ``if __name__ == '__main__':`` is intended
 for the Adafruit MacroPad, with 12 NeoPixel LEDs. It shows a cycling rainbow
@@ -25,6 +32,7 @@ pattern across all the LEDs.
 """
 
 import struct
+from array import array
 import adafruit_pixelbuf
 from rp2pio import StateMachine
 from adafruit_pioasm import Program
@@ -39,6 +47,11 @@ RGBW = "RGBW"
 GRBW = "GRBW"
 """Green Red Blue White"""
 
+# The state machine is fed 32-bit words. On CircuitPython "L" and "I" are both
+# 32 bits, but "L" is 64 bits on most desktop Pythons, and the host simulator
+# in tools/hostsim needs the same words we'd send on the device.
+_WORD = "I"
+
 # NeoPixels are 800khz bit streams. We are choosing zeros as <312ns hi, 936 lo>
 # and ones as <700 ns hi, 556 ns lo>.
 _program = Program(
@@ -68,11 +81,24 @@ wait_reset:
 )
 
 
+_pixelbuf_show = adafruit_pixelbuf.PixelBuf.show
+
+
 class NeoPixelBackground(  # pylint: disable=too-few-public-methods
     adafruit_pixelbuf.PixelBuf
 ):
     def __init__(
-        self, pin, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None
+        self,
+        pin,
+        n,
+        *,
+        bpp=3,
+        brightness=1.0,
+        auto_write=True,
+        pixel_order=None,
+        deferred=False,
+        double_buffer=False,
+        gamma=None,
     ):
         if not pixel_order:
             pixel_order = GRB if bpp == 3 else GRBW
@@ -99,6 +125,70 @@ class NeoPixelBackground(  # pylint: disable=too-few-public-methods
         )
 
         self._first = True
+
+        # With deferred set, show() just notes that a frame is wanted and
+        # flush() sends it, so any number of show()s between two flush()es
+        # (from several PixelSlices, say) cost one transfer -- and none at
+        # all if nobody asked.
+        self.deferred = deferred
+        self._pending = False
+
+        # Dithering PixelSlices register themselves here, and flush()
+        # renders them just before it sends a frame: once per frame that
+        # actually goes out, however many times they were shown, so that
+        # their error carries from one sent frame to the next.
+        self.dithering = []
+
+        # The pixelbuf hands _transmit the same buffer every time (header,
+        # pixels, trailer), so we make its word-cast memoryview, and a view
+        # of just its pixels, the first time we see it and reuse them after
+        # that. _whole is a ready-made [:] so that copying between buffers
+        # doesn't need a new slice object either. Between them, sending a
+        # frame doesn't allocate anything.
+        self._data_start = len(header)
+        self._data_end = len(header) + byte_count
+        self._buf = None
+        self._buf_words = None
+        self._buf_data = None
+        self._whole = slice(None)
+
+        # With double_buffer set, show() copies the frame into whichever of
+        # these front buffers isn't the last one handed to the state machine,
+        # so the DMA only ever reads a frame nobody is drawing into. They're
+        # allocated once, here, with the header and trailer already in
+        # place, so a swap only has to copy the pixels.
+        self._fronts = None
+        self._front = 0
+
+        if double_buffer:
+            fronts = []
+
+            for _ in range(2):
+                front = bytearray(header + bytes(byte_count) + trailer)
+                fronts.append((
+                    memoryview(front).cast(_WORD),
+                    memoryview(front)[self._data_start:self._data_end],
+                ))
+
+            self._fronts = tuple(fronts)
+
+        # With gamma set, the pixelbuf runs at full brightness, and luts[c]
+        # maps a value for channel c (in r, g, b, w order) to what should
+        # actually go out, brightness and gamma included. PixelSlice applies
+        # them; anything writing to us directly gets full brightness.
+        # fine_luts are the same tables in 8.8 fixed point, keeping the
+        # fraction that luts round away, for PixelSlice's dithering. Setting
+        # brightness rebuilds them (with the same gamma).
+        self.luts = None
+        self.fine_luts = None
+        self._brightness = min(max(brightness, 0.0), 1.0)
+        self._gamma = gamma
+
+        if gamma is not None:
+            self.luts = tuple(bytearray(256) for _ in range(bpp))
+            self.fine_luts = tuple(array("H", bytes(512)) for _ in range(bpp))
+            brightness = 1.0
+
         super().__init__(
             n,
             brightness=brightness,
@@ -108,10 +198,50 @@ class NeoPixelBackground(  # pylint: disable=too-few-public-methods
             trailer=trailer,
         )
 
+        if self.luts is not None:
+            self.set_lut(self._brightness)
+
         self._auto_write = False
         self._auto_writing = False
         self.auto_write = auto_write
 
+    def set_lut(self, brightness, gamma=None):
+        """Rebuild `luts` and `fine_luts` (in place) for a new brightness and
+        gamma (by default, the gamma we already have). gamma can be one
+        exponent for every channel or a tuple of one per channel. Pixels
+        already written keep their old values until they're redrawn.
+        """
+        if self.luts is None:
+            raise ValueError("No lookup tables to rebuild: set gamma when creating the NeoPixelBackground")
+
+        if gamma is None:
+            gamma = self._gamma
+
+        self._brightness = min(max(brightness, 0.0), 1.0)
+        self._gamma = gamma
+
+        brightness = self._brightness
+        gammas = gamma if isinstance(gamma, tuple) else (gamma,) * len(self.luts)
+
+        for lut, fine, g in zip(self.luts, self.fine_luts, gammas):
+            for i in range(256):
+                fine[i] = int((255 * 256 * brightness * ((i / 255) ** g)) + 0.5)
+                lut[i] = (fine[i] + 128) >> 8
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        # With lookup tables, the pixelbuf itself stays at full brightness
+        # and the tables do the scaling, so that's what has to change.
+        # Without them, the brightness given to the constructor is it.
+        if self.luts is None:
+            raise ValueError("Brightness can only be changed with lookup tables: set gamma when creating the NeoPixelBackground")
+
+        self.set_lut(value)
+
     @property
     def auto_write(self):
         return self._auto_write
@@ -123,15 +253,93 @@ class NeoPixelBackground(  # pylint: disable=too-few-public-methods
             self._sm.background_write()
             self._auto_writing = False
         elif value:
-            self.show()
+            super().show()
+
+    # show() and flush() call PixelBuf's show() by name rather than through
+    # super(): it's the same thing, but some Pythons (CPython before 3.12)
+    # allocate an object for every super() call, and these run every frame.
+    def show(self):
+        if self.deferred:
+            self._pending = True
+        else:
+            _pixelbuf_show(self)
+
+    def flush(self, wait=False):
+        """Send the frame asked for by show() since the last flush(), if any,
+        rendering any dithering views into it first (which may mean there's
+        a frame to send even if nobody asked).
+
+        If the state machine already has a frame queued behind the one it's
+        sending, the new frame waits for the next flush() rather than for
+        the LEDs -- unless wait is set, in which case we wait for the queue
+        to clear, so that the frame definitely goes out now.
+        """
+        if wait:
+            while self._sm.pending_write:
+                pass
+
+        if self._sm.pending_write:
+            return
+
+        if self.dithering:
+            for view in self.dithering:
+                if view.render():
+                    self._pending = True
+
+        if self._pending:
+            self._pending = False
+            _pixelbuf_show(self)
+
+    @property
+    def pending_write(self):
+        """True while a frame is queued behind the one being sent, so that
+        flush() can't send another one yet."""
+        return self._sm.pending_write
+
+    def deinit(self):
+        """Stop sending (letting the current frame finish) and release the
+        state machine."""
+        if self._auto_writing:
+            self._sm.background_write()
+            self._auto_writing = False
+
+        while self._sm.writing:
+            pass
+
+        self._sm.deinit()
+
+    @property
+    def frame_done(self):
+        """True once the state machine has finished sending every frame
+        it's been given (never, with `auto_write` on)."""
+        return not self._sm.writing
+
+    def _views(self, buf):
+        if buf is not self._buf:
+            self._buf = buf
+            self._buf_words = memoryview(buf).cast(_WORD)
+            self._buf_data = memoryview(buf)[self._data_start:self._data_end]
 
     def _transmit(self, buf):
+        self._views(buf)
+
         if self._auto_write:
             if not self._auto_writing:
-                self._sm.background_write(loop=memoryview(buf).cast("L"), swap=True)
+                self._sm.background_write(loop=self._buf_words, swap=True)
                 self._auto_writing = True
+        elif self._fronts is not None:
+            # The last front we handed over is either being sent or queued,
+            # so draw into the other one -- but if something is queued, the
+            # other one is the one being sent, so wait for it to finish.
+            while self._sm.pending_write:
+                pass
+
+            self._front ^= 1
+            words, data = self._fronts[self._front]
+            data[self._whole] = self._buf_data
+            self._sm.background_write(words, swap=True)
         else:
-            self._sm.background_write(memoryview(buf).cast("L"), swap=True)
+            self._sm.background_write(self._buf_words, swap=True)
 
 
 if __name__ == "__main__":
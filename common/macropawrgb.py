@@ -82,6 +82,10 @@ class MacroPawRGB(RGB):
         self.animation_timer = SimpleTimer()
         self.rescale_timer = SimpleTimer()
 
+        # While _capture is a list, set_rgb stores colors in it instead of
+        # writing them to the pixels; see effect_breathmap.
+        self._capture = None
+
     def during_bootup(self, sandbox):
         super().during_bootup(sandbox)
 
@@ -91,6 +95,9 @@ class MacroPawRGB(RGB):
         self.refresh_count = 0
         self.rescale_count = 0
 
+        # One frame's worth of colors, reused for every frame.
+        self.frame = [ (0, 0, 0) ] * self.num_pixels
+
         # This is partly ripped off from KMK's effect_breathing (which seems
         # to have been at least partly inspired by the stuff in
         # https://thingpulse.com/breathing-leds-cracking-the-algorithm-behind-our-breathing-pattern/,
@@ -177,21 +184,57 @@ class MacroPawRGB(RGB):
             # else:
             #     print(f"MPRGB: {key} not in coord_mapping, not updating usage")
 
+    def set_rgb(self, rgb, index):
+        if self._capture is not None:
+            self._capture[index] = rgb
+        else:
+            super().set_rgb(rgb, index)
+
+    def write_frame(self, frame):
+        """
+        Write a whole frame of colors at once, frame[i] being the color for
+        pixel i. Pixel objects with a bulk write_frame (like PixelSlice) get
+        their share of the frame in one call; anything else gets it in one
+        slice assignment. Either way, there's no per-pixel trip through
+        set_rgb, and nothing is shown until you call show().
+        """
+        start = 0
+
+        for pixels in self.pixels:
+            count = len(pixels)
+            chunk = frame if (start == 0 and count == len(frame)) else frame[start:start + count]
+
+            if hasattr(pixels, "write_frame"):
+                pixels.write_frame(chunk)
+            else:
+                pixels[0:count] = chunk
+
+            start += count
+
     def effect_breathmap(self, parent):
         with self.animation_timer:
-            for i in range(0, self.num_pixels):
-                scaled = 0
+            # Let set_hsv do the color conversion, but collect its results in
+            # self.frame so that they go out in one write_frame.
+            self._capture = self.frame
+
+            try:
+                for i in range(0, self.num_pixels):
+                    scaled = 0
+
+                    if self.key_usage[i] > 0:
+                        # We're going to use the key usage to pick the maximum brightness for this
+                        # key, from 128 to 255.
+                        maxval = (127 * (self.key_usage[i] / self.max_key_usage)) + 128
 
-                if self.key_usage[i] > 0:
-                    # We're going to use the key usage to pick the maximum brightness for this
-                    # key, from 128 to 255.
-                    maxval = (127 * (self.key_usage[i] / self.max_key_usage)) + 128
+                        # Then we use the animation position to curve that brightness, from 64 to
+                        # maxval.
+                        scaled = int(64 + (self.breath_table[self.pos] * (maxval - 64)) + 0.5)
 
-                    # Then we use the animation position to curve that brightness, from 64 to
-                    # maxval.
-                    scaled = int(64 + (self.breath_table[self.pos] * (maxval - 64)) + 0.5)
+                    self.set_hsv(self.hue, self.sat, scaled, i)
+            finally:
+                self._capture = None
 
-                self.set_hsv(self.hue, self.sat, scaled, i)
+            self.write_frame(self.frame)
 
             # Show final results
             self.disable_auto_write = False  # Resume showing changes
@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2022 Kodachi 6 14
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Copyright 2022 Kodachi 6 14
+#
+# This file is part of the MacroPaw firmware.
+#
+# The MacroPaw firmware is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or any
+# later version.
+#
+# The MacroPaw firmware is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the MacroPaw firmware. If not, see <https://www.gnu.org/licenses/>.
+
+from kmk.extensions import Extension
+
+class PixelFlusher(Extension):
+    """
+    PixelFlusher flushes a deferred NeoPixelBackground once per trip around
+    KMK's main loop. Add it to the keyboard's extensions _after_ every RGB
+    extension drawing on those pixels: KMK runs extensions in order, so by
+    the time our after_hid_send runs, all of their show()s for this loop
+    are in, and they go out as one frame (or not at all, if none of them
+    changed anything). Dithering PixelSlices on those pixels get rendered
+    by the flush itself, so they need nothing from us.
+    """
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def on_runtime_enable(self, sandbox):
+        return
+
+    def on_runtime_disable(self, sandbox):
+        return
+
+    def during_bootup(self, sandbox):
+        self.pixels.flush()
+
+    def before_matrix_scan(self, sandbox):
+        return
+
+    def after_matrix_scan(self, sandbox):
+        return
+
+    def before_hid_send(self, sandbox):
+        return
+
+    def after_hid_send(self, sandbox):
+        self.pixels.flush()
+
+    def on_powersave_enable(self, sandbox):
+        # The RGB extensions blank the LEDs going into powersave, and we
+        # want that out before things go quiet.
+        self.pixels.flush()
+
+    def on_powersave_disable(self, sandbox):
+        self.pixels.flush()
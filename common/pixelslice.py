@@ -20,42 +20,437 @@
 
 import adafruit_pixelbuf
 
+from array import array
+
 class PixelSlice:
-    def __init__(self, parent: adafruit_pixelbuf, offset: int, len: int, mapping=None):
+    def __init__(self, parent: adafruit_pixelbuf, offset: int, len: int, mapping=None,
+                 dither=False):
         self.parent = parent
         self.offset = offset
         self.len = len
 
         self.mapping = mapping or list(range(self.len))
 
+        # Physical index in the parent of each logical pixel, and whether
+        # that's just offset + k, in which case any slice of us is one slice
+        # of the parent.
+        self._physical = [ m + self.offset for m in self.mapping ]
+        self._contiguous = (list(self.mapping) == list(range(self.len)))
+
+        # For bulk writes, we build a whole frame as a flat list of channel
+        # values (r, g, b, r, g, b, ...) in the parent's physical pixel order,
+        # then hand it to the parent in one slice assignment, so that the
+        # parent converts the whole frame in C instead of one pixel at a
+        # time. _frame is that list (allocated once and reused), and
+        # _frame_offsets[k] is where logical pixel k's red channel goes in it.
+        self._bpp = parent.bpp
+        self._frame = [ 0 ] * (self.len * self._bpp)
+        self._frame_offsets = [ self.mapping[k] * self._bpp for k in range(self.len) ]
+
+        # Whether anything's been written to us since our last show(). If
+        # not, show() has nothing to send and doesn't bother the parent, so
+        # when several slices share a parent, only the ones that changed
+        # ask it for a frame.
+        self._dirty = True
+
+        # If the parent wants brightness and gamma applied on the way in
+        # (see NeoPixelBackground's gamma), these are its per-channel lookup
+        # tables. It rebuilds them in place, so holding on to them is fine.
+        self._luts = getattr(parent, "luts", None)
+
+        # Temporal dithering: 8-bit channels at low brightness only have a
+        # few distinct levels, so slow fades visibly step. With dither set,
+        # writes don't go to the parent at all. Instead, each channel of each
+        # logical pixel gets a target from the parent's fine_luts, in 8.8
+        # fixed point, and every frame sent carries target + the error left
+        # over from the last frame, carrying the new remainder forward. Over
+        # a few frames, each LED averages out to its exact target. It's all
+        # integer math.
+        #
+        # That only works if the error advances once per frame that
+        # actually goes out, so we register with the parent, and a deferred
+        # parent's flush() calls render() just before it sends -- and keeps
+        # sending as long as any target has a fraction to spread out. A
+        # parent that sends on every show() gets rendered into by show(),
+        # and an auto_write parent by every write.
+        self._targets = None
+
+        if dither:
+            fine = getattr(parent, "fine_luts", None)
+
+            if (fine is None) or not hasattr(parent, "dithering"):
+                raise ValueError("Dithering needs a parent with lookup tables (see NeoPixelBackground's gamma)")
+
+            self._fine = fine
+            self._targets = array("H", bytes(2 * self.len * self._bpp))
+            self._errors = bytearray(self.len * self._bpp)
+            self._fractional = False
+            self._whole = slice(self.offset, self.offset + self.len)
+
+            parent.dithering.append(self)
+
     # Our deinit needn't do anything; our parent can handle it.
     def deinit(self):
         pass
 
+    def _scaled(self, color):
+        # Run one color through the parent's lookup tables.
+        luts = self._luts
+        color = self._color(color)
+
+        if self._bpp == 3:
+            return (luts[0][color[0]], luts[1][color[1]], luts[2][color[2]])
+
+        return (luts[0][color[0]], luts[1][color[1]], luts[2][color[2]], luts[3][color[3]])
+
+    def _color(self, color):
+        # Colors can be (r, g, b(, w)) or 0xRRGGBB.
+        if isinstance(color, int):
+            color = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+            if self._bpp == 4:
+                color += (0,)
+
+        return color
+
+    def _target(self, k, color):
+        # Set logical pixel k's dithering target.
+        color = self._color(color)
+        i = k * self._bpp
+
+        for c in range(self._bpp):
+            self._targets[i + c] = self._fine[c][color[c]]
+
+    def _targeted(self):
+        # Called after a write has changed our targets.
+        self._dirty = True
+
+        if self.parent.auto_write and self.render():
+            self.parent.show()
+
+    def render(self):
+        """
+        For the parent, when dithering: if there's anything to send --
+        new targets, or targets with a fraction to spread out -- write the
+        next dithered frame into the parent and return True. Call this once
+        per frame the parent actually sends.
+        """
+        if self._dirty:
+            self._dirty = False
+            self._fractional = False
+
+            for t in self._targets:
+                if t & 0xFF:
+                    self._fractional = True
+                    break
+        elif not self._fractional:
+            return False
+
+        self._render()
+        self.parent[self._whole] = self._frame
+        return True
+
+    def _render(self):
+        # One dithered frame into _frame: target + error for every channel,
+        # keeping the low byte as the next error. This runs for every frame
+        # sent, so three channels get their own unrolled loop.
+        targets = self._targets
+        errors = self._errors
+        frame = self._frame
+        offsets = self._frame_offsets
+        bpp = self._bpp
+        i = 0
+
+        if bpp == 3:
+            for k in range(self.len):
+                o = offsets[k]
+
+                acc = targets[i] + errors[i]
+                frame[o] = acc >> 8
+                errors[i] = acc & 0xFF
+
+                acc = targets[i + 1] + errors[i + 1]
+                frame[o + 1] = acc >> 8
+                errors[i + 1] = acc & 0xFF
+
+                acc = targets[i + 2] + errors[i + 2]
+                frame[o + 2] = acc >> 8
+                errors[i + 2] = acc & 0xFF
+
+                i += 3
+
+            return
+
+        for k in range(self.len):
+            o = offsets[k]
+
+            for c in range(bpp):
+                acc = targets[i] + errors[i]
+                frame[o + c] = acc >> 8
+                errors[i] = acc & 0xFF
+                i += 1
+
     def fill(self, color):
+        if self._targets is not None:
+            for k in range(self.len):
+                self._target(k, color)
+
+            self._targeted()
+            return
+
+        if self._luts is not None:
+            color = self._scaled(color)
+
         # Don't worry about the order mapping here, since we're doing everything.
         self.parent[self.offset:self.offset+self.len] = [color] * self.len
+        self._dirty = True
 
     def show(self):
-        self.parent.show()
+        if self._targets is not None:
+            # A deferred parent renders us when it flushes; anything else
+            # sends a frame for every show(), so render it now.
+            if not getattr(self.parent, "deferred", False) and self.render():
+                self.parent.show()
 
-    def __setitem__(self, k: int, v):
-        if (k < 0) or (k >= self.len):
-            raise KeyError(f"{k} is out of range [0, {self.len})")
+            return
+
+        if self._dirty:
+            self._dirty = False
+            self.parent.show()
+
+    def write_frame(self, colors):
+        """
+        Set every pixel at once: colors[k] is the (r, g, b) (or (r, g, b, w))
+        color for logical pixel k, just as for self[k] = colors[k]. This goes
+        through the mapping with a precomputed offset table and writes the
+        parent once.
+        """
+        if len(colors) != self.len:
+            raise ValueError(f"write_frame needs {self.len} colors, not {len(colors)}")
+
+        self._dirty = True
+
+        if self._targets is not None:
+            if self._bpp == 3:
+                targets = self._targets
+                fr, fg, fb = self._fine
+                i = 0
+
+                for k in range(self.len):
+                    r, g, b = colors[k]
+                    targets[i] = fr[r]
+                    targets[i + 1] = fg[g]
+                    targets[i + 2] = fb[b]
+                    i += 3
+            else:
+                for k in range(self.len):
+                    self._target(k, colors[k])
+
+            self._targeted()
+            return
+
+        frame = self._frame
+        offsets = self._frame_offsets
+        luts = self._luts
 
-        self.parent[self.mapping[k] + self.offset] = v
+        if luts is None and self._bpp == 3:
+            for k in range(self.len):
+                o = offsets[k]
+                r, g, b = colors[k]
+                frame[o] = r
+                frame[o + 1] = g
+                frame[o + 2] = b
+        elif self._bpp == 3:
+            lr, lg, lb = luts
+
+            for k in range(self.len):
+                o = offsets[k]
+                r, g, b = colors[k]
+                frame[o] = lr[r]
+                frame[o + 1] = lg[g]
+                frame[o + 2] = lb[b]
+        else:
+            for k in range(self.len):
+                o = offsets[k]
+                color = colors[k]
+
+                for c in range(self._bpp):
+                    frame[o + c] = color[c] if luts is None else luts[c][color[c]]
+
+        self.parent[self.offset:self.offset + self.len] = frame
+
+    def write_bytes(self, buf):
+        """
+        Set every pixel at once from raw channel values: buf holds bpp
+        bytes per logical pixel, in r, g, b(, w) order, so buf[k*bpp] is the
+        red channel of logical pixel k. Like write_frame, this writes the
+        parent once.
+        """
+        bpp = self._bpp
+
+        if len(buf) != self.len * bpp:
+            raise ValueError(f"write_bytes needs {self.len * bpp} bytes, not {len(buf)}")
+
+        self._dirty = True
+
+        if self._targets is not None:
+            fine = self._fine
+
+            for i in range(len(buf)):
+                self._targets[i] = fine[i % bpp][buf[i]]
+
+            self._targeted()
+            return
+
+        frame = self._frame
+        offsets = self._frame_offsets
+        luts = self._luts
+        i = 0
+
+        for k in range(self.len):
+            o = offsets[k]
+
+            for c in range(bpp):
+                frame[o + c] = buf[i] if luts is None else luts[c][buf[i]]
+                i += 1
+
+        self.parent[self.offset:self.offset + self.len] = frame
+
+    def _index(self, k: int):
+        # Logical index -> physical index in the parent.
+        if k < 0:
+            k += self.len
 
-    def __getitem__(self, k: int):
         if (k < 0) or (k >= self.len):
             raise KeyError(f"{k} is out of range [0, {self.len})")
 
-        return self.parent[self.mapping[k] + self.offset]
+        return self.mapping[k] + self.offset
+
+    def _span(self, k: slice):
+        """
+        Map a logical slice to the physical pixels it covers, returning
+        (count, parent_slice, physical): if the mapped pixels are evenly
+        spaced in the parent, parent_slice is a slice of the parent that
+        covers exactly those pixels, in order, and physical is None;
+        otherwise parent_slice is None and physical is the list of physical
+        indices.
+        """
+        start, stop, step = k.indices(self.len)
+
+        if self._contiguous:
+            # The mapping is the identity, so the logical slice is just the
+            # parent's slice, shifted by our offset.
+            count = len(range(start, stop, step))
+
+            if count == 0:
+                return 0, slice(0, 0), None
+
+            stop += self.offset
+
+            return count, slice(start + self.offset, stop if stop >= 0 else None, step), None
+
+        physical = [ self.mapping[i] + self.offset for i in range(start, stop, step) ]
+        count = len(physical)
+
+        if count == 0:
+            return 0, slice(0, 0), None
+
+        if count == 1:
+            return 1, slice(physical[0], physical[0] + 1), None
+
+        stride = physical[1] - physical[0]
+
+        if stride != 0:
+            for i in range(2, count):
+                if physical[i] - physical[i - 1] != stride:
+                    return count, None, physical
+
+            stop = physical[-1] + stride
+
+            return count, slice(physical[0], stop if stop >= 0 else None, stride), None
+
+        return count, None, physical
+
+    def __setitem__(self, k, v):
+        self._dirty = True
+
+        if self._targets is not None:
+            self._set_targets(k, v)
+            self._targeted()
+            return
+
+        if not isinstance(k, slice):
+            self.parent[self._index(k)] = v if self._luts is None else self._scaled(v)
+            return
+
+        # Like the parent, we take either a color per pixel or a flat list
+        # of bpp channel values per pixel.
+        count, span, physical = self._span(k)
+        bpp = self._bpp
+        flat = (len(v) == count * bpp) and (len(v) != count)
+
+        if not flat and (len(v) != count):
+            raise ValueError(f"slice needs {count} colors, not {len(v)}")
+
+        if self._luts is not None:
+            if flat:
+                v = [ self._luts[i % bpp][v[i]] for i in range(len(v)) ]
+            else:
+                v = [ self._scaled(color) for color in v ]
+
+        if span is not None:
+            if count:
+                self.parent[span] = v
+
+            return
+
+        if flat:
+            for i in range(count):
+                self.parent[physical[i]] = tuple(v[i * bpp:(i + 1) * bpp])
+        else:
+            for i in range(count):
+                self.parent[physical[i]] = v[i]
+
+    def _set_targets(self, k, v):
+        # __setitem__, for dithering: the same indexing, but only the
+        # targets change.
+        if not isinstance(k, slice):
+            self._index(k)
+            self._target(k if k >= 0 else k + self.len, v)
+            return
+
+        logical = range(*k.indices(self.len))
+        count = len(logical)
+        bpp = self._bpp
+
+        if (len(v) == count * bpp) and (len(v) != count):
+            v = [ tuple(v[i * bpp:(i + 1) * bpp]) for i in range(count) ]
+        elif len(v) != count:
+            raise ValueError(f"slice needs {count} colors, not {len(v)}")
+
+        for i in range(count):
+            self._target(logical[i], v[i])
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self.parent[self._index(k)]
+
+        count, span, physical = self._span(k)
+
+        if span is not None:
+            return self.parent[span]
+
+        return tuple(self.parent[p] for p in physical)
 
     def __len__(self):
         return self.len
 
-    # def __iter__(self):
-    #     yield from self.parent[self.offset:self.len]
+    def __iter__(self):
+        if self._contiguous:
+            yield from self.parent[self.offset:self.offset + self.len]
+        else:
+            for p in self._physical:
+                yield self.parent[p]
 
     @property
     def auto_write(self):
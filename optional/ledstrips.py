@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: 2022 Kodachi 6 14
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Copyright 2022 Kodachi 6 14
+#
+# This file is part of the MacroPaw firmware.
+#
+# The MacroPaw firmware is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or any
+# later version.
+#
+# The MacroPaw firmware is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the MacroPaw firmware. If not, see <https://www.gnu.org/licenses/>.
+
+from adafruit_neopixelbackground import NeoPixelBackground
+from pixelslice import PixelSlice
+
+class LEDStrips:
+    """
+    LEDStrips drives several NeoPixel strips, each on its own pin and PIO
+    state machine, as one long strip: strip 0's pixels come first, then
+    strip 1's, and so on. Hand out views of it with view(), which returns
+    PixelSlices just like slicing up a single NeoPixelBackground.
+
+    Every strip runs deferred (see NeoPixelBackground), so show() only asks
+    for frames, and flush() starts all of the strips that were written to
+    back to back. Each strip has its own DMA channel, so they all send at
+    once, and a frame of hundreds of LEDs split over N strips takes about
+    1/N as long to go out as it would on one. Put a PixelFlusher after the
+    RGB extensions to flush once per main loop.
+
+    The RP2040 has eight state machines in all, and CircuitPython may want
+    some of them for other things.
+
+    This lives in optional/ rather than common/: build-uf2 only puts it on
+    boards whose firmware imports it.
+    """
+    def __init__(self, strips, *, bpp=3, brightness=1.0, pixel_order=None,
+                 double_buffer=False, gamma=None):
+        """
+        strips is a list of (pin, pixel count) pairs, in the order their
+        pixels should be numbered. The rest of the arguments apply to every
+        strip, as for NeoPixelBackground.
+        """
+        self.strips = []
+        self._starts = []
+        self.n = 0
+
+        for pin, count in strips:
+            self.strips.append(NeoPixelBackground(pin, count, bpp=bpp, brightness=brightness,
+                                                  auto_write=False, pixel_order=pixel_order,
+                                                  deferred=True, double_buffer=double_buffer,
+                                                  gamma=gamma))
+            self._starts.append(self.n)
+            self.n += count
+
+        # Which strips have been written to since their last show().
+        self._written = [ False ] * len(self.strips)
+
+        # We're always deferred, and as with NeoPixelBackground, dithering
+        # PixelSlices on us register here to be rendered by flush().
+        self.deferred = True
+        self.dithering = []
+
+        # All the strips' lookup tables are the same, so views can use the
+        # first one's.
+        self.luts = self.strips[0].luts
+        self.fine_luts = self.strips[0].fine_luts
+
+    def view(self, offset, count, mapping=None):
+        return PixelSlice(self, offset, count, mapping=mapping)
+
+    def _locate(self, k):
+        if k < 0:
+            k += self.n
+
+        if (k < 0) or (k >= self.n):
+            raise KeyError(f"{k} is out of range [0, {self.n})")
+
+        for s in range(len(self.strips) - 1, -1, -1):
+            if k >= self._starts[s]:
+                return s, k - self._starts[s]
+
+    def _runs(self, k):
+        """
+        Split a slice of the whole into its pieces on each strip, yielding
+        (strip number, slice of that strip, first, last) in slice order:
+        the pixels in that piece are items first through last - 1 of the
+        slice.
+        """
+        r = range(*k.indices(self.n))
+        count = len(r)
+
+        if count == 0:
+            return
+
+        step = r.step
+
+        # Go through the strips in the order the slice visits them.
+        order = range(len(self.strips)) if step > 0 else range(len(self.strips) - 1, -1, -1)
+
+        for s in order:
+            lo = self._starts[s]
+            hi = lo + len(self.strips[s])
+
+            if step > 0:
+                # Items whose index is in [lo, hi).
+                first = min(count, max(0, -((r.start - lo) // step)))
+                last = min(count, max(0, -((r.start - hi) // step)))
+            else:
+                # Indices go down, so it's the other way around.
+                first = min(count, max(0, ((r.start - hi) // -step) + 1))
+                last = min(count, max(0, ((r.start - lo) // -step) + 1))
+
+            if first >= last:
+                continue
+
+            start = r[first] - lo
+            stop = r[last - 1] - lo + step
+
+            yield s, slice(start, stop if stop >= 0 else None, step), first, last
+
+    def __setitem__(self, k, v):
+        if not isinstance(k, slice):
+            s, i = self._locate(k)
+            self.strips[s][i] = v
+            self._written[s] = True
+            return
+
+        # As with PixelBuf, v is either a color per pixel or a flat list of
+        # bpp channel values per pixel.
+        count = len(range(*k.indices(self.n)))
+        bpp = self.bpp
+        per = bpp if (len(v) == count * bpp) and (len(v) != count) else 1
+
+        if (per == 1) and (len(v) != count):
+            raise ValueError(f"slice needs {count} colors, not {len(v)}")
+
+        for s, span, first, last in self._runs(k):
+            self.strips[s][span] = v[first * per:last * per]
+            self._written[s] = True
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            s, i = self._locate(k)
+            return self.strips[s][i]
+
+        colors = ()
+
+        for s, span, first, last in self._runs(k):
+            colors += tuple(self.strips[s][span])
+
+        return colors
+
+    def __len__(self):
+        return self.n
+
+    def fill(self, color):
+        for s, strip in enumerate(self.strips):
+            strip.fill(color)
+            self._written[s] = True
+
+    def show(self):
+        for s, strip in enumerate(self.strips):
+            if self._written[s]:
+                self._written[s] = False
+                strip.show()
+
+    def flush(self, wait=False):
+        # Dithered views span strips, so they only render when every strip
+        # can take a frame; otherwise a strip would skip one that the
+        # others sent.
+        if self.dithering:
+            if wait:
+                while self.pending_write:
+                    pass
+
+            if not self.pending_write:
+                for view in self.dithering:
+                    view.render()
+
+                self.show()
+
+        for strip in self.strips:
+            strip.flush(wait)
+
+    def set_lut(self, brightness, gamma=None):
+        for strip in self.strips:
+            strip.set_lut(brightness, gamma)
+
+    def deinit(self):
+        for strip in self.strips:
+            strip.deinit()
+
+    @property
+    def frame_done(self):
+        for strip in self.strips:
+            if not strip.frame_done:
+                return False
+
+        return True
+
+    @property
+    def pending_write(self):
+        for strip in self.strips:
+            if strip.pending_write:
+                return True
+
+        return False
+
+    @property
+    def auto_write(self):
+        return False
+
+    @property
+    def bpp(self):
+        return self.strips[0].bpp
+
+    @property
+    def brightness(self):
+        return self.strips[0].brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        for strip in self.strips:
+            strip.brightness = value
+
+    @property
+    def byteorder(self):
+        return self.strips[0].byteorder
@@ -0,0 +1,671 @@
+import sys
+
+import argparse
+import fnmatch
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import tarfile
+import tempfile
+import time
+
+# bench.py times the firmware and hardware tooling on synthetic inputs, so
+# that we can tell whether a change to one of the tools actually made it
+# faster (or slower, or fatter):
+#
+#   mkuf2             tools/mkuf2.py: base UF2 + a FAT filesystem -> UF2
+#   build-uf2-cold    tools/build-uf2 with an empty build cache
+#   build-uf2-warm    tools/build-uf2 again, with the cache and output in place
+#   hrm               Beatboxer/hardware/hrm.py on a .kicad_pcb (KiCad 8 style)
+#   adjustLabels      adjustLabels.py on a .kicad_pcb (KiCad 7 style)
+#
+# Every benchmark runs at two sizes: "realistic" (about what we ship today)
+# and "10x". Each run is a separate process, so we can get its wall time and
+# peak RSS from wait4(); throughput is input bytes per second of wall time.
+#
+#   bench.py                   run everything, compare with the baseline
+#   bench.py --save-baseline   ...and then make this run the new baseline
+#   bench.py --only 'mkuf2*' --sizes 10x
+#
+# The baseline (.bench-baseline.json at the top of the repo by default) is
+# specific to the machine it was made on, so it isn't checked in. Anything
+# that gets more than --threshold slower or bigger than the baseline is
+# flagged, and bench.py exits nonzero.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = os.path.join(REPO, "tools")
+
+DEFAULT_BASELINE = os.path.join(REPO, ".bench-baseline.json")
+
+# Wall times this close to the baseline are noise, whatever the ratio.
+WALL_SLACK = 0.05
+
+UF2_HEADER = struct.Struct(b"<IIIIIIII")
+UF2_MAGIC_START0 = 0x0A324655
+UF2_MAGIC_START1 = 0x9E5D5157
+UF2_MAGIC_END = 0x0AB16F30
+RP2040_FAMILY_ID = 0xE48BFF56
+
+FLASH_BASE = 0x10000000
+FAT_BASE = 0x10100000
+
+
+class Scale:
+    """
+    How big the synthetic inputs are for one size.
+    """
+
+    def __init__(self, name, firmware_bytes, stage_files, stage_bytes,
+                 pcb_bytes, fat_size):
+        self.name = name
+        self.firmware_bytes = firmware_bytes
+        self.stage_files = stage_files
+        self.stage_bytes = stage_bytes
+        self.pcb_bytes = pcb_bytes
+        self.fat_size = fat_size
+
+
+# "realistic" is sized after a KnGXT build and the Beatboxer PCB.
+SCALES = {
+    "realistic": Scale("realistic", 768 * 1024, 250, 640 * 1024, 2400 * 1024, "8M"),
+    "10x": Scale("10x", 7680 * 1024, 2500, 6400 * 1024, 24000 * 1024, "16M"),
+}
+
+
+class Result:
+    def __init__(self, name, size, input_bytes, wall, rss):
+        self.name = name
+        self.size = size
+        self.input_bytes = input_bytes
+        self.wall = wall
+        self.rss = rss
+
+    @property
+    def key(self):
+        return "%s/%s" % (self.name, self.size)
+
+    @property
+    def throughput(self):
+        return self.input_bytes / self.wall if self.wall > 0 else 0.0
+
+    def as_dict(self):
+        return { "input_bytes": self.input_bytes, "wall": self.wall, "rss": self.rss }
+
+
+def run_measured(cmd, cwd=None, env=None, stdin=None, stdout=None):
+    """
+    Run cmd to completion, returning (wall seconds, peak RSS in bytes).
+    The RSS covers the command's whole process tree, since wait4() folds in
+    the peaks of any children it reaped.
+    """
+    stdin_f = open(stdin, "rb") if stdin else subprocess.DEVNULL
+    stdout_f = open(stdout, "wb") if stdout else subprocess.DEVNULL
+
+    try:
+        start = time.monotonic()
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdin=stdin_f, stdout=stdout_f,
+                                stderr=subprocess.PIPE)
+
+        # Drain stderr ourselves: wait4() doesn't, and some of these tools
+        # are chatty enough to fill the pipe.
+        errors = proc.stderr.read()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.monotonic() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        if stdin:
+            stdin_f.close()
+        if stdout:
+            stdout_f.close()
+
+    if proc.returncode != 0:
+        sys.stderr.write(errors.decode("utf-8", "replace"))
+        raise RuntimeError("%s failed with status %d" % (" ".join(cmd), proc.returncode))
+
+    # ru_maxrss is in bytes on MacOS and kilobytes everywhere else.
+    rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+
+    return wall, rss
+
+
+### Synthetic inputs
+
+def write_firmware_uf2(path, size, rng):
+    """
+    Write a UF2 of random (so, non-filler) firmware at the start of flash.
+    """
+    blocks = (size + 255) // 256
+    record = bytearray(512)
+    struct.pack_into("<I", record, 508, UF2_MAGIC_END)
+
+    with open(path, "wb") as f:
+        for n in range(blocks):
+            UF2_HEADER.pack_into(record, 0, UF2_MAGIC_START0, UF2_MAGIC_START1, 0x2000,
+                                 FLASH_BASE + (n * 256), 256, n, blocks, RP2040_FAMILY_ID)
+            record[32:288] = rng.randbytes(256)
+            f.write(record)
+
+
+def python_source(rng, size):
+    """
+    Return about size bytes of something that looks like Python.
+    """
+    words = [ "self", "keys", "layer", "state", "matrix", "report", "pixel",
+              "hue", "value", "timeout", "return", "None", "True", "index" ]
+    lines = []
+    total = 0
+
+    while total < size:
+        line = "    %s = %s(%s, %d)\n" % (rng.choice(words), rng.choice(words),
+                                          rng.choice(words), rng.randrange(1000))
+        lines.append(line)
+        total += len(line)
+
+    return "".join(lines)
+
+
+def source_tree(scale, rng):
+    """
+    Yield (relpath, contents) for a KMK-like tree of Python sources, spread
+    over enough directories to stay clear of the FAT root directory limit.
+    """
+    per_file = scale.stage_bytes // scale.stage_files
+
+    for n in range(scale.stage_files):
+        relpath = "modules%02d/mod_%04d.py" % (n // 100, n)
+        yield relpath, python_source(rng, per_file).encode("utf-8")
+
+
+def make_stage(path, scale, rng):
+    for relpath, contents in source_tree(scale, rng):
+        full = os.path.join(path, "lib", "kmk", relpath)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+
+        with open(full, "wb") as f:
+            f.write(contents)
+
+    with open(os.path.join(path, "code.py"), "w") as f:
+        f.write("import macropaw\n")
+
+
+def make_kmk_tarfile(path, scale, rng):
+    with tarfile.open(path, "w:gz") as tar:
+        for relpath, contents in source_tree(scale, rng):
+            info = tarfile.TarInfo(relpath)
+            info.size = len(contents)
+            info.mtime = 0
+            tar.addfile(info, io.BytesIO(contents))
+
+
+def make_build_tree(path, scale, rng):
+    """
+    Lay out a base directory that tools/build-uf2 can build a "Bench" board
+    from: the real tools, common code, and KnGXT firmware, plus a synthetic
+    base firmware and KMK tarfile.
+    """
+    tools = os.path.join(path, "tools")
+    os.makedirs(tools)
+
+    for name in os.listdir(TOOLS):
+        if name.endswith(".py") or name == "build-uf2":
+            os.symlink(os.path.join(TOOLS, name), os.path.join(tools, name))
+
+    # build-uf2 puts the filesystem at 0x10100000, so the firmware has to fit
+    # below that whatever the scale.
+    write_firmware_uf2(os.path.join(tools, "base-firmware-Bench.uf2"),
+                       min(scale.firmware_bytes, FAT_BASE - FLASH_BASE), rng)
+    make_kmk_tarfile(os.path.join(tools, "kmk-tarfile.tgz"), scale, rng)
+
+    shutil.copytree(os.path.join(REPO, "common"), os.path.join(path, "common"))
+    shutil.copytree(os.path.join(REPO, "KnGXT", "firmware"),
+                    os.path.join(path, "Bench", "firmware"))
+
+
+def uuid(rng):
+    h = "%032x" % rng.getrandbits(128)
+    return "%s-%s-%s-%s-%s" % (h[0:8], h[8:12], h[12:16], h[16:20], h[20:32])
+
+
+def kicad8_property(rng, name, value, x, y, layer, indent):
+    t = "\t" * indent
+    return (f'{t}(property "{name}" "{value}"\n'
+            f'{t}\t(at {x} {y} 0)\n'
+            f'{t}\t(layer "{layer}")\n'
+            f'{t}\t(uuid "{uuid(rng)}")\n'
+            f'{t}\t(effects\n'
+            f'{t}\t\t(font\n'
+            f'{t}\t\t\t(size 1 1)\n'
+            f'{t}\t\t\t(thickness 0.15)\n'
+            f'{t}\t\t)\n'
+            f'{t}\t)\n'
+            f'{t})\n')
+
+
+def kicad8_footprint(rng, kind, ref, value, x, y, lines):
+    s = (f'\t(footprint "{kind}"\n'
+         f'\t\t(layer "F.Cu")\n'
+         f'\t\t(uuid "{uuid(rng)}")\n'
+         f'\t\t(at {x} {y})\n'
+         f'\t\t(descr "Synthetic footprint for benchmarking")\n')
+    s += kicad8_property(rng, "Reference", ref, 0, -2.79, "F.SilkS", 2)
+    s += kicad8_property(rng, "Value", value, 0, 4, "F.Fab", 2)
+    s += kicad8_property(rng, "Datasheet", "", 0, 0, "F.Fab", 2)
+    s += '\t\t(attr through_hole)\n'
+
+    for _ in range(lines):
+        s += (f'\t\t(fp_line\n'
+              f'\t\t\t(start {rng.uniform(-3, 3):.2f} {rng.uniform(-3, 3):.2f})\n'
+              f'\t\t\t(end {rng.uniform(-3, 3):.2f} {rng.uniform(-3, 3):.2f})\n'
+              f'\t\t\t(stroke\n'
+              f'\t\t\t\t(width 0.12)\n'
+              f'\t\t\t\t(type solid)\n'
+              f'\t\t\t)\n'
+              f'\t\t\t(layer "F.SilkS")\n'
+              f'\t\t\t(uuid "{uuid(rng)}")\n'
+              f'\t\t)\n')
+
+    for pad in (1, 2):
+        s += (f'\t\t(pad "{pad}" thru_hole circle\n'
+              f'\t\t\t(at {(pad - 1) * 2} 0)\n'
+              f'\t\t\t(size 1.2 1.2)\n'
+              f'\t\t\t(drill 0.75)\n'
+              f'\t\t\t(layers "*.Cu" "*.Mask")\n'
+              f'\t\t\t(net {pad} "Net-({ref}-Pad{pad})")\n'
+              f'\t\t\t(uuid "{uuid(rng)}")\n'
+              f'\t\t)\n')
+
+    return s + '\t)\n'
+
+
+def kicad8_gr_text(rng, text, x, y):
+    return (f'\t(gr_text "{text}"\n'
+            f'\t\t(at {x} {y} 0)\n'
+            f'\t\t(layer "B.SilkS")\n'
+            f'\t\t(uuid "{uuid(rng)}")\n'
+            f'\t\t(effects\n'
+            f'\t\t\t(font\n'
+            f'\t\t\t\t(size 0.7 0.7)\n'
+            f'\t\t\t\t(thickness 0.15)\n'
+            f'\t\t\t)\n'
+            f'\t\t\t(justify mirror)\n'
+            f'\t\t)\n'
+            f'\t)\n')
+
+
+def kicad8_segment(rng):
+    return (f'\t(segment\n'
+            f'\t\t(start {rng.uniform(50, 180):.4f} {rng.uniform(20, 130):.4f})\n'
+            f'\t\t(end {rng.uniform(50, 180):.4f} {rng.uniform(20, 130):.4f})\n'
+            f'\t\t(width 0.25)\n'
+            f'\t\t(layer "F.Cu")\n'
+            f'\t\t(net {rng.randrange(1, 200)})\n'
+            f'\t\t(uuid "{uuid(rng)}")\n'
+            f'\t)\n')
+
+
+def make_beatboxer_pcb(path, scale, rng):
+    """
+    Write a KiCad 8 style board with the 64 switches, 64 diodes and 64 back
+    labels that hrm.py lays out, padded out to size with other footprints
+    and tracks (which hrm.py has to parse and write back, but not move).
+    """
+    parts = [ '(kicad_pcb\n\t(version 20241229)\n\t(generator "pcbnew")\n'
+              '\t(generator_version "9.0")\n\t(general\n\t\t(thickness 1.6)\n\t)\n'
+              '\t(paper "A4")\n' ]
+
+    for n in range(1, 65):
+        parts.append(kicad8_footprint(rng, "Connector_JST:JST_PH_B2B-PH-K_1x02_P2.00mm_Vertical",
+                                      "SW%d" % n, "SW_Push_45deg",
+                                      rng.randrange(50, 180), rng.randrange(20, 130), 8))
+        parts.append(kicad8_footprint(rng, "Diode_SMD:D_SOD-323", "D%d" % n, "1N4148",
+                                      rng.randrange(50, 180), rng.randrange(20, 130), 6))
+        parts.append(kicad8_gr_text(rng, "SW%d" % n, rng.randrange(50, 180), rng.randrange(20, 130)))
+
+    size = sum(len(p) for p in parts)
+    n = 0
+
+    while size < scale.pcb_bytes:
+        # Mostly tracks, like a real board, with the odd passive.
+        if n % 20 == 0:
+            p = kicad8_footprint(rng, "Resistor_SMD:R_0402_1005Metric", "R%d" % (n // 20 + 1),
+                                 "10k", rng.randrange(50, 180), rng.randrange(20, 130), 4)
+        else:
+            p = kicad8_segment(rng)
+
+        parts.append(p)
+        size += len(p)
+        n += 1
+
+    parts.append(')\n')
+
+    with open(path, "w") as f:
+        f.writelines(parts)
+
+
+def kicad7_footprint(rng, kind, ref, value, x, y, lines):
+    s = (f'  (footprint "{kind}" (layer "F.Cu")\n'
+         f'    (tstamp {uuid(rng)})\n'
+         f'    (at {x} {y})\n'
+         f'    (attr smd)\n')
+
+    for name, text, tx, ty, layer, hide in (("reference", ref, 0, -1.05, "F.SilkS", ""),
+                                            ("value", value, 0, 1.05, "F.Fab", " hide"),
+                                            ("user", "${REFERENCE}", 0, 0, "F.Fab", "")):
+        s += (f'    (fp_text {name} "{text}" (at {tx} {ty}) (layer "{layer}"){hide}\n'
+              f'        (effects (font (size 0.25 0.25) (thickness 0.04)))\n'
+              f'      (tstamp {uuid(rng)})\n'
+              f'    )\n')
+
+    for _ in range(lines):
+        s += (f'    (fp_line (start {rng.uniform(-1, 1):.6f} {rng.uniform(-1, 1):.6f}) '
+              f'(end {rng.uniform(-1, 1):.6f} {rng.uniform(-1, 1):.6f})\n'
+              f'      (stroke (width 0.12) (type solid)) (layer "F.SilkS") (tstamp {uuid(rng)}))\n')
+
+    s += (f'    (pad "1" smd roundrect (at -0.48 0 90) (size 0.56 0.62) '
+          f'(layers "F.Cu" "F.Paste" "F.Mask") (roundrect_rratio 0.25) (tstamp {uuid(rng)}))\n')
+
+    return s + '  )\n\n'
+
+
+def make_kngxt_pcb(path, scale, rng):
+    """
+    Write a KiCad 7 style board, with one footprint per line group and a
+    blank line after each, for adjustLabels.py. A quarter of the footprints
+    are NP (NeoPixel) parts that it rewrites.
+    """
+    parts = [ '(kicad_pcb (version 20221018) (generator pcbnew)\n\n' ]
+    size = len(parts[0])
+    n = 0
+
+    while size < scale.pcb_bytes:
+        prefix = ("NP", "C", "R", "D")[n % 4]
+        p = kicad7_footprint(rng, "Synthetic:Part", "%s%d" % (prefix, n // 4 + 1), "X",
+                             round(rng.uniform(10, 100), 4), round(rng.uniform(10, 100), 4), 10)
+        parts.append(p)
+        size += len(p)
+        n += 1
+
+    parts.append(')\n')
+
+    with open(path, "w") as f:
+        f.writelines(parts)
+
+
+def tree_size(path):
+    total = 0
+
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+
+    return total
+
+
+### Benchmarks
+
+class Benchmarks:
+    """
+    Benchmarks makes the inputs for each size in a scratch directory as
+    they're first needed, then runs the tools on them.
+    """
+
+    def __init__(self, workdir, repeat):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.rng = random.Random(614)
+
+    def scratch(self, *parts):
+        path = os.path.join(self.workdir, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def measure(self, name, scale, input_bytes, cmd, setup=None, **kwargs):
+        """
+        Run cmd self.repeat times, keeping the best wall time and the worst
+        peak RSS.
+        """
+        walls = []
+        rsses = []
+
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+
+            wall, rss = run_measured(cmd, **kwargs)
+            walls.append(wall)
+            rsses.append(rss)
+
+        return Result(name, scale.name, input_bytes, min(walls), max(rsses))
+
+    def bench_mkuf2(self, scale):
+        firmware = self.scratch(scale.name, "mkuf2", "base.uf2")
+        stage = self.scratch(scale.name, "mkuf2", "stage", "")
+        output = self.scratch(scale.name, "mkuf2", "out.uf2")
+
+        write_firmware_uf2(firmware, scale.firmware_bytes, self.rng)
+        make_stage(stage, scale, self.rng)
+
+        # Put the filesystem at the first 1MB boundary after the firmware.
+        fat_base = FLASH_BASE + max(FAT_BASE - FLASH_BASE,
+                                    (scale.firmware_bytes + 0xFFFFF) & ~0xFFFFF)
+
+        cmd = [ sys.executable, os.path.join(TOOLS, "mkuf2.py"), "--fat-size", scale.fat_size,
+                "--output", output, firmware, "0x%08X:%s" % (fat_base, stage) ]
+
+        return self.measure("mkuf2", scale, os.path.getsize(firmware) + tree_size(stage), cmd)
+
+    def bench_build_uf2(self, scale):
+        base = self.scratch(scale.name, "build-uf2", "base")
+        cache = self.scratch(scale.name, "build-uf2", "cache")
+        output = os.path.join(base, "macropaw-Bench.uf2")
+
+        make_build_tree(base, scale, self.rng)
+
+        env = dict(os.environ, MACROPAW_CACHE=cache, TMPDIR=self.workdir)
+        cmd = [ "bash", os.path.join(base, "tools", "build-uf2"), "Bench", base ]
+        input_bytes = (os.path.getsize(os.path.join(base, "tools", "base-firmware-Bench.uf2")) +
+                       os.path.getsize(os.path.join(base, "tools", "kmk-tarfile.tgz")) +
+                       tree_size(os.path.join(base, "common")) +
+                       tree_size(os.path.join(base, "Bench")))
+
+        def cold():
+            shutil.rmtree(cache, ignore_errors=True)
+
+            if os.path.exists(output):
+                os.unlink(output)
+
+        results = [ self.measure("build-uf2-cold", scale, input_bytes, cmd, setup=cold, env=env) ]
+
+        # The last cold run left the cache and output behind, which is just
+        # what a warm run wants.
+        results.append(self.measure("build-uf2-warm", scale, input_bytes, cmd, env=env))
+
+        return results
+
+    def bench_hrm(self, scale):
+        pcb = self.scratch(scale.name, "hrm", "board.kicad_pcb")
+        output = self.scratch(scale.name, "hrm", "out.kicad_pcb")
+
+        make_beatboxer_pcb(pcb, scale, self.rng)
+
+        cmd = [ sys.executable, os.path.join(REPO, "Beatboxer", "hardware", "hrm.py"), pcb ]
+
+        return self.measure("hrm", scale, os.path.getsize(pcb), cmd, stdout=output)
+
+    def bench_adjust_labels(self, scale):
+        pcb = self.scratch(scale.name, "adjustLabels", "board.kicad_pcb")
+        output = self.scratch(scale.name, "adjustLabels", "out.kicad_pcb")
+
+        make_kngxt_pcb(pcb, scale, self.rng)
+
+        cmd = [ sys.executable, os.path.join(REPO, "adjustLabels.py") ]
+
+        return self.measure("adjustLabels", scale, os.path.getsize(pcb), cmd,
+                            stdin=pcb, stdout=output)
+
+
+# Benchmark name(s) -> Benchmarks method. Globs given to --only match any
+# of the names.
+BENCHMARKS = [
+    (("mkuf2",), Benchmarks.bench_mkuf2),
+    (("build-uf2-cold", "build-uf2-warm"), Benchmarks.bench_build_uf2),
+    (("hrm",), Benchmarks.bench_hrm),
+    (("adjustLabels",), Benchmarks.bench_adjust_labels),
+]
+
+
+### Reporting
+
+def human_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return "%.1f%s" % (n, unit)
+        n /= 1024.0
+
+    return "%.1fGB" % n
+
+
+def regressions(result, baseline, threshold):
+    """
+    Return a list of the ways result is worse than its baseline entry.
+    """
+    worse = []
+
+    if baseline is None:
+        return worse
+
+    base_wall = baseline["wall"]
+    base_rss = baseline["rss"]
+
+    if (result.wall > base_wall * (1 + threshold)) and (result.wall - base_wall > WALL_SLACK):
+        worse.append("wall %.2fs -> %.2fs" % (base_wall, result.wall))
+
+    if result.rss > base_rss * (1 + threshold):
+        worse.append("RSS %s -> %s" % (human_bytes(base_rss), human_bytes(result.rss)))
+
+    return worse
+
+
+def report(results, baseline, threshold):
+    """
+    Print the results table, returning the number of regressions.
+    """
+    print("%-24s %10s %9s %10s %12s  %s" %
+          ("Benchmark", "Input", "Wall", "Peak RSS", "Throughput", "vs. baseline"))
+
+    flagged = 0
+
+    for r in results:
+        base = baseline.get(r.key)
+
+        if base is None:
+            verdict = "(new)"
+        else:
+            worse = regressions(r, base, threshold)
+
+            if worse:
+                verdict = "REGRESSION: " + ", ".join(worse)
+                flagged += 1
+            else:
+                verdict = "ok (%+.0f%% wall, %+.0f%% RSS)" % (
+                    100.0 * (r.wall - base["wall"]) / base["wall"] if base["wall"] else 0.0,
+                    100.0 * (r.rss - base["rss"]) / base["rss"] if base["rss"] else 0.0)
+
+        print("%-24s %10s %8.2fs %10s %10s/s  %s" %
+              (r.key, human_bytes(r.input_bytes), r.wall, human_bytes(r.rss),
+               human_bytes(r.throughput), verdict))
+
+    return flagged
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, baseline, results):
+    # Merge, so that saving a partial run (--only, --sizes) doesn't forget
+    # the rest.
+    merged = dict(baseline)
+
+    for r in results:
+        merged[r.key] = r.as_dict()
+
+    tmp = path + ".tmp"
+
+    with open(tmp, "w") as f:
+        json.dump(merged, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+    os.replace(tmp, path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the MacroPaw build and PCB tools.")
+    parser.add_argument("--sizes", default=",".join(SCALES.keys()),
+                        help="comma-separated sizes to run (default: %(default)s)")
+    parser.add_argument("--only", action="append", default=None, metavar="GLOB",
+                        help="only run benchmarks matching GLOB (may be repeated)")
+    parser.add_argument("-n", "--repeat", type=int, default=1,
+                        help="runs per benchmark; the best wall time is kept (default: 1)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline file (default: .bench-baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save this run's results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="flag results this fraction worse than the baseline (default: 0.25)")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the scratch directory with the inputs and outputs")
+
+    args = parser.parse_args(argv)
+
+    sizes = [ s.strip() for s in args.sizes.split(",") if s.strip() ]
+
+    for s in sizes:
+        if s not in SCALES:
+            parser.error("unknown size %s (choose from %s)" % (s, ", ".join(SCALES.keys())))
+
+    selected = [ method for names, method in BENCHMARKS
+                 if (args.only is None) or
+                    any(fnmatch.fnmatch(n, g) for n in names for g in args.only) ]
+
+    baseline = load_baseline(args.baseline)
+    workdir = tempfile.mkdtemp(prefix="macropaw-bench.")
+    results = []
+
+    try:
+        bench = Benchmarks(workdir, max(1, args.repeat))
+
+        for size in sizes:
+            for method in selected:
+                sys.stderr.write("== %s (%s)...\n" % (method.__name__[len("bench_"):], size))
+
+                r = method(bench, SCALES[size])
+                results.extend(r if isinstance(r, list) else [ r ])
+    finally:
+        if args.keep:
+            sys.stderr.write("Scratch files are in %s\n" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.only:
+        results = [ r for r in results if any(fnmatch.fnmatch(r.name, g) for g in args.only) ]
+
+    flagged = report(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, baseline, results)
+        sys.stderr.write("Saved baseline to %s\n" % args.baseline)
+
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+import sys
+
+import argparse
+import os
+import subprocess
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Builds UF2 images for several MacroPaw boards at once by running
+# tools/build-uf2 for each of them in parallel. Every board gets its own
+# scratch staging directory (see build-uf2), so the builds don't step on
+# each other.
+#
+# Usage: build-all.py base-dir board[:volname] ...
+
+
+class BoardBuild:
+    def __init__(self, spec, base_dir, log_dir):
+        self.board_id, _, self.volname = spec.partition(":")
+        self.base_dir = base_dir
+        self.log_path = os.path.join(log_dir, "build-%s.log" % self.board_id)
+        self.returncode = None
+        self.elapsed = None
+
+    def command(self):
+        cmd = [ "bash", os.path.join(self.base_dir, "tools", "build-uf2"),
+                self.board_id, self.base_dir ]
+
+        if self.volname:
+            cmd.append(self.volname)
+
+        return cmd
+
+    def run(self):
+        start = time.monotonic()
+
+        with open(self.log_path, "w") as log:
+            self.returncode = subprocess.call(self.command(),
+                                              stdin=subprocess.DEVNULL,
+                                              stdout=log,
+                                              stderr=subprocess.STDOUT)
+
+        self.elapsed = time.monotonic() - start
+
+        status = "OK" if self.returncode == 0 else "FAILED (%d)" % self.returncode
+        sys.stderr.write("== %s: %s in %.2fs\n" % (self.board_id, status, self.elapsed))
+
+        return self
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Build MacroPaw UF2 images for several boards in parallel.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="maximum number of concurrent builds (default: number of cores)")
+    parser.add_argument("--log-dir", default=None,
+                        help="where to write per-board build logs (default: $TMPDIR)")
+    parser.add_argument("base_dir")
+    parser.add_argument("boards", nargs="+", metavar="board[:volname]")
+
+    args = parser.parse_args(argv)
+
+    base_dir = os.path.abspath(args.base_dir)
+    log_dir = args.log_dir or os.environ.get("TMPDIR", "/tmp")
+
+    builds = [ BoardBuild(spec, base_dir, log_dir) for spec in args.boards ]
+    jobs = max(1, min(args.jobs, len(builds)))
+
+    sys.stderr.write("Building %s with %d job%s...\n" %
+                     (", ".join(b.board_id for b in builds), jobs, "s" if jobs != 1 else ""))
+
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(BoardBuild.run, builds))
+
+    total = time.monotonic() - start
+
+    sys.stderr.write("\n%-12s %8s  %s\n" % ("Board", "Time", "Result"))
+
+    for b in results:
+        result = "OK" if b.returncode == 0 else "FAILED, see %s" % b.log_path
+        sys.stderr.write("%-12s %7.2fs  %s\n" % (b.board_id, b.elapsed, result))
+
+    sys.stderr.write("%-12s %7.2fs\n" % ("Total", total))
+
+    return 0 if all(b.returncode == 0 for b in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,197 @@
+import sys
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+# buildcache keeps build products that only depend on their inputs, keyed by
+# content hashes, so that rebuilding a board only redoes work for things
+# that actually changed:
+#
+# - `buildcache.py kmk TARFILE` extracts the KMK tarfile once per distinct
+#   tarfile and prints the directory it was extracted into.
+#
+# - `buildcache.py compile STAGE` runs mpy-cross on every .py file under
+#   STAGE (except code.py and boot.py), replacing each with its .mpy. Each
+#   .mpy is cached under the hash of the mpy-cross version, the file's path
+#   within STAGE, and its contents. Cache misses are compiled by a pool of
+#   mpy-cross processes, one per core by default.
+#
+# The cache lives in $MACROPAW_CACHE, or .build-cache at the top of the repo.
+# It's shared by every board and every build, so things like KMK (which is
+# the same on every board) get compiled once, not once per board per build.
+
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             ".build-cache")
+
+# These stay as source: CircuitPython only looks for code.py and boot.py.
+KEEP_AS_SOURCE = ("code.py", "boot.py")
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def store(path, cached):
+    """
+    Atomically copy path into the cache as cached, so that a concurrent
+    build never sees a partially written entry.
+    """
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached), prefix=".tmp-")
+    os.close(fd)
+
+    try:
+        shutil.copy2(path, tmp)
+        os.replace(tmp, cached)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class BuildCache:
+    def __init__(self, root):
+        self.root = root
+
+    def kmk_tree(self, tarpath):
+        """
+        Return a directory holding the extracted contents of tarpath,
+        extracting it only if this exact tarfile hasn't been seen before.
+        """
+        target = os.path.join(self.root, "kmk", file_hash(tarpath))
+
+        if not os.path.isdir(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=".tmp-")
+
+            try:
+                with tarfile.open(tarpath, "r:gz") as tar:
+                    members = [ m for m in tar.getmembers()
+                                if "__pycache__" not in m.name.split("/") ]
+                    # Use the "data" filter (which, among other things,
+                    # doesn't restore owners) where this Python has it.
+                    kwargs = { "filter": "data" } if hasattr(tarfile, "data_filter") else {}
+                    tar.extractall(tmp, members=members, **kwargs)
+
+                os.rename(tmp, target)
+            except OSError:
+                # Someone else got there first; theirs is just as good.
+                shutil.rmtree(tmp, ignore_errors=True)
+
+                if not os.path.isdir(target):
+                    raise
+
+        return target
+
+    def mpy_path(self, key):
+        return os.path.join(self.root, "mpy", key[:2], key + ".mpy")
+
+
+class Compiler:
+    """
+    Compiler turns the .py files in a staging directory into .mpy files,
+    running mpy-cross only for sources the cache hasn't seen, with up to
+    `jobs` mpy-cross processes at once.
+    """
+
+    def __init__(self, cache, mpy_cross="mpy-cross", jobs=None):
+        self.cache = cache
+        self.mpy_cross = mpy_cross
+        self.jobs = jobs or os.cpu_count() or 1
+        self.version = subprocess.check_output([ mpy_cross, "--version" ]).strip()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, stage, relpath):
+        h = hashlib.sha256()
+        h.update(self.version + b"\0")
+        h.update(relpath.encode("utf-8") + b"\0")
+
+        with open(os.path.join(stage, relpath), "rb") as f:
+            h.update(f.read())
+
+        return h.hexdigest()
+
+    def sources(self, stage):
+        for dirpath, dirnames, filenames in os.walk(stage):
+            dirnames.sort()
+
+            for name in sorted(filenames):
+                if name.endswith(".py") and name not in KEEP_AS_SOURCE:
+                    yield os.path.relpath(os.path.join(dirpath, name), stage)
+
+    def compile_one(self, stage, relpath):
+        """
+        Compile one source, returning True if it came from the cache.
+        """
+        source = os.path.join(stage, relpath)
+        output = source[:-3] + ".mpy"
+        cached = self.cache.mpy_path(self.key(stage, relpath))
+        hit = os.path.exists(cached)
+
+        if not hit:
+            # Compile using the path relative to the stage, so that the name
+            # baked into the .mpy is the one it'll have on the device rather
+            # than some scratch path. That also keeps it cacheable.
+            subprocess.check_call([ self.mpy_cross, relpath ], cwd=stage)
+            store(output, cached)
+
+        shutil.copy2(cached, output)
+        os.unlink(source)
+
+        return hit
+
+    def compile(self, stage):
+        # The work happens in mpy-cross processes, so threads are all we
+        # need to keep several of them going.
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = list(pool.map(lambda relpath: self.compile_one(stage, relpath),
+                                    self.sources(stage)))
+
+        self.hits += sum(1 for hit in results if hit)
+        self.misses += sum(1 for hit in results if not hit)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Content-addressed MacroPaw build cache.")
+    parser.add_argument("--cache", default=os.environ.get("MACROPAW_CACHE", DEFAULT_CACHE),
+                        help="cache directory (default: $MACROPAW_CACHE or .build-cache)")
+
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    kmk = sub.add_parser("kmk", help="extract a KMK tarfile (once) and print its directory")
+    kmk.add_argument("tarfile")
+
+    comp = sub.add_parser("compile", help="compile .py files in a staging directory to .mpy")
+    comp.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross to use")
+    comp.add_argument("-j", "--jobs", type=int, default=None,
+                      help="maximum concurrent mpy-cross processes (default: number of cores)")
+    comp.add_argument("stage")
+
+    args = parser.parse_args(argv)
+    cache = BuildCache(args.cache)
+
+    if args.command == "kmk":
+        print(cache.kmk_tree(args.tarfile))
+    elif args.command == "compile":
+        compiler = Compiler(cache, args.mpy_cross, args.jobs)
+        compiler.compile(args.stage)
+
+        sys.stderr.write("mpy-cross: %d compiled, %d from cache\n" %
+                         (compiler.misses, compiler.hits))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
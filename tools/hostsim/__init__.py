@@ -0,0 +1,70 @@
+import os
+import sys
+
+# hostsim runs the LED side of the firmware (NeoPixelBackground, PixelSlice,
+# and LEDStrips from optional/) on a desktop Python, by putting stand-ins for the CircuitPython
+# modules it needs ahead of everything else on sys.path:
+#
+#   rp2pio              StateMachine, which records every frame written to it
+#   adafruit_pioasm     Program, which doesn't actually assemble anything
+#   adafruit_pixelbuf   PixelBuf, in Python, following the C one's behavior
+#   board               every pin you ask for
+#   supervisor          ticks_ms() and friends
+#
+# KMK isn't here, so the RGB extensions themselves can't run; drive the
+# pixels directly, the way the extensions do.
+#
+#   import hostsim
+#   hostsim.install()
+#
+#   from adafruit_neopixelbackground import NeoPixelBackground
+#   ...
+#   for frame in hostsim.frames():
+#       print(frame.time, frame.bits, frame.data.hex())
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+
+MODULES = os.path.join(HERE, "modules")
+COMMON = os.path.join(REPO, "common")
+COMMON_LIB = os.path.join(COMMON, "lib")
+OPTIONAL = os.path.join(REPO, "optional")
+
+
+def install():
+    """
+    Put the stand-ins, and the firmware's common and optional code, at the
+    front of sys.path. Call this before importing any firmware module.
+
+    This also turns off writing bytecode, so that importing the firmware
+    here doesn't leave __pycache__ directories in common/ for build-uf2 to
+    copy onto the board.
+    """
+    sys.dont_write_bytecode = True
+
+    for path in (OPTIONAL, COMMON, COMMON_LIB, MODULES):
+        if path in sys.path:
+            sys.path.remove(path)
+
+        sys.path.insert(0, path)
+
+
+def frames():
+    """
+    Every frame recorded by every state machine since the last reset(), in
+    the order they were written.
+    """
+    import rp2pio
+
+    return sorted((f for sm in rp2pio.state_machines for f in sm.frames),
+                  key=lambda f: f.seq)
+
+
+def reset():
+    """
+    Forget every recorded frame (but not the state machines).
+    """
+    import rp2pio
+
+    for sm in rp2pio.state_machines:
+        sm.frames.clear()
@@ -0,0 +1,26 @@
+# Stand-in for adafruit_pioasm. The simulated state machine doesn't run the
+# program, so all Program has to do is count its instructions and hand back
+# the sort of pio_kwargs the real one would.
+
+class Program:
+    def __init__(self, text, *, build_debuginfo=False):
+        self.text = text
+        self.instructions = []
+        self.pio_kwargs = {}
+
+        for line in text.split("\n"):
+            line = line.split(";", 1)[0].strip()
+
+            if not line:
+                continue
+
+            if line.startswith(".side_set"):
+                words = line.split()
+                self.pio_kwargs["sideset_pin_count"] = int(words[1])
+                self.pio_kwargs["sideset_enable"] = "opt" in words
+            elif line.startswith(".") or line.endswith(":"):
+                continue
+            else:
+                self.instructions.append(line)
+
+        self.assembled = bytes(2 * len(self.instructions))
@@ -0,0 +1,149 @@
+# Stand-in for CircuitPython's adafruit_pixelbuf (the C _pixelbuf), in
+# Python. It keeps the same buffer layout -- header, then bpp bytes per
+# pixel in byteorder, then trailer -- and hands that whole buffer to
+# _transmit() on show(), so subclasses like NeoPixelBackground see exactly
+# what they would on the device.
+#
+# As in the C version, the values you write are kept as written, and the
+# buffer that goes out has brightness applied; auto_write here is the
+# pixelbuf's own setting, so a subclass overriding the auto_write property
+# doesn't change when we call show(). Everything of ours is _pb_-prefixed,
+# so that it can't collide with a subclass's attributes (there's nothing to
+# collide with in C).
+
+class PixelBuf:
+    def __init__(self, size, *, byteorder="BGR", brightness=1.0, auto_write=False,
+                 header=b"", trailer=b""):
+        if not all(c in "RGBW" for c in byteorder) or len(set(byteorder)) != len(byteorder):
+            raise ValueError(f"Invalid byteorder {byteorder!r}")
+
+        self._pb_n = size
+        self._pb_bpp = len(byteorder)
+        self._pb_byteorder = byteorder
+        self._pb_header_len = len(header)
+
+        # Where each of r, g, b(, w) goes within a pixel.
+        self._pb_slots = [ byteorder.index(c) for c in "RGBW"[:self._pb_bpp] ]
+
+        self._pb_buf = bytearray(header + bytes(size * self._pb_bpp) + trailer)
+        self._pb_values = [ (0,) * self._pb_bpp ] * size
+
+        self._pb_brightness = min(max(float(brightness), 0.0), 1.0)
+        self._pb_auto_write = bool(auto_write)
+
+    def __len__(self):
+        return self._pb_n
+
+    @property
+    def bpp(self):
+        return self._pb_bpp
+
+    @property
+    def byteorder(self):
+        return self._pb_byteorder
+
+    @property
+    def auto_write(self):
+        return self._pb_auto_write
+
+    @auto_write.setter
+    def auto_write(self, value):
+        self._pb_auto_write = bool(value)
+
+    @property
+    def brightness(self):
+        return self._pb_brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        self._pb_brightness = min(max(float(value), 0.0), 1.0)
+
+        for i in range(self._pb_n):
+            self._pb_pack(i, self._pb_values[i])
+
+        if self._pb_auto_write:
+            self.show()
+
+    def _pb_color(self, value):
+        if isinstance(value, int):
+            color = ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+            if self._pb_bpp == 4:
+                color += ((value >> 24) & 0xFF,)
+
+            return color
+
+        color = tuple(int(c) for c in value)
+
+        if len(color) == 3 and self._pb_bpp == 4:
+            color += (0,)
+
+        if len(color) != self._pb_bpp:
+            raise ValueError(f"Expected tuple of length {self._pb_bpp}, got {len(color)}")
+
+        for c in color:
+            if not 0 <= c <= 255:
+                raise ValueError(f"Color component {c} out of range")
+
+        return color
+
+    def _pb_pack(self, i, color):
+        o = self._pb_header_len + (i * self._pb_bpp)
+
+        for c in range(self._pb_bpp):
+            self._pb_buf[o + self._pb_slots[c]] = int(color[c] * self._pb_brightness)
+
+    def _pb_index(self, i):
+        if i < 0:
+            i += self._pb_n
+
+        if not 0 <= i < self._pb_n:
+            raise IndexError("PixelBuf index out of range")
+
+        return i
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            indices = range(*index.indices(self._pb_n))
+            value = list(value)
+
+            if (len(value) == len(indices) * self._pb_bpp) and (len(value) != len(indices)):
+                value = [ tuple(value[i:i + self._pb_bpp]) for i in range(0, len(value), self._pb_bpp) ]
+
+            if len(value) != len(indices):
+                raise ValueError(f"Expected {len(indices)} colors, got {len(value)}")
+
+            for i, v in zip(indices, value):
+                color = self._pb_color(v)
+                self._pb_values[i] = color
+                self._pb_pack(i, color)
+        else:
+            i = self._pb_index(index)
+            color = self._pb_color(value)
+            self._pb_values[i] = color
+            self._pb_pack(i, color)
+
+        if self._pb_auto_write:
+            self.show()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self._pb_values[i] for i in range(*index.indices(self._pb_n)))
+
+        return self._pb_values[self._pb_index(index)]
+
+    def fill(self, color):
+        color = self._pb_color(color)
+
+        for i in range(self._pb_n):
+            self._pb_values[i] = color
+            self._pb_pack(i, color)
+
+        if self._pb_auto_write:
+            self.show()
+
+    def show(self):
+        self._transmit(self._pb_buf)
+
+    def _transmit(self, buffer):
+        raise NotImplementedError("Must be subclassed")
@@ -0,0 +1,22 @@
+# Stand-in for CircuitPython's board module: any pin name you ask for
+# exists, as a Pin that just knows its name.
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"board.{self.name}"
+
+
+_pins = {}
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+
+    if name not in _pins:
+        _pins[name] = Pin(name)
+
+    return _pins[name]
@@ -0,0 +1,178 @@
+import time
+
+# Stand-in for CircuitPython's rp2pio. StateMachine doesn't run its program:
+# it assumes it's the NeoPixel program in adafruit_neopixelbackground, which
+# pulls a header word (the number of bits to send, minus one), then the
+# bits, then a word of delay cycles, and records each buffer written to it
+# as a Frame. It also keeps track of how long each frame would take on the
+# wire, so writing and pending_write behave (roughly) like the real ones.
+
+# Every StateMachine made so far, in order.
+state_machines = []
+
+# Set to False to stop recording frames (for timing or allocation checks,
+# where the recording itself would get in the way).
+recording = True
+
+# Set to False to have every write finish the moment it starts, so nothing
+# is ever writing or pending (for exercising the send path flat out).
+timing = True
+
+# Each bit of the NeoPixel program takes this many state machine cycles.
+CYCLES_PER_BIT = 16
+
+_seq = 0
+
+
+class Frame:
+    """
+    One buffer handed to a state machine: when (time.monotonic()), how many
+    bits its header said to send, the bytes those bits come from (in the
+    order they go out on the wire), the delay cycles from its trailer, and
+    whether it was a looping write.
+    """
+
+    def __init__(self, seq, time, bits, data, delay, loop, sm):
+        self.seq = seq
+        self.time = time
+        self.bits = bits
+        self.data = data
+        self.delay = delay
+        self.loop = loop
+        self.sm = sm
+
+    @property
+    def size(self):
+        """Bytes handed to the state machine, header and trailer included."""
+        return 4 + (((self.bits + 31) // 32) * 4) + 4
+
+    def __repr__(self):
+        return f"<Frame {self.seq} @{self.time:.6f}: {self.bits} bits{' loop' if self.loop else ''}>"
+
+
+class StateMachine:
+    def __init__(self, program, *, frequency, first_sideset_pin=None, auto_pull=False,
+                 out_shift_right=True, pull_threshold=32, **kwargs):
+        self.program = program
+        self.frequency = frequency
+        self.first_sideset_pin = first_sideset_pin
+        self.kwargs = kwargs
+
+        self.frames = []
+        self.deinited = False
+
+        # When the one-shot write being sent, and the one queued behind it
+        # (the real thing has room for one), will be done.
+        self._sending = None
+        self._queued = None
+        self._looping = None
+        self._durations = {}
+
+        state_machines.append(self)
+
+    def _word(self, raw, i, swap):
+        # Word i of a buffer, as the state machine pulls it.
+        return int.from_bytes(raw[i * 4:(i + 1) * 4], "big" if swap else "little")
+
+    def _header(self, buf, swap):
+        """Return (bits, delay) from a buffer's header and trailer."""
+        raw = memoryview(buf).cast("B")
+        bits = self._word(raw, 0, swap) + 1
+
+        return bits, self._word(raw, 1 + ((bits + 31) // 32), swap)
+
+    def _record(self, buf, swap, loop):
+        global _seq
+
+        raw = memoryview(buf).cast("B")
+        bits, delay = self._header(buf, swap)
+
+        # The state machine sends each word most significant bit first.
+        data = b"".join(self._word(raw, i, swap).to_bytes(4, "big")
+                        for i in range(1, 1 + ((bits + 31) // 32)))
+
+        _seq += 1
+        self.frames.append(Frame(_seq, time.monotonic(), bits, data[:(bits + 7) // 8],
+                                 delay, loop, self))
+
+    def _duration(self, buf, swap):
+        # Buffers get written over and over, so remember how long each one
+        # takes to send (keyed by the buffer itself, which keeps it alive
+        # and its id unique).
+        key = id(buf)
+        known = self._durations.get(key)
+
+        if known is None:
+            bits, delay = self._header(buf, swap)
+            known = (buf, ((bits * CYCLES_PER_BIT) + delay) / self.frequency)
+            self._durations[key] = known
+
+        return known[1]
+
+    def _expire(self):
+        now = time.monotonic()
+
+        if (self._sending is not None) and (self._sending <= now):
+            self._sending = self._queued
+            self._queued = None
+
+            if (self._sending is not None) and (self._sending <= now):
+                self._sending = None
+
+    def background_write(self, once=None, *, loop=None, swap=False):
+        if self.deinited:
+            raise ValueError("Object has been deinitialized and can no longer be used.")
+
+        if (once is None) and (loop is None):
+            # Stop looping, once the current pass is done.
+            self._looping = None
+            return
+
+        if once is not None:
+            self._expire()
+
+            # With one frame already queued, the real thing waits until
+            # there's room for another.
+            while self._queued is not None:
+                time.sleep(max(0, self._sending - time.monotonic()))
+                self._expire()
+
+            if recording:
+                self._record(once, swap, False)
+
+            if not timing:
+                pass
+            elif self._sending is None:
+                self._sending = time.monotonic() + self._duration(once, swap)
+            else:
+                self._queued = self._sending + self._duration(once, swap)
+
+        if loop is not None:
+            if recording:
+                self._record(loop, swap, True)
+
+            self._looping = loop
+
+    @property
+    def writing(self):
+        self._expire()
+
+        return (self._sending is not None) or (self._looping is not None)
+
+    @property
+    def pending_write(self):
+        self._expire()
+
+        return self._queued is not None
+
+    def deinit(self):
+        self._sending = None
+        self._queued = None
+        self._looping = None
+        self.deinited = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
@@ -0,0 +1,28 @@
+import time
+
+# Stand-in for CircuitPython's supervisor module.
+
+_start = time.monotonic()
+
+# Like the real thing, ticks_ms() wraps at 2**29.
+_TICKS_PERIOD = 1 << 29
+
+reloads = 0
+
+
+def ticks_ms():
+    return int((time.monotonic() - _start) * 1000) % _TICKS_PERIOD
+
+
+def reload():
+    global reloads
+    reloads += 1
+
+
+class _Runtime:
+    serial_connected = False
+    serial_bytes_available = 0
+    usb_connected = False
+
+
+runtime = _Runtime()
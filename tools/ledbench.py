@@ -0,0 +1,395 @@
+import sys
+
+import argparse
+import fnmatch
+import itertools
+import math
+import time
+import tracemalloc
+
+import hostsim
+
+hostsim.install()
+
+import board
+import rp2pio
+
+from adafruit_neopixelbackground import NeoPixelBackground
+from ledstrips import LEDStrips
+from pixelslice import PixelSlice
+
+# ledbench.py runs the LED pipeline -- PixelSlice views, NeoPixelBackground,
+# LEDStrips -- on the host simulator in tools/hostsim, set up the way each
+# board sets it up, and measures it:
+#
+#   Loops/s       draw + show + flush rounds per second (host CPU, so only
+#                 good for comparing one change with another)
+#   Draw/loop     host CPU time per loop spent in the views' write_frame()s
+#                 (mapping, brightness, gamma) and, where show() can't wait
+#                 on the LEDs because the pixels are deferred, their show()s
+#   Render        host CPU time for one dithered frame of every dithering
+#                 view (their per-pixel loop, which runs once per frame
+#                 sent), or - if there aren't any
+#   Frames/s      frames each state machine was actually handed per second
+#   Bytes/frame   bytes per frame handed to a state machine
+#   Wire/frame    how long the slowest strip's frame takes to send, which
+#                 caps the refresh rate at Max fps
+#   Alloc/push    bytes allocated by one show() + flush() on each strip,
+#                 which should be zero (not counting dithered views'
+#                 renders, which write through the simulated pixelbuf: it's
+#                 Python, and allocates where the C one doesn't)
+#   Check         whether the last frame each strip sent has exactly the
+#                 bytes the views were last given (mapped, scaled, and in
+#                 the strip's byte order) -- or, for dithered views, is
+#                 within one step of them
+#
+#   ledbench.py                          every configuration
+#   ledbench.py --only 'strips*' --seconds 3
+#   ledbench.py --linear                 the pixelbuf's own brightness scaling
+#                                        rather than lookup tables, to compare
+#
+# Exits nonzero if a check fails or a push allocates. --no-alloc skips the
+# allocation check, which is the slow part. (tools/tests has the same check
+# as a unit test.)
+
+KNGXT_MATRIX = [ 0, 5, 10, 1, 6, 11, 2, 7, 12, 3, 8, 13, 4, 9 ]
+KNGYT_MATRIX = [ 0, 3, 4, 7, 8, 1, 2, 5, 6, 9 ]
+
+# How the boards set up brightness and gamma; --linear switches to the
+# pixelbuf's own brightness scaling (and no dithering, which needs the
+# lookup tables).
+LEDS = dict(brightness=0.1875, gamma=2.2)
+LINEAR = dict(brightness=0.125, gamma=None)
+
+# Animation frames are precomputed, this many per cycle, so that what we
+# time is the pipeline rather than the drawing.
+CYCLE = 64
+
+
+class Rig:
+    """
+    One configuration: the views effects draw into, the strips they end up
+    on, and the thing to flush once per loop.
+    """
+
+    def __init__(self, name, driver, views, strips):
+        self.name = name
+        self.driver = driver
+        self.views = views
+        self.strips = strips
+
+    @property
+    def leds(self):
+        return sum(len(s) for s in self.strips)
+
+
+def kngxt():
+    pixels = NeoPixelBackground(board.NEOPIXEL, 30, pixel_order="GRB",
+                                auto_write=False, deferred=True, double_buffer=True, **LEDS)
+    views = [ PixelSlice(pixels, 8, 8), PixelSlice(pixels, 0, 8),
+              PixelSlice(pixels, 16, 14, mapping=KNGXT_MATRIX,
+                         dither=(LEDS["gamma"] is not None)) ]
+
+    return Rig("kngxt", pixels, views, [ pixels ])
+
+
+def kngyt():
+    pixels = NeoPixelBackground(board.NEOPIXEL, 10, pixel_order="GRB",
+                                auto_write=False, **LEDS)
+
+    return Rig("kngyt", pixels, [ PixelSlice(pixels, 0, 10, mapping=KNGYT_MATRIX) ], [ pixels ])
+
+
+def beatboxer():
+    pixels = NeoPixelBackground(board.NEOPIXEL, 8, pixel_order="GRB",
+                                auto_write=False, **LEDS)
+
+    return Rig("beatboxer", pixels, [ PixelSlice(pixels, 0, 8) ], [ pixels ])
+
+
+def single256():
+    pixels = NeoPixelBackground(board.NEOPIXEL, 256, pixel_order="GRB",
+                                auto_write=False, deferred=True, double_buffer=True, **LEDS)
+    views = [ PixelSlice(pixels, i * 64, 64) for i in range(4) ]
+
+    return Rig("single-256", pixels, views, [ pixels ])
+
+
+def strips4x64():
+    strips = LEDStrips([ (getattr(board, "LED%d" % i), 64) for i in range(4) ],
+                       pixel_order="GRB", double_buffer=True, **LEDS)
+
+    # Views that straddle the strips, to make sure that works too.
+    views = [ strips.view(32 + (i * 64), 64) for i in range(3) ] + \
+            [ strips.view(0, 32), strips.view(224, 32) ]
+
+    return Rig("strips-4x64", strips, views, strips.strips)
+
+
+CONFIGS = [
+    ("kngxt", kngxt),
+    ("kngyt", kngyt),
+    ("beatboxer", beatboxer),
+    ("single-256", single256),
+    ("strips-4x64", strips4x64),
+]
+
+
+def animation(n):
+    """
+    A breathing rainbow for n pixels: CYCLE frames of n (r, g, b) colors.
+    """
+    frames = []
+
+    for j in range(CYCLE):
+        frame = []
+
+        for k in range(n):
+            phase = 2 * math.pi * ((j / CYCLE) + (k / n))
+            level = 0.5 - (0.5 * math.cos(2 * math.pi * j / CYCLE))
+            frame.append(tuple(int(255 * level * (0.5 + 0.5 * math.sin(phase + offset)))
+                               for offset in (0, 2.1, 4.2)))
+
+        frames.append(frame)
+
+    return frames
+
+
+def expected_bytes(rig, last):
+    """
+    What each strip should be sending, given the last colors drawn into
+    each view: a list of (bytes, slack), one per strip, where slack says
+    how far above each byte a dithered view is allowed to go.
+    """
+    out = [ bytearray(len(s) * s.bpp) for s in rig.strips ]
+    slack = [ bytearray(len(s) * s.bpp) for s in rig.strips ]
+
+    for view, colors in zip(rig.views, last):
+        for k, color in enumerate(colors):
+            index = view.offset + view.mapping[k]
+
+            if isinstance(rig.driver, LEDStrips):
+                s, index = rig.driver._locate(index)
+            else:
+                s = 0
+
+            strip = rig.strips[s]
+            o = index * strip.bpp
+
+            for c, value in enumerate(color):
+                i = o + strip.byteorder.index("RGBW"[c])
+
+                if view._targets is not None:
+                    fine = strip.fine_luts[c][value]
+                    out[s][i] = fine >> 8
+                    slack[s][i] = 1 if (fine & 0xFF) else 0
+                elif strip.luts:
+                    out[s][i] = strip.luts[c][value]
+                else:
+                    out[s][i] = int(value * strip.brightness)
+
+    return [ (bytes(b), bytes(d)) for b, d in zip(out, slack) ]
+
+
+def matches(data, want, slack):
+    return (len(data) == len(want)) and \
+           all(0 <= (d - w) <= s for d, w, s in zip(data, want, slack))
+
+
+def wire_time(strip):
+    frames = strip._sm.frames
+
+    if not frames:
+        return 0.0
+
+    f = frames[-1]
+
+    return ((f.bits * rp2pio.CYCLES_PER_BIT) + f.delay) / strip._sm.frequency
+
+
+def allocations(rig, pushes=1000):
+    """
+    Bytes allocated (at peak) by pushes rounds of show() and flush() on a
+    strip, over and above what the loop itself costs, for the worst of the
+    rig's strips.
+    """
+    def run(fn, n):
+        for _ in itertools.repeat(None, n):
+            fn()
+
+    def nothing():
+        pass
+
+    def pusher(strip):
+        # Bound up front, so that the loop doesn't allocate anything of its
+        # own to be counted.
+        show = strip.show
+        flush = strip.flush
+
+        def push():
+            show()
+            flush()
+
+        return push
+
+    rp2pio.recording = False
+    rp2pio.timing = False
+
+    dithering = [ strip.dithering[:] for strip in rig.strips ]
+
+    for strip in rig.strips:
+        strip.dithering.clear()
+
+    try:
+        measured = []
+
+        for fn in [ nothing ] + [ pusher(strip) for strip in rig.strips ]:
+            run(fn, 10)
+
+            tracemalloc.start()
+            run(fn, 10)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            run(fn, pushes)
+            measured.append(tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+
+        worst = max(0, max(measured[1:]) - measured[0])
+    finally:
+        rp2pio.recording = True
+        rp2pio.timing = True
+
+        for strip, views in zip(rig.strips, dithering):
+            strip.dithering.extend(views)
+
+    return worst
+
+
+def render_time(rig, renders=1000):
+    """
+    Host CPU time for one dithered frame of every dithering view in the
+    rig, or None if there aren't any.
+    """
+    views = [ view for view in rig.views if view._targets is not None ]
+
+    if not views:
+        return None
+
+    start = time.perf_counter()
+
+    for _ in range(renders):
+        for view in views:
+            view._render()
+
+    return (time.perf_counter() - start) / renders
+
+
+def bench(make, seconds, measure_alloc=True):
+    hostsim.reset()
+    rig = make()
+
+    animations = [ animation(len(v)) for v in rig.views ]
+    last = None
+
+    start = time.monotonic()
+    loops = 0
+    drawing = 0.0
+    deferred = getattr(rig.driver, "deferred", True)
+
+    while True:
+        j = loops % CYCLE
+        last = [ a[j] for a in animations ]
+
+        for view, colors in zip(rig.views, last):
+            t = time.perf_counter()
+            view.write_frame(colors)
+
+            if deferred:
+                view.show()
+                drawing += time.perf_counter() - t
+            else:
+                drawing += time.perf_counter() - t
+                view.show()
+
+        rig.driver.flush()
+        loops += 1
+
+        elapsed = time.monotonic() - start
+
+        if elapsed >= seconds:
+            break
+
+    frames = [ f for s in rig.strips for f in s._sm.frames ]
+
+    # Let everything drain, then send whatever was still pending, so that
+    # the last frame on each strip is the last thing drawn.
+    while not all(s.frame_done for s in rig.strips):
+        time.sleep(0.001)
+
+    rig.driver.flush()
+
+    check = all(s._sm.frames and matches(s._sm.frames[-1].data, want, slack)
+                for s, (want, slack) in zip(rig.strips, expected_bytes(rig, last)))
+
+    # After the check, since rendering moves the dithering along.
+    render = render_time(rig)
+
+    return {
+        "rig": rig,
+        "loops": loops / elapsed,
+        "draw": drawing / loops,
+        "fps": len(frames) / elapsed / len(rig.strips),
+        "bytes": (sum(f.size for f in frames) / len(frames)) if frames else 0,
+        "wire": max(wire_time(s) for s in rig.strips),
+        "render": render,
+        "alloc": allocations(rig) if measure_alloc else None,
+        "check": check,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the LED pipeline on the host simulator.")
+    parser.add_argument("--only", action="append", default=None, metavar="GLOB",
+                        help="only run configurations matching GLOB (may be repeated)")
+    parser.add_argument("--seconds", type=float, default=1.0,
+                        help="how long to run each configuration (default: %(default)s)")
+    parser.add_argument("--linear", action="store_true",
+                        help="scale brightness in the pixelbuf rather than with lookup tables")
+    parser.add_argument("--no-alloc", dest="alloc", action="store_false",
+                        help="don't measure allocations")
+
+    args = parser.parse_args(argv)
+
+    if args.linear:
+        LEDS.clear()
+        LEDS.update(LINEAR)
+
+    selected = [ make for name, make in CONFIGS
+                 if (args.only is None) or any(fnmatch.fnmatch(name, g) for g in args.only) ]
+
+    print("%-12s %5s %6s %9s %9s %9s %9s %11s %10s %8s %10s  %s" %
+          ("Config", "LEDs", "Strips", "Loops/s", "Draw/loop", "Render", "Frames/s", "Bytes/frame",
+           "Wire/frame", "Max fps", "Alloc/push", "Check"))
+
+    failed = 0
+
+    for make in selected:
+        r = bench(make, args.seconds, measure_alloc=args.alloc)
+        rig = r["rig"]
+
+        alloc = "%dB" % r["alloc"] if args.alloc else "-"
+        render = "%.1fus" % (r["render"] * 1e6) if r["render"] is not None else "-"
+
+        if (not r["check"]) or r["alloc"]:
+            failed += 1
+
+        print("%-12s %5d %6d %9.0f %7.1fus %9s %9.1f %11.0f %8.2fms %8.0f %10s  %s" %
+              (rig.name, rig.leds, len(rig.strips), r["loops"], r["draw"] * 1e6, render, r["fps"], r["bytes"],
+               r["wire"] * 1000, (1 / r["wire"]) if r["wire"] else 0, alloc,
+               "ok" if r["check"] else "FAILED"))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,600 @@
+import sys
+
+import argparse
+import os
+import struct
+import time
+import zlib
+
+# mkfat builds a FAT12/16 filesystem image in memory from a directory tree,
+# without mkfs.fat, loop mounts, or root. build-uf2 uses it (by way of
+# mkuf2.py) to build the CIRCUITPY volume; run it directly to get a plain
+# image file for poking at with other tools.
+
+SECTOR_SIZE = 512
+DIRENT_SIZE = 32
+ROOT_ENTRIES = 512
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LFN = 0x0F
+
+LFN_CHARS = 13
+
+FAT12_MAX_CLUSTERS = 4084
+FAT16_MAX_CLUSTERS = 65524
+
+# Characters allowed in a short name. Generated short names replace anything
+# else with an underscore.
+SHORT_NAME_VALID = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$%'-_@~`!(){}^#&")
+
+# The same little x86 stub mkfs.fat uses: print the message that follows it
+# and wait for a key, in case anyone tries to boot the volume.
+BOOT_CODE = (b"\x0e\x1f\xbe\x5b\x7c\xac\x22\xc0\x74\x0b\x56\xb4\x0e\xbb\x07\x00"
+             b"\xcd\x10\x5e\xeb\xf0\x32\xe4\xcd\x16\xcd\x19\xeb\xfe")
+BOOT_CODE_OFFSET = 0x3E
+
+DEFAULT_BOOT_MESSAGE = "This is not a bootable disk. Please don't try to boot it.\n"
+
+
+def fat_date_time(mtime, utc=False):
+    """
+    Convert a Unix timestamp to FAT (date, time) words, in local time as FAT
+    expects (or in UTC, if utc is set). FAT can't go earlier than 1980, so
+    clamp there.
+    """
+    tm = time.gmtime(mtime) if utc else time.localtime(mtime)
+
+    if tm.tm_year < 1980:
+        return ((0 << 9) | (1 << 5) | 1), 0
+
+    date = ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday
+    tod = (tm.tm_hour << 11) | (tm.tm_min << 5) | (min(tm.tm_sec, 59) // 2)
+
+    return date, tod
+
+
+def lfn_checksum(short_name):
+    csum = 0
+
+    for c in short_name:
+        csum = ((((csum & 1) << 7) + (csum >> 1)) + c) & 0xFF
+
+    return csum
+
+
+def short_name_for(name):
+    """
+    If name can be stored as a plain 8.3 short name, return it as 11 padded
+    bytes. Otherwise, return None: it needs a long name.
+
+    Like Linux's default "shortname=mixed", anything that isn't already all
+    uppercase gets a long name, rather than relying on the NTRes lowercase
+    flags that not every FAT implementation honors.
+    """
+    if name in (".", ".."):
+        return None
+
+    base, dot, ext = name.rpartition(".")
+
+    if not dot:
+        base, ext = name, ""
+
+    if (not base) or (len(base) > 8) or (len(ext) > 3):
+        return None
+
+    if not all(c in SHORT_NAME_VALID for c in base + ext):
+        return None
+
+    return base.ljust(8).encode("ascii") + ext.ljust(3).encode("ascii")
+
+
+def basis_name(name):
+    """
+    Generate the uppercase base and extension used to make a numbered short
+    name ("KEYMAP~1.MPY") for a name that needs a long name.
+    """
+    def clean(s):
+        out = ""
+
+        for c in s.upper():
+            if c in (" ", "."):
+                continue
+            elif c in SHORT_NAME_VALID:
+                out += c
+            else:
+                out += "_"
+
+        return out
+
+    stripped = name.lstrip(".")
+    base, dot, ext = stripped.rpartition(".")
+
+    if not dot:
+        base, ext = stripped, ""
+
+    return clean(base) or "_", clean(ext)[:3]
+
+
+class FATNode:
+    def __init__(self, name, mtime):
+        self.name = name
+        self.mtime = mtime
+        self.short_name = None
+        self.needs_lfn = False
+        self.first_cluster = 0
+        self.cluster_count = 0
+
+    def dirent_count(self):
+        if not self.needs_lfn:
+            return 1
+
+        return 1 + (len(self.name) + LFN_CHARS - 1) // LFN_CHARS
+
+
+class FATFile(FATNode):
+    attr = ATTR_ARCHIVE
+
+    def __init__(self, name, mtime, path=None, data=None):
+        super().__init__(name, mtime)
+        self.path = path
+        self.data = data
+
+        if data is not None:
+            self.size = len(data)
+        else:
+            self.size = os.path.getsize(path)
+
+
+class FATDirectory(FATNode):
+    attr = ATTR_DIRECTORY
+
+    def __init__(self, name, mtime):
+        super().__init__(name, mtime)
+        self.children = []
+
+    def add(self, node):
+        self.children.append(node)
+        return node
+
+    def find(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+
+        return None
+
+
+class FATImage:
+    """
+    FATImage collects a tree of files and directories and lays it out as a
+    FAT12 or FAT16 volume of a fixed size. Every file and directory is
+    stored in a single contiguous run of clusters, allocated in tree order,
+    so the image is compact and its FAT chains are trivial.
+
+    Usage:
+
+        fat = FATImage(8 * 1024 * 1024, label="MACROPAW")
+        fat.add_tree("/path/to/staging")
+        image = fat.build()         # a bytearray of the whole volume
+
+    With timestamp set (a Unix time, as in SOURCE_DATE_EPOCH), every file
+    and directory gets that time, in UTC, instead of its own mtime; and
+    unless volume_id is given, it's a CRC of the rest of the volume. So the
+    same tree always builds the same image, byte for byte, which is what
+    lets mkuf2.py --update tell that nothing changed.
+    """
+
+    def __init__(self, size, label="NO NAME", boot_message=None, volume_id=None,
+                 timestamp=None):
+        if size % SECTOR_SIZE:
+            raise ValueError("Image size must be a multiple of %d" % SECTOR_SIZE)
+
+        self.size = size
+        self.label = label.upper()[:11]
+        self.boot_message = boot_message if boot_message is not None else DEFAULT_BOOT_MESSAGE
+        self.volume_id = volume_id
+        self.timestamp = timestamp
+        self.root = FATDirectory("", self._mtime(None))
+
+        self._choose_geometry()
+
+    def _choose_geometry(self):
+        total_sectors = self.size // SECTOR_SIZE
+        root_sectors = (ROOT_ENTRIES * DIRENT_SIZE) // SECTOR_SIZE
+
+        self.total_sectors = total_sectors
+        self.reserved_sectors = 1
+        self.num_fats = 2
+        self.root_sectors = root_sectors
+
+        # Use the smallest cluster that keeps us within FAT16; small clusters
+        # waste less space on the many small files we store.
+        for spc in (1, 2, 4, 8, 16, 32, 64):
+            fat_sectors = 1
+
+            # The FAT size depends on the cluster count, which depends on the
+            # FAT size. Iterate until it settles.
+            while True:
+                data_sectors = (total_sectors - self.reserved_sectors -
+                                (self.num_fats * fat_sectors) - root_sectors)
+                clusters = data_sectors // spc
+
+                if clusters <= FAT12_MAX_CLUSTERS:
+                    needed = (((clusters + 2) * 3 + 1) // 2 + SECTOR_SIZE - 1) // SECTOR_SIZE
+                else:
+                    needed = ((clusters + 2) * 2 + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+                if needed <= fat_sectors:
+                    break
+
+                fat_sectors = needed
+
+            if clusters <= FAT16_MAX_CLUSTERS:
+                break
+        else:
+            raise ValueError("Image size %d is too large for FAT16" % self.size)
+
+        if clusters < 1:
+            raise ValueError("Image size %d is too small for a FAT volume" % self.size)
+
+        self.sectors_per_cluster = spc
+        self.cluster_size = spc * SECTOR_SIZE
+        self.fat_sectors = fat_sectors
+        self.cluster_count = clusters
+        self.fat_bits = 12 if clusters <= FAT12_MAX_CLUSTERS else 16
+
+        self.fat_offset = self.reserved_sectors * SECTOR_SIZE
+        self.root_offset = self.fat_offset + (self.num_fats * fat_sectors * SECTOR_SIZE)
+        self.data_offset = self.root_offset + (root_sectors * SECTOR_SIZE)
+
+    def _mtime(self, mtime):
+        if self.timestamp is not None:
+            return self.timestamp
+
+        return mtime if mtime is not None else time.time()
+
+    def makedirs(self, path, mtime=None):
+        """
+        Return the FATDirectory for a slash-separated path, creating any
+        missing directories along the way.
+        """
+        node = self.root
+
+        for part in [ p for p in path.split("/") if p ]:
+            child = node.find(part)
+
+            if child is None:
+                child = node.add(FATDirectory(part, self._mtime(mtime)))
+            elif not isinstance(child, FATDirectory):
+                raise ValueError("%s: %s is a file, not a directory" % (path, part))
+
+            node = child
+
+        return node
+
+    def add_file(self, path, source=None, data=None, mtime=None):
+        """
+        Add a file at a slash-separated path in the image, with its contents
+        taken either from a host file (source) or from bytes (data).
+        """
+        dirname, _, name = path.rpartition("/")
+        parent = self.makedirs(dirname)
+
+        if (mtime is None) and (source is not None):
+            mtime = os.path.getmtime(source)
+
+        mtime = self._mtime(mtime)
+
+        existing = parent.find(name)
+
+        if existing is not None:
+            parent.children.remove(existing)
+
+        return parent.add(FATFile(name, mtime, path=source, data=data))
+
+    def add_tree(self, source, dest=""):
+        """
+        Recursively add everything under a host directory.
+        """
+        for entry in sorted(os.scandir(source), key=lambda e: e.name):
+            mtime = entry.stat().st_mtime
+            target = dest + "/" + entry.name if dest else entry.name
+
+            if entry.is_dir():
+                self.makedirs(target, mtime)
+                self.add_tree(entry.path, target)
+            elif entry.is_file():
+                self.add_file(target, source=entry.path, mtime=mtime)
+
+    def _assign_short_names(self, directory):
+        taken = set()
+
+        for child in directory.children:
+            short_name = short_name_for(child.name)
+
+            if (short_name is not None) and (short_name not in taken):
+                child.short_name = short_name
+                child.needs_lfn = False
+            else:
+                child.needs_lfn = True
+                child.short_name = None
+
+            if child.short_name is not None:
+                taken.add(child.short_name)
+
+        for child in directory.children:
+            if child.short_name is None:
+                base, ext = basis_name(child.name)
+
+                for n in range(1, 1000000):
+                    tail = "~%d" % n
+                    candidate = ((base[:8 - len(tail)] + tail).ljust(8).encode("ascii") +
+                                 ext.ljust(3).encode("ascii"))
+
+                    if candidate not in taken:
+                        break
+                else:
+                    raise ValueError("Too many files like %s" % child.name)
+
+                child.short_name = candidate
+                taken.add(candidate)
+
+            if isinstance(child, FATDirectory):
+                self._assign_short_names(child)
+
+    def _directory_size(self, directory):
+        entries = sum(child.dirent_count() for child in directory.children)
+
+        if directory is self.root:
+            # The root also holds the volume label.
+            return (entries + 1) * DIRENT_SIZE
+
+        # Subdirectories also hold "." and "..".
+        return (entries + 2) * DIRENT_SIZE
+
+    def _allocate(self, directory, next_cluster):
+        """
+        Give every node below directory a contiguous run of clusters,
+        starting at next_cluster. Returns the next free cluster.
+        """
+        if directory is not self.root:
+            directory.cluster_count = (self._directory_size(directory) + self.cluster_size - 1) // self.cluster_size
+            directory.first_cluster = next_cluster
+            next_cluster += directory.cluster_count
+
+        for child in directory.children:
+            if isinstance(child, FATFile):
+                child.cluster_count = (child.size + self.cluster_size - 1) // self.cluster_size
+                child.first_cluster = next_cluster if child.cluster_count else 0
+                next_cluster += child.cluster_count
+
+        for child in directory.children:
+            if isinstance(child, FATDirectory):
+                next_cluster = self._allocate(child, next_cluster)
+
+        if next_cluster > self.cluster_count + 2:
+            raise ValueError("Filesystem image is full: need %d clusters, have %d" %
+                             (next_cluster - 2, self.cluster_count))
+
+        return next_cluster
+
+    def _set_fat(self, fat, cluster, value):
+        if self.fat_bits == 16:
+            struct.pack_into("<H", fat, cluster * 2, value)
+        else:
+            offset = cluster + (cluster // 2)
+
+            if cluster & 1:
+                fat[offset] = (fat[offset] & 0x0F) | ((value & 0x0F) << 4)
+                fat[offset + 1] = (value >> 4) & 0xFF
+            else:
+                fat[offset] = value & 0xFF
+                fat[offset + 1] = (fat[offset + 1] & 0xF0) | ((value >> 8) & 0x0F)
+
+    def _chain(self, fat, node):
+        eoc = 0xFFFF if self.fat_bits == 16 else 0xFFF
+
+        for i in range(node.cluster_count):
+            cluster = node.first_cluster + i
+            last = (i == node.cluster_count - 1)
+            self._set_fat(fat, cluster, eoc if last else cluster + 1)
+
+    def _dirent(self, short_name, attr, mtime, cluster, size):
+        date, tod = fat_date_time(mtime, utc=(self.timestamp is not None))
+
+        return struct.pack("<11sBBBHHHHHHHI",
+                           short_name, attr, 0, 0, tod, date, date,
+                           0, tod, date, cluster, size)
+
+    @staticmethod
+    def _lfn_entries(name, short_name):
+        csum = lfn_checksum(short_name)
+        units = name.encode("utf-16-le")
+        chars = [ units[i:i + 2] for i in range(0, len(units), 2) ]
+        count = (len(chars) + LFN_CHARS - 1) // LFN_CHARS
+
+        # Terminate with a NUL (if there's room), then pad with 0xFFFF.
+        if len(chars) % LFN_CHARS:
+            chars.append(b"\x00\x00")
+
+        while len(chars) < count * LFN_CHARS:
+            chars.append(b"\xFF\xFF")
+
+        entries = []
+
+        # Long name entries are stored last piece first.
+        for seq in range(count, 0, -1):
+            piece = chars[(seq - 1) * LFN_CHARS:seq * LFN_CHARS]
+            ordinal = seq | (0x40 if seq == count else 0)
+
+            entries.append(struct.pack("<B10sBBB12sH4s",
+                                       ordinal, b"".join(piece[0:5]), ATTR_LFN, 0, csum,
+                                       b"".join(piece[5:11]), 0, b"".join(piece[11:13])))
+
+        return entries
+
+    def _directory_bytes(self, directory, parent):
+        entries = []
+
+        if directory is self.root:
+            label = self.label.ljust(11).encode("ascii")
+            entries.append(self._dirent(label, ATTR_VOLUME_ID, directory.mtime, 0, 0))
+        else:
+            parent_cluster = 0 if parent is self.root else parent.first_cluster
+
+            entries.append(self._dirent(b".          ", ATTR_DIRECTORY, directory.mtime,
+                                        directory.first_cluster, 0))
+            entries.append(self._dirent(b"..         ", ATTR_DIRECTORY, directory.mtime,
+                                        parent_cluster, 0))
+
+        for child in directory.children:
+            if child.needs_lfn:
+                entries.extend(self._lfn_entries(child.name, child.short_name))
+
+            size = child.size if isinstance(child, FATFile) else 0
+            entries.append(self._dirent(child.short_name, child.attr, child.mtime,
+                                        child.first_cluster, size))
+
+        return b"".join(entries)
+
+    def _boot_sector(self):
+        sector = bytearray(SECTOR_SIZE)
+
+        total16 = self.total_sectors if self.total_sectors < 0x10000 else 0
+        total32 = 0 if total16 else self.total_sectors
+        fstype = b"FAT12   " if self.fat_bits == 12 else b"FAT16   "
+
+        struct.pack_into("<3s8sHBHBHHBHHHII", sector, 0,
+                         b"\xEB\x3C\x90", b"MACROPAW",
+                         SECTOR_SIZE, self.sectors_per_cluster, self.reserved_sectors,
+                         self.num_fats, ROOT_ENTRIES, total16, 0xF8, self.fat_sectors,
+                         32, 64, 0, total32)
+
+        struct.pack_into("<BBBI11s8s", sector, 36,
+                         0x80, 0, 0x29, self.volume_id or 0,
+                         self.label.ljust(11).encode("ascii"), fstype)
+
+        message = self.boot_message.replace("\r\n", "\n").replace("\n", "\r\n").encode("ascii", "replace")
+        room = 510 - BOOT_CODE_OFFSET - len(BOOT_CODE) - 1
+        boot = BOOT_CODE + message[:room] + b"\x00"
+
+        sector[BOOT_CODE_OFFSET:BOOT_CODE_OFFSET + len(boot)] = boot
+        sector[510:512] = b"\x55\xAA"
+
+        return sector
+
+    def build(self):
+        """
+        Lay out the tree and return the complete volume as a bytearray.
+        """
+        self._assign_short_names(self.root)
+
+        if self._directory_size(self.root) > ROOT_ENTRIES * DIRENT_SIZE:
+            raise ValueError("Too many entries in the root directory")
+
+        self._allocate(self.root, 2)
+
+        image = bytearray(self.size)
+        view = memoryview(image)
+
+        image[0:SECTOR_SIZE] = self._boot_sector()
+
+        fat = bytearray(self.fat_sectors * SECTOR_SIZE)
+        media = 0xFFF8 if self.fat_bits == 16 else 0xFF8
+        self._set_fat(fat, 0, media)
+        self._set_fat(fat, 1, 0xFFFF if self.fat_bits == 16 else 0xFFF)
+
+        pending = [ (self.root, None) ]
+
+        while pending:
+            directory, parent = pending.pop()
+            contents = self._directory_bytes(directory, parent)
+
+            if directory is self.root:
+                image[self.root_offset:self.root_offset + len(contents)] = contents
+            else:
+                self._chain(fat, directory)
+                offset = self._cluster_offset(directory.first_cluster)
+                image[offset:offset + len(contents)] = contents
+
+            for child in directory.children:
+                if isinstance(child, FATDirectory):
+                    pending.append((child, directory))
+                elif child.cluster_count:
+                    self._chain(fat, child)
+                    offset = self._cluster_offset(child.first_cluster)
+
+                    if child.data is not None:
+                        image[offset:offset + child.size] = child.data
+                    else:
+                        with open(child.path, "rb") as f:
+                            f.readinto(view[offset:offset + child.size])
+
+        for i in range(self.num_fats):
+            offset = self.fat_offset + (i * len(fat))
+            image[offset:offset + len(fat)] = fat
+
+        if self.volume_id is None:
+            # The volume ID is supposed to tell one volume from another, and
+            # the time is the traditional way to do that -- but for a
+            # reproducible image, use a CRC of everything else instead.
+            volume_id = int(time.time()) if self.timestamp is None else zlib.crc32(image)
+            struct.pack_into("<I", image, 39, volume_id & 0xFFFFFFFF)
+
+        return image
+
+    def _cluster_offset(self, cluster):
+        return self.data_offset + ((cluster - 2) * self.cluster_size)
+
+
+def parse_size(text):
+    """
+    Parse a size like "8M", "512K", or "8388608".
+    """
+    multipliers = { "K": 1024, "M": 1024 * 1024 }
+    suffix = text[-1:].upper()
+
+    if suffix in multipliers:
+        return int(text[:-1]) * multipliers[suffix]
+
+    return int(text)
+
+
+def source_date_epoch():
+    """
+    The SOURCE_DATE_EPOCH environment variable, as an int, or None.
+    """
+    value = os.environ.get("SOURCE_DATE_EPOCH")
+
+    return int(value) if value else None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build a FAT12/16 image from a directory.")
+    parser.add_argument("--size", default="8M", help="image size (default: 8M)")
+    parser.add_argument("--label", default="NO NAME", help="volume label")
+    parser.add_argument("--boot-message", default=None,
+                        help="message shown if someone tries to boot the volume")
+    parser.add_argument("--timestamp", type=int, default=source_date_epoch(),
+                        help="give every file this Unix time, for a reproducible image "
+                             "(default: $SOURCE_DATE_EPOCH, if set)")
+    parser.add_argument("source", help="directory to copy into the image")
+    parser.add_argument("image", help="image file to write")
+
+    args = parser.parse_args(argv)
+
+    fat = FATImage(parse_size(args.size), label=args.label, boot_message=args.boot_message,
+                   timestamp=args.timestamp)
+    fat.add_tree(args.source)
+
+    with open(args.image, "wb") as f:
+        f.write(fat.build())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
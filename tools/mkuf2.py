@@ -1,47 +1,100 @@
 import sys
 
+import argparse
+import hashlib
+import heapq
+import mmap
+import os
+import shutil
 import struct
+import tempfile
+
+from mkfat import FATImage, parse_size, source_date_epoch
 
 UF2_MAGIC_START0 = 0x0A324655 # "UF2\n"
 UF2_MAGIC_START1 = 0x9E5D5157 # Randomly selected
 UF2_MAGIC_END    = 0x0AB16F30 # Ditto
 
+RP2040_FAMILY_ID = 0xE48BFF56
 
 PAGE_SIZE = 4096
 BLOCK_SIZE = 256
 BLOCKS_PER_PAGE = (PAGE_SIZE // BLOCK_SIZE)
 
+# Precompiled structs for the UF2 record header and end magic.
+UF2_HEADER = struct.Struct(b"<IIIIIIII")
+UF2_END = struct.Struct(b"<I")
+
+# A single all-zero block, shared by every hole we fill and used as the
+# reference for zero checks.
+ZERO_BLOCK = bytes(BLOCK_SIZE)
+
+
+def is_zero(data):
+    """
+    Check whether a block's data is all zeroes. ZERO_BLOCK.startswith does a
+    straight memory compare against any bytes-like object no longer than
+    BLOCK_SIZE, without copying it.
+    """
+    return ZERO_BLOCK.startswith(data)
+
+
+# UF2 flag: the family ID field is present.
+UF2_FLAG_FAMILY_ID = 0x2000
+
+
 class Block:
-    def __init__(self, flags, addr, data):
+    def __init__(self, flags, addr, data, family=None):
         self.flags = flags
         self.addr = addr
         self.data = data
+        self.family = family
+
+    def is_filler(self):
+        """
+        A filler Block is a full-sized, all-zero block with the default
+        flags: writing it is exactly the same as leaving a hole in its Page.
+        """
+        return (self.flags == 0x2000) and (len(self.data) == BLOCK_SIZE) and is_zero(self.data)
 
 
 class Page:
+    """
+    A Page is sparse: holes are filled from ZERO_BLOCK when the Page is
+    iterated, and a bitmask of slots holding nonzero data makes all_zeroes()
+    a single comparison.
+    """
+
     def __init__(self, baseaddr):
         self.blocks = [ None ] * BLOCKS_PER_PAGE
         self.baseaddr = baseaddr
+        self.nonzero = 0
 
     def add_block(self, block):
         page_offset = (block.addr - self.baseaddr) // BLOCK_SIZE
 
         self.blocks[page_offset] = block
 
+        if is_zero(block.data):
+            self.nonzero &= ~(1 << page_offset)
+        else:
+            self.nonzero |= (1 << page_offset)
+
     def all_zeroes(self):
-        for i in range(BLOCKS_PER_PAGE):
-            if self.blocks[i]:
-                data = self.blocks[i].data
+        return self.nonzero == 0
+
+    def digest(self):
+        h = hashlib.sha256()
 
-                if any(map(bool, data)):
-                    return False
-        
-        return True
+        for block in self:
+            h.update(block.data)
+
+        return h.digest()
 
     def __iter__(self):
         for i in range(BLOCKS_PER_PAGE):
             if not self.blocks[i]:
-                yield Block(0x2000, self.baseaddr + (i * BLOCK_SIZE), b"\x00" * BLOCK_SIZE)
+                yield Block(0x2000, self.baseaddr + (i * BLOCK_SIZE), ZERO_BLOCK)
             else:
                 yield self.blocks[i]
 
@@ -61,10 +114,71 @@ class PageMap:
         page_base = (block.addr // PAGE_SIZE) * PAGE_SIZE
         pkey = "%08X" % page_base
 
-        if not self.pages.get(pkey):
-            self.pages[pkey] = Page(page_base)
+        page = self.pages.get(pkey)
+
+        if not page:
+            # Most of a filesystem image is empty, so don't bother creating
+            # Pages that would only ever hold filler.
+            if block.is_filler():
+                return
+
+            page = self.pages[pkey] = Page(page_base)
+
+        page.add_block(block)
+
 
-        self.pages[pkey].add_block(block)
+class PageStream:
+    """
+    PageStream is the streaming counterpart of PageMap: rather than collecting
+    every Block up front, it merges several address-ordered Block sources and
+    hands back one Page at a time, so only the Page currently being assembled
+    is ever held in memory.
+
+    As with PageMap, when two sources supply the same address, the source
+    given later wins.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    @staticmethod
+    def _ordered(index, source):
+        last_addr = None
+
+        for block in source:
+            if (last_addr is not None) and (block.addr < last_addr):
+                raise ValueError("Input %d is not in address order at %08X; "
+                                 "use --buffered instead" % (index, block.addr))
+
+            last_addr = block.addr
+
+            # The index breaks ties between sources, so that a later source
+            # sorts after (and thus overrides) an earlier one.
+            yield (block.addr, index, block)
+
+    def __iter__(self):
+        merged = heapq.merge(*[ self._ordered(i, source)
+                                for i, source in enumerate(self.sources) ])
+
+        page = None
+
+        for _, _, block in merged:
+            page_base = (block.addr // PAGE_SIZE) * PAGE_SIZE
+
+            if (page is None) or (page.baseaddr != page_base):
+                # As with PageMap, filler never needs a Page of its own.
+                if block.is_filler():
+                    continue
+
+                if page is not None:
+                    yield page
+
+                page = Page(page_base)
+
+            page.add_block(block)
+
+        if page is not None:
+            yield page
 
 
 class UF2Reader:
@@ -106,7 +220,8 @@ class UF2Reader:
             if not good:
                 continue
 
-            yield Block(flags, addr, rawblock[32:32 + datalen])
+            yield Block(flags, addr, rawblock[32:32 + datalen],
+                        family if (flags & UF2_FLAG_FAMILY_ID) else None)
 
 
 class BinaryReader:
@@ -128,77 +243,454 @@ class BinaryReader:
             yield block
 
 
-pagemap = PageMap()
+class MappedUF2Reader:
+    """
+    MappedUF2Reader is a UF2Reader that maps its file into memory rather than
+    reading it: headers are parsed in place with UF2_HEADER.unpack_from, and
+    each Block's data is a memoryview into the mapping, so nothing is copied
+    until the block is actually written out.
+    """
 
-for arg in sys.argv[1:]:
-    if ":" in arg:
-        addr, filename = arg.split(":", 1)
-        addr = int(addr, 16)
+    def __init__(self, path):
+        self.path = path
+        self.view = map_file(path)
+        self.ptr = 0
 
-        sys.stderr.write("@%08X -- %s\n" % (addr, filename))
+    def __iter__(self):
+        view = self.view
+        unpack_from = UF2_HEADER.unpack_from
+        end_from = UF2_END.unpack_from
 
-        for block in BinaryReader(filename, addr):
-            pagemap.add_block(block)
-    else:
-        sys.stderr.write("UF2 -- %s\n" % arg)
+        for ptr in range(0, len(view) - 511, 512):
+            self.ptr = ptr
+
+            (magic_start0, magic_start1, flags, addr,
+             datalen, blkno, totalblks, family) = unpack_from(view, ptr)
+
+            if datalen > 476:
+                assert False, "Invalid UF2 data size at %08X" % ptr
+
+            if (magic_start0 != UF2_MAGIC_START0) or (magic_start1 != UF2_MAGIC_START1):
+                continue
+
+            if end_from(view, ptr + 508)[0] != UF2_MAGIC_END:
+                continue
+
+            if flags & 1:
+                continue
+
+            yield Block(flags, addr, view[ptr + 32:ptr + 32 + datalen],
+                        family if (flags & UF2_FLAG_FAMILY_ID) else None)
+
+
+class BufferReader:
+    """
+    BufferReader splits a raw image that's already in memory into Blocks,
+    each of which holds a memoryview into the buffer rather than a copy.
+    """
+
+    def __init__(self, buffer, baseaddr):
+        self.view = memoryview(buffer)
+        self.ptr = baseaddr
+
+    def __iter__(self):
+        view = self.view
+
+        for offset in range(0, len(view), BLOCK_SIZE):
+            rawblock = view[offset:offset + BLOCK_SIZE]
+
+            block = Block(0x2000, self.ptr, rawblock)
+            self.ptr += len(rawblock)
+
+            yield block
+
+
+class MappedBinaryReader(BufferReader):
+    """
+    MappedBinaryReader is the memory-mapped counterpart of BinaryReader: its
+    Blocks hand out memoryviews into the mapped file instead of copies.
+    """
+
+    def __init__(self, path, baseaddr):
+        super().__init__(map_file(path), baseaddr)
+        self.path = path
+
+
+class ImageBuffer:
+    """
+    ImageBuffer stands in for a filename in the inputs list when the raw
+    image was built in memory, such as a FAT image built from a directory.
+    """
+
+    def __init__(self, description, data):
+        self.description = description
+        self.data = data
 
-        for block in UF2Reader(arg):
+    def __str__(self):
+        return self.description
+
+
+def map_file(path):
+    """
+    Map a file read-only and return a memoryview of it. Empty files can't be
+    mapped, so they get an empty view instead.
+    """
+    with open(path, "rb") as f:
+        try:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:
+            return memoryview(b"")
+
+
+class UF2Writer:
+    """
+    UF2Writer turns Blocks into 512-byte UF2 records on an output stream,
+    logging each contiguous address range to stderr as it goes. The total
+    block count has to be known up front, since every record carries it.
+
+    Every record is assembled in the same preallocated buffer, so the only
+    copy of a block's data is the one into that buffer.
+    """
+
+    def __init__(self, output, total_blocks, family=RP2040_FAMILY_ID):
+        self.output = output
+        self.total_blocks = total_blocks
+        self.family = family
+        self.blockno = 0
+
+        self.sequence_start = None
+        self.wanted_addr = None
+
+        # Everything past the data is zero padding plus the end magic, and
+        # never changes.
+        self.record = bytearray(512)
+        UF2_END.pack_into(self.record, 508, UF2_MAGIC_END)
+
+    def write(self, block):
+        datalen = len(block.data)
+
+        if self.sequence_start is None:
+            self.sequence_start = block.addr
+        elif block.addr != self.wanted_addr:
+            sys.stderr.write("%08X - %08X\n" % (self.sequence_start, self.wanted_addr))
+            self.sequence_start = block.addr
+
+        self.wanted_addr = block.addr + datalen
+
+        assert datalen <= BLOCK_SIZE, "Block at %08X is too large" % block.addr
+
+        record = self.record
+
+        UF2_HEADER.pack_into(record, 0,
+            UF2_MAGIC_START0, UF2_MAGIC_START1,
+            block.flags, block.addr, datalen, self.blockno, self.total_blocks,
+            self.family)
+        self.blockno += 1
+
+        record[32:32 + datalen] = block.data
+
+        if datalen != BLOCK_SIZE:
+            record[32 + datalen:32 + BLOCK_SIZE] = bytes(BLOCK_SIZE - datalen)
+
+        self.output.write(record)
+
+    def close(self):
+        if self.blockno != self.total_blocks:
+            errmsg = ("Internal error: promised %d blocks but wrote %d" %
+                      (self.total_blocks, self.blockno))
+
+            assert False, errmsg
+
+        if self.sequence_start is not None:
+            sys.stderr.write("%08X - %08X\n" % (self.sequence_start, self.wanted_addr))
+
+
+class UF2Updater:
+    """
+    UF2Updater is a write-only file-like object that brings an existing UF2
+    file up to date: output arrives one flash page (16 records) at a time
+    and is compared with what's already in the file. The new file is
+    written next to the old one and only replaces it (atomically) on
+    close(), and only if some page actually changed, so a build that
+    changed nothing leaves the file -- and its mtime -- alone, and a build
+    that fails partway (see discard()) leaves the old file intact. If the
+    file doesn't exist yet, it's created.
+
+    Every UF2 record carries its block number and the total block count,
+    so if the number of pages changes, or a page appears or disappears
+    partway through, every record after that point changes too.
+    """
+
+    CHUNK_SIZE = BLOCKS_PER_PAGE * 512
+
+    def __init__(self, path):
+        self.path = path
+        self.existing = open(path, "rb") if os.path.exists(path) else None
+
+        fd, self.tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                        prefix="." + os.path.basename(path) + ".")
+        self.file = os.fdopen(fd, "wb")
+
+        self.pending = bytearray()
+        self.pages = 0
+        self.changed = 0
+
+    def write(self, data):
+        self.pending += data
+
+        if len(self.pending) >= self.CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+
+        existing = self.existing.read(len(self.pending)) if self.existing else b""
+
+        self.pages += 1
+
+        if existing != self.pending:
+            self.changed += 1
+
+        self.file.write(self.pending)
+        self.pending = bytearray()
+
+    def _cleanup(self):
+        self.file.close()
+
+        if self.existing:
+            self.existing.close()
+
+    def discard(self):
+        """
+        Give up: leave the existing file as it was.
+        """
+        self._cleanup()
+        os.unlink(self.tmp)
+
+    def close(self):
+        self._flush()
+
+        # The old file might have had more pages than the new one.
+        truncated = self.existing and self.existing.read(1)
+
+        self._cleanup()
+
+        if (self.existing is not None) and not (self.changed or truncated):
+            os.unlink(self.tmp)
+            sys.stderr.write("No pages changed in %s\n" % self.path)
+            return
+
+        if self.existing is not None:
+            shutil.copymode(self.path, self.tmp)
+
+        os.replace(self.tmp, self.path)
+
+        sys.stderr.write("Updated %d of %d pages in %s\n" % (self.changed, self.pages, self.path))
+
+
+def parse_inputs(args):
+    """
+    Turn command-line arguments into (addr, filename) pairs: addr is None for
+    a UF2 input, or the load address for a raw binary written as ADDR:FILE.
+    (ADDR:DIRECTORY is also allowed; see build_fat_images.)
+    """
+    inputs = []
+
+    for arg in args:
+        if ":" in arg:
+            addr, filename = arg.split(":", 1)
+            inputs.append((int(addr, 16), filename))
+        else:
+            inputs.append((None, arg))
+
+    return inputs
+
+
+def open_readers(inputs, mapped=True, announce=False):
+    readers = []
+
+    for addr, filename in inputs:
+        if addr is not None:
+            if announce:
+                sys.stderr.write("@%08X -- %s\n" % (addr, filename))
+
+            if isinstance(filename, ImageBuffer):
+                readers.append(BufferReader(filename.data, addr))
+            elif mapped:
+                readers.append(MappedBinaryReader(filename, addr))
+            else:
+                readers.append(BinaryReader(filename, addr))
+        else:
+            if announce:
+                sys.stderr.write("UF2 -- %s\n" % filename)
+
+            if mapped:
+                readers.append(MappedUF2Reader(filename))
+            else:
+                readers.append(UF2Reader(filename))
+
+    return readers
+
+
+def build_fat_images(inputs, size, label, boot_message, timestamp=None):
+    """
+    Replace every ADDR:DIRECTORY input with an ImageBuffer holding a FAT
+    image of that directory, built in memory. With timestamp set, the
+    images are reproducible (see FATImage).
+    """
+    result = []
+
+    for addr, filename in inputs:
+        if (addr is not None) and os.path.isdir(filename):
+            fat = FATImage(size, label=label, boot_message=boot_message, timestamp=timestamp)
+            fat.add_tree(filename)
+
+            description = "FAT%d image of %s (%s)" % (fat.fat_bits, filename, fat.label)
+            result.append((addr, ImageBuffer(description, fat.build())))
+        else:
+            result.append((addr, filename))
+
+    return result
+
+
+def buffered_pages(inputs, mapped=True):
+    pagemap = PageMap()
+
+    for reader in open_readers(inputs, mapped=mapped, announce=True):
+        for block in reader:
             pagemap.add_block(block)
 
-total_pages = 0
-blocks_to_write = []
+    return [ page for page in pagemap if not page.all_zeroes() ]
 
-for page in pagemap:
-    if not page.all_zeroes():
-        total_pages += 1
-        for block in page:
-            blocks_to_write.append(block)
 
-total_blocks = len(blocks_to_write)
+def streamed_pages(inputs, mapped=True, announce=False):
+    for page in PageStream(open_readers(inputs, mapped=mapped, announce=announce)):
+        if not page.all_zeroes():
+            yield page
 
-if total_blocks != (total_pages * BLOCKS_PER_PAGE):
-    errmsg = ("Internal error: should have %d blocks for %d pages but have %d" %
-              (total_pages * BLOCKS_PER_PAGE, total_pages, total_blocks))
 
-    assert False, errmsg
+def page_digests(path, mapped=True):
+    """
+    Return a dict mapping page base address to Page.digest() for every
+    nonzero page in a UF2 file.
+    """
+    return { page.baseaddr: page.digest()
+             for page in streamed_pages([ (None, path) ], mapped=mapped) }
 
-sys.stderr.write("Pages: %d\n" % total_pages)
-sys.stderr.write("Blocks: %d\n" % total_blocks)
 
-sequence_start = None
-last_addr = None
+def delta_pages(pages, previous):
+    """
+    Filter address-ordered pages down to the ones that differ from previous
+    (as returned by page_digests). Pages that previous had but that are now
+    gone (or all zeroes) come back as explicit zero pages: a delta image
+    doesn't erase anything first, so nothing else would overwrite them.
+    """
+    stale = sorted(previous.keys())
+    i = 0
 
-datapadding = b""
+    for page in pages:
+        while (i < len(stale)) and (stale[i] < page.baseaddr):
+            yield Page(stale[i])
+            i += 1
 
-while len(datapadding) < 512 - 256 - 32 - 4:
-    datapadding += b"\x00\x00\x00\x00"
+        if (i < len(stale)) and (stale[i] == page.baseaddr):
+            i += 1
 
-blockno = 0
+            if previous[page.baseaddr] == page.digest():
+                continue
 
-for block in blocks_to_write:
-    if sequence_start is None:
-        sequence_start = block.addr
-    else:
-        if block.addr != wanted_addr:
-            sys.stderr.write("%08X - %08X\n" % (sequence_start, wanted_addr))
-            sequence_start = block.addr
+        yield page
 
-    wanted_addr = block.addr + len(block.data)
+    while i < len(stale):
+        yield Page(stale[i])
+        i += 1
 
-    hd = struct.pack(b"<IIIIIIII",
-        UF2_MAGIC_START0, UF2_MAGIC_START1,
-        block.flags, block.addr, len(block.data), blockno, total_blocks, 0xE48BFF56)
-    blockno += 1
 
-    chunk = hd + block.data
+def write_pages(output, pages, total_pages):
+    total_blocks = total_pages * BLOCKS_PER_PAGE
 
-    if len(block.data) != 256:
-        chunk += b"\x00" * (256 - len(block.data))
+    sys.stderr.write("Pages: %d\n" % total_pages)
+    sys.stderr.write("Blocks: %d\n" % total_blocks)
 
-    chunk += datapadding + struct.pack(b"<I", UF2_MAGIC_END)
-    assert len(chunk) == 512
+    writer = UF2Writer(output, total_blocks)
 
-    sys.stdout.buffer.write(chunk)
+    for page in pages:
+        for block in page:
+            writer.write(block)
+
+    writer.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Combine UF2 files and raw images (as ADDR:FILE) into one UF2. "
+                    "ADDR:DIRECTORY builds a FAT image of DIRECTORY to use at ADDR.")
+    parser.add_argument("--buffered", action="store_true",
+                        help="load every block before writing (needed if inputs are out of order)")
+    parser.add_argument("--no-mmap", dest="mapped", action="store_false",
+                        help="read inputs with plain file reads rather than mmap")
+    parser.add_argument("--fat-size", default="8M",
+                        help="size of FAT images built from directories (default: 8M)")
+    parser.add_argument("--label", default="MACROPAW",
+                        help="volume label for FAT images built from directories")
+    parser.add_argument("--boot-message", default=None,
+                        help="boot sector message for FAT images built from directories")
+    parser.add_argument("--timestamp", type=int, default=source_date_epoch(),
+                        help="give every file in FAT images this Unix time, so that the same "
+                             "files always make the same image (default: $SOURCE_DATE_EPOCH, if set)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write to OUTPUT rather than stdout")
+    parser.add_argument("--update", action="store_true",
+                        help="compare with the existing OUTPUT, and leave it alone if nothing changed")
+    parser.add_argument("--delta-from", default=None, metavar="PREVIOUS",
+                        help="only include pages that differ from the UF2 file PREVIOUS")
+    parser.add_argument("inputs", nargs="+", metavar="INPUT")
+
+    args = parser.parse_args(argv)
+
+    if args.update and not args.output:
+        parser.error("--update needs --output")
+
+    inputs = build_fat_images(parse_inputs(args.inputs), parse_size(args.fat_size),
+                              args.label, args.boot_message, args.timestamp)
+
+    if args.update:
+        output = UF2Updater(args.output)
+    elif args.output:
+        output = open(args.output, "wb")
+    else:
+        output = sys.stdout.buffer
 
-if sequence_start != None:
-    sys.stderr.write("%08X - %08X\n" % (sequence_start, wanted_addr))
+    if args.delta_from:
+        # For a delta image, only keep pages that changed since PREVIOUS.
+        sys.stderr.write("Delta from %s\n" % args.delta_from)
+        previous = page_digests(args.delta_from, mapped=args.mapped)
+        select = lambda pages: delta_pages(pages, previous)
+    else:
+        select = lambda pages: pages
+
+    try:
+        if args.buffered:
+            # The original approach: load everything, then write everything.
+            pages = list(select(buffered_pages(inputs, mapped=args.mapped)))
+            write_pages(output, pages, len(pages))
+        else:
+            # Every UF2 record carries the total block count, so make one
+            # cheap pass to count the pages we'll keep, then a second pass to
+            # write them. Either way, we only ever hold a single page in
+            # memory.
+            total_pages = sum(1 for _ in select(streamed_pages(inputs, mapped=args.mapped, announce=True)))
+            write_pages(output, select(streamed_pages(inputs, mapped=args.mapped)), total_pages)
+    except BaseException:
+        if isinstance(output, UF2Updater):
+            output.discard()
+
+        raise
+
+    if output is not sys.stdout.buffer:
+        output.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+import os
+import sys
+
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hostsim
+
+hostsim.install()
+
+import board
+
+from adafruit_neopixelbackground import NeoPixelBackground
+from ledstrips import LEDStrips
+from pixelslice import PixelSlice
+
+KNGXT_MATRIX = [ 0, 5, 10, 1, 6, 11, 2, 7, 12, 3, 8, 13, 4, 9 ]
+
+# A color whose targets all have a fraction to spread out.
+COLOR = (127, 100, 33)
+
+FRAMES = 200
+
+
+class DitheringTest(unittest.TestCase):
+    """
+    A dithered view's error has to advance once per frame that actually
+    goes out, however often it's shown, so that the frames sent average
+    out to its targets.
+    """
+
+    def setUp(self):
+        hostsim.reset()
+
+    def run_loops(self, pixels, view, shows):
+        # Like KMK's main loop: an effect redraws the view, shows it (more
+        # than once, on the KnGXT), and PixelFlusher flushes. The LEDs are
+        # much slower than the loop, so most flushes can't send anything.
+        while len(hostsim.frames()) < FRAMES:
+            view.fill(COLOR)
+
+            for _ in range(shows):
+                view.show()
+
+            pixels.flush()
+
+    def assertAverages(self, view, strips):
+        # Every frame each strip sent, for the bytes the view covers, must
+        # add up to what the targets say, to within the error still carried.
+        for c in range(3):
+            fine = view.parent.fine_luts[c][COLOR[c]]
+
+            for k in range(len(view)):
+                index = view.offset + view.mapping[k]
+
+                if isinstance(view.parent, LEDStrips):
+                    s, index = view.parent._locate(index)
+                else:
+                    s = 0
+
+                strip = strips[s]
+                i = (index * strip.bpp) + strip.byteorder.index("RGB"[c])
+                sent = [ f.data[i] for f in strip._sm.frames ]
+
+                self.assertLessEqual(abs((sum(sent) * 256) - (len(sent) * fine)), 255,
+                                     "pixel %d channel %d: %d frames averaged %.3f, not %.3f" %
+                                     (k, c, len(sent), sum(sent) / len(sent), fine / 256))
+
+    def test_kngxt(self):
+        pixels = NeoPixelBackground(board.NEOPIXEL, 30, pixel_order="GRB", auto_write=False,
+                                    deferred=True, double_buffer=True, brightness=0.1875, gamma=2.2)
+        view = PixelSlice(pixels, 16, 14, mapping=KNGXT_MATRIX, dither=True)
+
+        for shows in (1, 2, 5):
+            with self.subTest(shows=shows):
+                hostsim.reset()
+                view._errors[:] = bytes(len(view._errors))
+
+                self.run_loops(pixels, view, shows)
+                self.assertAverages(view, [ pixels ])
+
+        pixels.deinit()
+
+    def test_not_deferred(self):
+        # Every show() sends a frame, so every show() renders one.
+        pixels = NeoPixelBackground(board.NEOPIXEL, 10, pixel_order="GRB", auto_write=False,
+                                    brightness=0.1875, gamma=2.2)
+        view = PixelSlice(pixels, 0, 10, dither=True)
+
+        self.run_loops(pixels, view, 2)
+        self.assertAverages(view, [ pixels ])
+
+        pixels.deinit()
+
+    def test_strips(self):
+        strips = LEDStrips([ (getattr(board, "LED%d" % i), 4) for i in range(3) ],
+                           pixel_order="GRB", double_buffer=True, brightness=0.1875, gamma=2.2)
+        view = PixelSlice(strips, 2, 8, mapping=[ 7, 6, 5, 4, 3, 2, 1, 0 ], dither=True)
+
+        self.run_loops(strips, view, 2)
+        self.assertAverages(view, strips.strips)
+
+        strips.deinit()
+
+    def test_idle(self):
+        # With nothing new drawn and no fraction to spread out (black
+        # has none), nothing more is sent.
+        pixels = NeoPixelBackground(board.NEOPIXEL, 10, pixel_order="GRB", auto_write=False,
+                                    deferred=True, brightness=0.1875, gamma=2.2)
+        view = PixelSlice(pixels, 0, 10, dither=True)
+
+        view.fill((0, 0, 0))
+        pixels.flush(wait=True)
+        pixels.flush(wait=True)
+
+        self.assertEqual(len(hostsim.frames()), 1)
+
+        pixels.deinit()
+
+    def test_needs_tables(self):
+        pixels = NeoPixelBackground(board.NEOPIXEL, 10, auto_write=False, brightness=0.125)
+
+        with self.assertRaises(ValueError):
+            PixelSlice(pixels, 0, 10, dither=True)
+
+        pixels.deinit()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import sys
+
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hostsim
+
+hostsim.install()
+
+import board
+
+from adafruit_neopixelbackground import NeoPixelBackground
+from ledstrips import LEDStrips
+
+
+class LEDStripsTest(unittest.TestCase):
+    """
+    Four strips of 4 LEDs, numbered 0-15 across all of them, with no
+    brightness scaling so that what's sent is what was written.
+    """
+
+    def setUp(self):
+        hostsim.reset()
+
+        self.strips = LEDStrips([ (getattr(board, "LED%d" % i), 4) for i in range(4) ],
+                                pixel_order="RGB")
+
+    def tearDown(self):
+        self.strips.deinit()
+
+    def sent(self):
+        # The last frame each strip sent, as one tuple of colors per LED
+        # across all the strips.
+        colors = []
+
+        for strip in self.strips.strips:
+            data = strip._sm.frames[-1].data
+            colors.extend(tuple(data[i:i + 3]) for i in range(0, len(data), 3))
+
+        return colors
+
+    def push(self):
+        self.strips.show()
+        self.strips.flush()
+
+    def test_one_flush_sends_every_strip(self):
+        self.strips.fill((1, 2, 3))
+        self.strips.show()
+
+        self.assertEqual(hostsim.frames(), [])
+
+        self.strips.flush()
+
+        self.assertEqual([ f.sm for f in hostsim.frames() ],
+                         [ s._sm for s in self.strips.strips ])
+        self.assertEqual(self.sent(), [ (1, 2, 3) ] * 16)
+
+    def test_only_written_strips_send(self):
+        self.strips.fill((0, 0, 0))
+        self.push()
+        hostsim.reset()
+
+        self.strips[9] = (9, 9, 9)
+        self.push()
+
+        self.assertEqual([ f.sm for f in hostsim.frames() ], [ self.strips.strips[2]._sm ])
+
+    def test_view_across_strips(self):
+        view = self.strips.view(2, 8, mapping=[ 7, 6, 5, 4, 3, 2, 1, 0 ])
+
+        self.strips.fill((0, 0, 0))
+        view.write_frame([ (k, k, k) for k in range(8) ])
+        view.show()
+        self.strips.flush()
+
+        self.assertEqual(self.sent(),
+                         [ (0, 0, 0) ] * 2 + [ (k, k, k) for k in range(7, -1, -1) ] + [ (0, 0, 0) ] * 6)
+
+    def test_slices(self):
+        colors = [ (k, k, k) for k in range(16) ]
+
+        for k in (slice(None), slice(3, 14), slice(1, 15, 3), slice(None, None, -1),
+                  slice(13, 2, -2), slice(-5, None)):
+            with self.subTest(k=k):
+                self.strips.fill((0, 0, 0))
+                self.strips[k] = colors[k]
+
+                self.assertEqual(list(self.strips[k]), colors[k])
+
+                flat = [ c for color in colors[k] for c in color ]
+                self.strips.fill((0, 0, 0))
+                self.strips[k] = flat
+
+                self.assertEqual(list(self.strips[k]), colors[k])
+
+    def test_out_of_range(self):
+        with self.assertRaises(KeyError):
+            self.strips[16] = (1, 1, 1)
+
+        with self.assertRaises(ValueError):
+            self.strips[0:4] = [ (1, 1, 1) ] * 3
+
+    def test_brightness(self):
+        strips = LEDStrips([ (board.LED4, 4), (board.LED5, 4) ], brightness=0.1875, gamma=2.2)
+        expected = NeoPixelBackground(board.LED6, 4, brightness=0.5, gamma=2.2, auto_write=False)
+
+        try:
+            strips.brightness = 0.5
+
+            self.assertEqual(strips.brightness, 0.5)
+
+            for strip in strips.strips:
+                self.assertEqual(strip.luts, expected.luts)
+        finally:
+            strips.deinit()
+            expected.deinit()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import sys
+
+import itertools
+import tracemalloc
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hostsim
+
+hostsim.install()
+
+import board
+import rp2pio
+
+import adafruit_neopixelbackground
+
+from adafruit_neopixelbackground import NeoPixelBackground
+
+# Each of the ways the boards run NeoPixelBackground without auto_write.
+MODES = {
+    "plain": dict(),
+    "deferred": dict(deferred=True),
+    "double-buffered": dict(deferred=True, double_buffer=True),
+    "lookup tables": dict(deferred=True, double_buffer=True, gamma=2.2),
+}
+
+PUSHES = 1000
+
+
+def run(fn, n):
+    for _ in itertools.repeat(None, n):
+        fn()
+
+
+def nothing():
+    pass
+
+
+class TransmitAllocationTest(unittest.TestCase):
+    """
+    Pushing a frame -- show() and flush() on a warmed-up NeoPixelBackground
+    -- mustn't allocate anything, since on the device every allocation in
+    the scan loop is more work for the garbage collector.
+    """
+
+    def setUp(self):
+        rp2pio.recording = False
+        rp2pio.timing = False
+
+    def tearDown(self):
+        rp2pio.recording = True
+        rp2pio.timing = True
+
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def pusher(self, **kwargs):
+        pixels = NeoPixelBackground(board.NEOPIXEL, 30, pixel_order="GRB", auto_write=False,
+                                    brightness=0.125, **kwargs)
+        pixels.fill((1, 2, 3))
+
+        show = pixels.show
+        flush = pixels.flush
+
+        def push():
+            show()
+            flush()
+
+        # Warm up: the first frame sets up the cached views.
+        run(push, 10)
+
+        return push
+
+    def peak(self, fn):
+        # Bytes allocated at peak while running fn PUSHES times.
+        tracemalloc.start()
+        run(fn, 10)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run(fn, PUSHES)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        return peak
+
+    def test_nothing_retained(self):
+        # Nothing allocated in adafruit_neopixelbackground.py survives a push.
+        only_driver = [ tracemalloc.Filter(True, adafruit_neopixelbackground.__file__) ]
+
+        for mode, kwargs in MODES.items():
+            with self.subTest(mode=mode):
+                push = self.pusher(**kwargs)
+
+                tracemalloc.start()
+                before = tracemalloc.take_snapshot().filter_traces(only_driver)
+                run(push, PUSHES)
+                after = tracemalloc.take_snapshot().filter_traces(only_driver)
+                tracemalloc.stop()
+
+                grown = [ stat for stat in after.compare_to(before, "lineno") if stat.size_diff > 0 ]
+
+                self.assertEqual(grown, [], "%s: allocations left behind" % mode)
+
+    def test_nothing_allocated(self):
+        # Nor does a push allocate anything even for a moment (a snapshot
+        # can't see that, but the peak can), over and above what the loop
+        # costs on its own.
+        baseline = self.peak(nothing)
+
+        for mode, kwargs in MODES.items():
+            with self.subTest(mode=mode):
+                allocated = self.peak(self.pusher(**kwargs)) - baseline
+
+                self.assertLessEqual(allocated, 0, "%s: %d bytes allocated" % (mode, allocated))
+
+
+class LookupTableTest(unittest.TestCase):
+    """
+    With gamma set, brightness lives in the lookup tables, so changing it
+    has to rebuild them without losing the gamma.
+    """
+
+    def pixels(self, **kwargs):
+        return NeoPixelBackground(board.NEOPIXEL, 4, pixel_order="GRB", auto_write=False, **kwargs)
+
+    def test_brightness_keeps_gamma(self):
+        pixels = self.pixels(brightness=0.1875, gamma=2.2)
+        expected = self.pixels(brightness=0.5, gamma=2.2)
+
+        pixels.brightness = 0.5
+
+        self.assertEqual(pixels.brightness, 0.5)
+        self.assertEqual(pixels.luts, expected.luts)
+
+    def test_set_lut_keeps_gamma(self):
+        pixels = self.pixels(brightness=0.1875, gamma=2.2)
+        expected = self.pixels(brightness=0.125, gamma=2.2)
+
+        pixels.set_lut(0.125)
+
+        self.assertEqual(pixels.luts, expected.luts)
+
+    def test_set_lut_new_gamma(self):
+        pixels = self.pixels(brightness=0.1875, gamma=2.2)
+
+        pixels.set_lut(0.125, gamma=1.0)
+        pixels.brightness = 0.25
+
+        self.assertEqual(pixels.luts[0][128], 32)
+
+    def test_without_tables(self):
+        pixels = self.pixels(brightness=0.125)
+
+        self.assertEqual(pixels.brightness, 0.125)
+
+        with self.assertRaises(ValueError):
+            pixels.set_lut(0.5)
+
+        with self.assertRaises(ValueError):
+            pixels.brightness = 0.5
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,363 @@
+import sys
+
+import argparse
+import hashlib
+import struct
+
+from mkfat import ATTR_DIRECTORY, ATTR_LFN, ATTR_VOLUME_ID, DIRENT_SIZE
+from mkuf2 import BLOCK_SIZE, PAGE_SIZE, PageStream, open_readers, parse_inputs
+
+# uf2info indexes the flash pages in a UF2 file (or a raw image given as
+# ADDR:FILE, as with mkuf2.py) and tells you what's in them:
+#
+#   uf2info.py index IMAGE      every page: address, hash, family, owners
+#   uf2info.py files IMAGE      flash cost of every file in the filesystem
+#   uf2info.py diff OLD NEW     which pages (and files) changed
+#
+# "Owners" are the files in the CIRCUITPY FAT filesystem (at 0x10100000 by
+# default) whose clusters live in a page, plus FAT metadata like the boot
+# sector, the FATs, and directories.
+
+DEFAULT_FAT_BASE = 0x10100000
+
+# Owner names for the parts of the filesystem that aren't files.
+OWNER_BOOT = "(boot sector)"
+OWNER_FAT = "(FAT)"
+OWNER_ROOT = "(root directory)"
+OWNER_FIRMWARE = "(firmware)"
+
+
+class PageInfo:
+    def __init__(self, addr, digest, family, data):
+        self.addr = addr
+        self.digest = digest
+        self.family = family
+        self.data = data
+
+        # owners lists who has anything in this page, in the order we found
+        # them; held maps each of them to how many bytes of the page are
+        # theirs.
+        self.owners = []
+        self.held = {}
+
+
+class FATReader:
+    """
+    FATReader walks a FAT12/16 volume held in a sparse dict of pages and
+    works out which file or structure owns each byte range of it. It only
+    reads what it needs: the boot sector, the FAT, and the directories.
+    """
+
+    def __init__(self, pages, base):
+        self.pages = pages
+        self.base = base
+
+        boot = self.read(0, 512)
+
+        (self.sector_size, self.sectors_per_cluster, reserved, self.num_fats,
+         self.root_entries, total16, _, self.fat_sectors) = struct.unpack_from("<HBHBHHBH", boot, 11)
+        total32 = struct.unpack_from("<I", boot, 32)[0]
+
+        if (boot[510:512] != b"\x55\xAA") or (self.sector_size not in (512, 1024, 2048, 4096)):
+            raise ValueError("No FAT filesystem at %08X" % base)
+
+        self.total_sectors = total16 or total32
+        self.cluster_size = self.sector_size * self.sectors_per_cluster
+
+        self.fat_offset = reserved * self.sector_size
+        self.root_offset = self.fat_offset + (self.num_fats * self.fat_sectors * self.sector_size)
+        self.data_offset = self.root_offset + (self.root_entries * DIRENT_SIZE)
+
+        clusters = ((self.total_sectors * self.sector_size) - self.data_offset) // self.cluster_size
+        self.fat_bits = 12 if clusters <= 4084 else 16
+
+        self.size = self.total_sectors * self.sector_size
+        self.fat = self.read(self.fat_offset, self.fat_sectors * self.sector_size)
+
+    def read(self, offset, length):
+        """
+        Read bytes from the volume; anything not in a page reads as zero.
+        """
+        out = bytearray()
+
+        while length > 0:
+            addr = self.base + offset
+            page_base = addr - (addr % PAGE_SIZE)
+            start = addr - page_base
+            count = min(length, PAGE_SIZE - start)
+
+            page = self.pages.get(page_base)
+            out += page.data[start:start + count] if page else bytes(count)
+
+            offset += count
+            length -= count
+
+        return bytes(out)
+
+    def next_cluster(self, cluster):
+        if self.fat_bits == 16:
+            value = struct.unpack_from("<H", self.fat, cluster * 2)[0]
+            return None if value >= 0xFFF8 else value
+
+        offset = cluster + (cluster // 2)
+        value = struct.unpack_from("<H", self.fat, offset)[0]
+        value = (value >> 4) if (cluster & 1) else (value & 0x0FFF)
+
+        return None if value >= 0xFF8 else value
+
+    def chain(self, cluster):
+        seen = set()
+
+        while (cluster is not None) and (cluster >= 2) and (cluster not in seen):
+            seen.add(cluster)
+            yield cluster
+            cluster = self.next_cluster(cluster)
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + ((cluster - 2) * self.cluster_size)
+
+    def entries(self, data):
+        """
+        Yield (name, attr, first_cluster, size) for each entry in a chunk of
+        directory data, reassembling long names as we go.
+        """
+        lfn = {}
+
+        for offset in range(0, len(data) - DIRENT_SIZE + 1, DIRENT_SIZE):
+            entry = data[offset:offset + DIRENT_SIZE]
+
+            if entry[0] == 0x00:
+                break
+
+            if entry[0] == 0xE5:
+                lfn = {}
+                continue
+
+            attr = entry[11]
+
+            if attr == ATTR_LFN:
+                seq = entry[0] & 0x1F
+                units = entry[1:11] + entry[14:26] + entry[28:32]
+                lfn[seq] = units
+                continue
+
+            if attr & ATTR_VOLUME_ID:
+                lfn = {}
+                continue
+
+            if lfn:
+                units = b"".join(lfn[k] for k in sorted(lfn))
+                name = units.decode("utf-16-le", "replace")
+                name = name.split("\x00", 1)[0]
+                lfn = {}
+            else:
+                base = entry[0:8].decode("ascii", "replace").rstrip()
+                ext = entry[8:11].decode("ascii", "replace").rstrip()
+                name = base + ("." + ext if ext else "")
+
+            if name in (".", ".."):
+                continue
+
+            first_cluster, size = struct.unpack_from("<HI", entry, 26)
+            yield name, attr, first_cluster, size
+
+    def extents(self):
+        """
+        Yield (owner, offset, length) for every allocated region of the
+        volume.
+        """
+        yield OWNER_BOOT, 0, self.fat_offset
+        yield OWNER_FAT, self.fat_offset, self.root_offset - self.fat_offset
+        yield OWNER_ROOT, self.root_offset, self.data_offset - self.root_offset
+
+        pending = [ ("", self.read(self.root_offset, self.data_offset - self.root_offset)) ]
+
+        while pending:
+            path, data = pending.pop()
+
+            for name, attr, first_cluster, size in self.entries(data):
+                full = path + "/" + name
+                clusters = list(self.chain(first_cluster))
+
+                if attr & ATTR_DIRECTORY:
+                    full += "/"
+                    contents = b"".join(self.read(self.cluster_offset(c), self.cluster_size)
+                                        for c in clusters)
+                    pending.append((full.rstrip("/"), contents))
+
+                for c in clusters:
+                    yield full, self.cluster_offset(c), self.cluster_size
+
+
+def index_image(spec, fat_base=DEFAULT_FAT_BASE):
+    """
+    Build the page index for a UF2 file or ADDR:FILE raw image: a dict
+    mapping page address to PageInfo, with owners filled in.
+    """
+    pages = {}
+
+    for page in PageStream(open_readers(parse_inputs([ spec ]))):
+        data = bytearray(PAGE_SIZE)
+        family = None
+
+        for i, block in enumerate(page.blocks):
+            if block is not None:
+                data[i * BLOCK_SIZE:i * BLOCK_SIZE + len(block.data)] = block.data
+                family = family if family is not None else block.family
+
+        pages[page.baseaddr] = PageInfo(page.baseaddr, hashlib.sha256(data).hexdigest(),
+                                        family, bytes(data))
+
+    fat = None
+
+    if fat_base in pages:
+        try:
+            fat = FATReader(pages, fat_base)
+        except (ValueError, struct.error):
+            fat = None
+
+    if fat is not None:
+        for owner, offset, length in fat.extents():
+            first = (fat_base + offset) // PAGE_SIZE
+            last = (fat_base + offset + length - 1) // PAGE_SIZE
+
+            for n in range(first, last + 1):
+                info = pages.get(n * PAGE_SIZE)
+
+                if info is None:
+                    continue
+
+                start = max(fat_base + offset, info.addr)
+                end = min(fat_base + offset + length, info.addr + PAGE_SIZE)
+
+                if owner not in info.owners:
+                    info.owners.append(owner)
+
+                info.held[owner] = info.held.get(owner, 0) + (end - start)
+
+    for info in pages.values():
+        if (info.addr < fat_base) and not info.owners:
+            info.owners.append(OWNER_FIRMWARE)
+            info.held[OWNER_FIRMWARE] = PAGE_SIZE
+
+    return pages
+
+
+class FileCost:
+    def __init__(self):
+        self.pages = []     # addresses of every page holding any of it
+        self.flash = 0      # its share of those pages, in bytes
+        self.held = 0       # bytes of clusters (etc.) it actually occupies
+
+
+def file_costs(pages):
+    """
+    Return a dict mapping owner to FileCost over an index. A page shared by
+    several owners is split between them in proportion to how much of it
+    each one holds, so the flash bytes of every owner add up to the flash
+    bytes of every owned page.
+    """
+    costs = {}
+
+    for info in pages.values():
+        total = sum(info.held.values())
+
+        for owner in info.owners:
+            cost = costs.setdefault(owner, FileCost())
+            held = info.held.get(owner, 0)
+
+            cost.pages.append(info.addr)
+            cost.held += held
+            cost.flash += (PAGE_SIZE * held / total) if total else (PAGE_SIZE / len(info.owners))
+
+    return costs
+
+
+def cmd_index(args):
+    pages = index_image(args.image, args.fat_base)
+
+    for addr in sorted(pages.keys()):
+        info = pages[addr]
+        family = "%08X" % info.family if info.family is not None else "-"
+
+        print("%08X  %s  %s  %s" % (addr, info.digest[:16], family, ", ".join(info.owners)))
+
+    print("%d pages, %d bytes of flash" % (len(pages), len(pages) * PAGE_SIZE))
+
+
+def cmd_files(args):
+    costs = file_costs(index_image(args.image, args.fat_base))
+
+    # Pages counts every page an owner touches, so shared pages count more
+    # than once there; Flash is the owner's share of them, which does add
+    # up; Held is what it takes up in the filesystem, cluster slack
+    # included.
+    print("%8s %10s %10s  %s" % ("Pages", "Flash", "Held", "Owner"))
+
+    for owner, cost in sorted(costs.items(), key=lambda kv: (-kv[1].flash, kv[0])):
+        print("%8d %10.0f %10d  %s" % (len(cost.pages), cost.flash, cost.held, owner))
+
+    print("%8s %10.0f %10d  total" % ("", sum(c.flash for c in costs.values()),
+                                      sum(c.held for c in costs.values())))
+
+
+def cmd_diff(args):
+    old = index_image(args.old, args.fat_base)
+    new = index_image(args.new, args.fat_base)
+
+    added = set(a for a in new if a not in old)
+    removed = set(a for a in old if a not in new)
+    changed = set(a for a in new if (a in old) and (old[a].digest != new[a].digest))
+
+    touched = {}
+
+    for addr in sorted(added | removed | changed):
+        if addr in added:
+            kind, info = "+", new[addr]
+        elif addr in removed:
+            kind, info = "-", old[addr]
+        else:
+            kind, info = "~", new[addr]
+
+        print("%s %08X  %s" % (kind, addr, ", ".join(info.owners)))
+
+        for owner in info.owners:
+            touched[owner] = touched.get(owner, 0) + 1
+
+    print("%d added, %d removed, %d changed, %d unchanged" %
+          (len(added), len(removed), len(changed), len(new) - len(added) - len(changed)))
+
+    if touched:
+        print()
+        print("%8s  %s" % ("Pages", "Owner"))
+
+        for owner, count in sorted(touched.items(), key=lambda kv: (-kv[1], kv[0])):
+            print("%8d  %s" % (count, owner))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Index, summarize, and diff UF2 files.")
+    parser.add_argument("--fat-base", type=lambda s: int(s, 16), default=DEFAULT_FAT_BASE,
+                        help="flash address of the FAT filesystem (default: %08X)" % DEFAULT_FAT_BASE)
+
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="list every page with its hash, family, and owners")
+    p.add_argument("image", help="UF2 file, or ADDR:FILE for a raw image")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("files", help="summarize how much flash each file costs")
+    p.add_argument("image", help="UF2 file, or ADDR:FILE for a raw image")
+    p.set_defaults(func=cmd_files)
+
+    p = sub.add_parser("diff", help="show which pages differ between two images")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.set_defaults(func=cmd_diff)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])